@@ -96,12 +96,53 @@ except (KeyError, ValueError):
     USE_BIGINT = ''
 
 
-if USE_BIGINT:
+if USE_BIGINT == 'hybrid':
+    from aheui.int import hybridint as bigint  # Machine int promoted to bigint on overflow
+elif USE_BIGINT:
     from aheui.int import bigint  # Enable bigint in rpython build
 else:
     from aheui.int import smallint as bigint  # noqa: F401 smallint or python support
 
 try:
-    from aheui.storage.linkedlist import Stack, Queue, Port
-except ImportError:
-    from aheui.storage.array import Stack, Queue, Port  # noqa: F401 smallint or python support
+    USE_STORAGE = os.environ["RPAHEUI_STORAGE"]
+except (KeyError, ValueError):
+    USE_STORAGE = ''
+
+
+if USE_STORAGE == 'contiguous':
+    from aheui.storage.contiguous import Stack, Queue, Port, CountedStack, CountedQueue, CountedPort  # Array and ring buffer storages
+else:
+    try:
+        from aheui.storage.linkedlist import Stack, Queue, Port, CountedStack, CountedQueue, CountedPort
+    except ImportError:
+        from aheui.storage.array import Stack, Queue, Port, CountedStack, CountedQueue, CountedPort  # noqa: F401 smallint or python support
+
+
+if PYR:
+    from rpython.rlib.rmd5 import RMD5
+
+    def md5_hexdigest(data):
+        return RMD5(data).hexdigest()
+else:
+    import hashlib
+
+    def md5_hexdigest(data):
+        return hashlib.md5(data).hexdigest()
+
+
+if PYR:
+    def mmap_input(fd):
+        """Memory mapped input is not supported in RPython build."""
+        return None
+else:
+    import mmap
+    import stat
+
+    def mmap_input(fd):
+        """Map `fd` if it is a non-empty regular file, otherwise None."""
+        try:
+            if not stat.S_ISREG(os.fstat(fd).st_mode):
+                return None
+            return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError):
+            return None
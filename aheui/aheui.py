@@ -7,8 +7,15 @@ import os
 
 from aheui import const as c
 from aheui._argparse import InformationException, get_prog
-from aheui._compat import jit, unichr, ord, _unicode, bigint, PYR, Stack, Queue, Port
+from aheui._compat import jit, unichr, ord, _unicode, bigint, mmap_input, PYR, Stack, Queue, Port, \
+    CountedStack, CountedQueue, CountedPort
+from aheui import bytecode
+from aheui import cache
 from aheui import compile
+from aheui import register
+from aheui import stats
+from aheui.profile import Profile
+from aheui import transpile
 from aheui.option import process_options, OptionError
 from aheui.warning import NoRpythonWarning, WriteUtf8RangeWarning, warnings
 
@@ -27,7 +34,12 @@ def get_location(pc, stackok, is_queue, program):
 
 driver = jit.JitDriver(
     greens=['pc', 'stackok', 'is_queue', 'program'],
-    reds=['stacksize', 'storage', 'selected'],
+    reds=['stacksize', 'storage', 'selected', 'selected_idx', 'io'],
+    get_printable_location=get_location)
+
+profile_driver = jit.JitDriver(
+    greens=['pc', 'stackok', 'is_queue', 'program'],
+    reds=['stacksize', 'storage', 'selected', 'selected_idx', 'io'],
     get_printable_location=get_location)
 
 
@@ -35,47 +47,232 @@ DEBUG = False  # debug flag for `rpaheui`
 
 
 class Storage(object):
-    _immutable_fields = ['pools[*]']
+    _immutable_fields_ = ['pools[*]', 'stacks[*]']
 
-    def __init__(self):
+    def __init__(self, counted=False):
+        """If `counted`, the storages count pushes for `stats`."""
         pools = []
+        stacks = []  # pools typed as stacks for specialized operations
         for i in range(0, c.STORAGE_COUNT):
             if i == c.VAL_QUEUE:
-                pools.append(Queue())
+                pools.append(CountedQueue() if counted else Queue())
+                stacks.append(None)
             elif i == c.VAL_PORT:
-                pools.append(Port())
+                pools.append(CountedPort() if counted else Port())
+                stacks.append(None)
             else:
-                pools.append(Stack())
+                stack = CountedStack() if counted else Stack()
+                pools.append(stack)
+                stacks.append(stack)
         self.pools = pools
+        self.stacks = stacks
+        # Sizes of the storages tracked by `mainloop`. The size of the
+        # selected storage is kept in `stacksize` until the next `OP_SEL`.
+        self.sizes = [0] * c.STORAGE_COUNT
 
     def __getitem__(self, idx):
         return self.pools[idx]
 
 
 class InputBuffer(object):
+    """Read the input in blocks and consume it with a cursor.
 
-    def __init__(self, read=os.read):
-        self.buf = b''
+    The unread bytes are `buf[pos:]`. They are compacted only when the
+    buffer is refilled. If the input is a regular file, the whole file is
+    memory mapped instead when it is supported.
+    """
+
+    def __init__(self, fd=0, read=os.read, block_size=65536):
+        self.fd = fd
         self.read = read
+        self.block_size = block_size
+        self.buf = b''
+        self.pos = 0
+        self.mapped = False
+        self.map_checked = False
+        # ready queue of numbers scanned ahead from `buf[pos:]`
+        self.numbers = []
+        self.number_lengths = []
+        self.number_index = 0
 
     def load(self, length):
-        read_length = length - len(self.buf)
-        if read_length > 0:
-            self.buf += self.read(0, read_length)
+        if len(self.buf) - self.pos >= length:
+            return
+        if not self.map_checked:
+            self.map_checked = True
+            mapped = mmap_input(self.fd)
+            if mapped is not None:
+                self.buf = mapped
+                self.pos = os.lseek(self.fd, 0, os.SEEK_CUR)
+                self.mapped = True
+        if self.mapped:
+            return
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        while len(self.buf) < length:
+            data = self.read(self.fd, self.block_size)
+            if not data:
+                break
+            self.buf += data
 
     def take(self, length):
-        result, self.buf = self.buf[:length], self.buf[length:]
+        start = self.pos
+        result = self.buf[start:start + length]
+        self.pos = start + len(result)
         return result
 
     def look(self, length):
-        return self.buf[:length]
+        start = self.pos
+        return self.buf[start:start + length]
+
+    def scan_numbers(self, limit=4096):
+        """Parse the buffered tokens of `read_number` ahead into the queue.
+
+        A token is an optional `-`, digits and an optional delimiter of
+        space, tab or newline. Scanning stops before anything else, including
+        a token which may continue after the end of the buffer. Those are
+        left to the byte-by-byte path of `read_number`.
+        """
+        buf = self.buf
+        size = len(buf)
+        numbers = []
+        lengths = []
+        start = self.pos
+        while len(numbers) < limit:
+            idx = start
+            if idx < size and ord(buf[idx]) == 0x2d:  # -
+                idx += 1
+            digit_start = idx
+            value = 0
+            while idx < size:
+                digit = ord(buf[idx]) - 0x30
+                if digit < 0 or digit > 9:
+                    break
+                value = value * 10 + digit if idx - digit_start < 18 else 0
+                idx += 1
+            if idx == digit_start or idx >= size:
+                break
+            if idx - digit_start <= 18:
+                if digit_start > start:
+                    value = -value
+                number = bigint.fromint(value)
+            else:
+                number = bigint.fromstr(buf[start:idx])
+            delimiter = ord(buf[idx])
+            if delimiter == 0x20 or delimiter == 0x09 or delimiter == 0x0a:
+                idx += 1
+            numbers.append(number)
+            lengths.append(idx - start)
+            start = idx
+        self.numbers = numbers
+        self.number_lengths = lengths
+        self.number_index = 0
+
+    def has_number(self):
+        """Check if a number is ready, scanning ahead if the queue is empty."""
+        if self.number_index >= len(self.numbers):
+            self.load(1)
+            self.scan_numbers()
+        return self.number_index < len(self.numbers)
+
+    def take_number(self):
+        """Pop a number from the ready queue.
+
+        `has_number` must be checked first.
+        """
+        idx = self.number_index
+        self.number_index = idx + 1
+        self.pos += self.number_lengths[idx]
+        return self.numbers[idx]
+
+    def drop_numbers(self):
+        if self.numbers:
+            self.numbers = []
+            self.number_lengths = []
+            self.number_index = 0
 
 
 input_buffer = InputBuffer()
 
 
+def read_nothing(fd, length):
+    return b''
+
+
+class MemoryInputBuffer(InputBuffer):
+    """Input buffer over bytes in memory."""
+
+    def __init__(self, data):
+        InputBuffer.__init__(self, -1, read_nothing)
+        self.buf = data
+        self.map_checked = True
+
+
+class OutputBuffer(object):
+    """Collect output bytes to reduce `write` system calls.
+
+    `mode` is one of `line` and `full`. In `line` mode, the buffer is
+    flushed when a newline is written. In any mode, it is flushed when it
+    grows up to `threshold`. Callers flush it before reading input and at
+    exit.
+    """
+
+    def __init__(self, fd=1, mode='full', threshold=65536, write=os.write):
+        self.fd = fd
+        self.mode = mode
+        self.threshold = threshold
+        self.write_fd = write
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.size >= self.threshold or (self.mode == 'line' and data.find(b'\n') >= 0):
+            self.flush()
+
+    def flush(self):
+        if self.size == 0:
+            return
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        while data:
+            written = self.write_fd(self.fd, data)
+            data = data[written:]
+
+
+output_buffer = OutputBuffer()
+
+
+class MemoryOutputBuffer(OutputBuffer):
+    """Output buffer which keeps every written byte in memory."""
+
+    def __init__(self):
+        OutputBuffer.__init__(self, -1, 'full')
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return b''.join(self.chunks)
+
+
+class IO(object):
+    """Input and output buffers of a run."""
+
+    _immutable_fields_ = ['input', 'output']
+
+    def __init__(self, input, output):
+        self.input = input
+        self.output = output
+
+
+stdio = IO(input_buffer, output_buffer)
+
+
 @jit.dont_look_inside
-def read_utf8(input_buffer=input_buffer):
+def read_utf8(input_buffer=input_buffer, output_buffer=output_buffer):
     """Get a utf-8 character from standard input.
 
     The length of a UTF-8 character can be detected in the first byte.
@@ -83,6 +280,8 @@ def read_utf8(input_buffer=input_buffer):
     In Aheui, non-UTF-8 character input is undefined.
     In this implementation, let's assign -1.
     """
+    output_buffer.flush()
+    input_buffer.drop_numbers()
     input_buffer.load(1)
     head = input_buffer.look(1)
     if head:
@@ -116,8 +315,11 @@ def read_utf8(input_buffer=input_buffer):
 
 
 @jit.dont_look_inside
-def read_number(input_buffer=input_buffer):
+def read_number(input_buffer=input_buffer, output_buffer=output_buffer):
     """Get a number from standard input."""
+    output_buffer.flush()
+    if input_buffer.has_number():
+        return input_buffer.take_number()
     input_buffer.load(1)
     numchar = input_buffer.look(1)  # for sign
     negative = numchar == b'-'
@@ -141,11 +343,11 @@ def read_number(input_buffer=input_buffer):
     return num
 
 
-def write_number(value_str):
-    os.write(outfp, value_str)
+def write_number(value_str, output_buffer=output_buffer):
+    output_buffer.write(value_str)
 
 
-def write_utf8(value):
+def write_utf8(value, output_buffer=output_buffer):
     REPLACE_CHAR = unichr(0xfffd).encode('utf-8')
 
     if bigint.is_unicodepoint(value):
@@ -155,12 +357,59 @@ def write_utf8(value):
     else:
         bytes = REPLACE_CHAR
 
-    os.write(outfp, bytes)
+    output_buffer.write(bytes)
+
+
+BULK_ZERO = bigint.fromint(0)
+BULK_LIMIT = bigint.fromint(0x7fffffff)  # longer loops are left to run
+
+
+@jit.dont_look_inside
+def run_bulk(op, value, storage, selected_idx, stacksize):
+    """Run the rest of a loop of a bulk operation at once.
+
+    Do nothing if it may not do the same as the loop. Return the new size of
+    the selected storage. See `Compiler.optimize_loop` for the loops.
+    """
+    if selected_idx == c.VAL_QUEUE or selected_idx == c.VAL_PORT or stacksize < 2:
+        return stacksize
+    selected = storage[selected_idx]
+    counter = selected.pop()
+    count = -1
+    if bigint.ge(counter, BULK_ZERO) and bigint.ge(BULK_LIMIT, counter):
+        count = bigint.toint(counter)
+    if count < 0 or (op == c.OP_BULKMOV and (value == selected_idx or count > stacksize - 1)):
+        selected.push(counter)
+        return stacksize
+
+    if op == c.OP_ADDMUL:
+        acc = selected.pop()
+        selected.push(bigint.add(acc, bigint.mul(counter, bigint.fromint(value))))
+    elif op == c.OP_POWMUL:
+        acc = selected.pop()
+        factor = bigint.fromint(value)
+        while count > 0:
+            if count & 1:
+                acc = bigint.mul(acc, factor)
+            count >>= 1
+            if count > 0:
+                factor = bigint.mul(factor, factor)
+        selected.push(acc)
+    elif op == c.OP_BULKMOV:
+        target = storage[value]
+        for _ in range(0, count):
+            target.push(selected.pop())
+        storage.sizes[value] += count
+        stacksize -= count
+    else:
+        assert False
+    selected.push(BULK_ZERO)
+    return stacksize
 
 
 def warn_utf8_range(value):
     warnings.warn(WriteUtf8RangeWarning, value)
-    os.write(outfp, unichr(0xfffd).encode('utf-8'))
+    output_buffer.write(unichr(0xfffd).encode('utf-8'))
 
 class Program(object):
     _immutable_fields_ = ['labels[**]', 'opcodes[*]', 'values[*]', 'size']
@@ -188,128 +437,347 @@ class Program(object):
         return self.labels[self.get_operand(pc)]
 
 
-outfp = 1
+class BytecodeProgram(Program):
+    """`Program` built from the arrays of v2 bytecode."""
+
+    def __init__(self, opcodes, values, labels):
+        self.opcodes = opcodes
+        self.values = values
+        self.size = len(opcodes)
+        self.labels = labels
+
+
+def load_bytecode(data):
+    """Load v2 bytecode `data` as a `Program` without compiling it.
+
+    `data` is bytes or a memory map of a bytecode file from `option.read_input`.
+    """
+    opcodes, values, targets = bytecode.parse(data)
+    labels = {}
+    for idx in range(0, len(targets)):
+        labels[idx] = targets[idx]
+    return BytecodeProgram(opcodes, values, labels)
+
+
 errfp = 2
 
 
-def mainloop(program, debug):
+def make_mainloop(driver, counting):
+    """Build the main loop. If `counting`, run `profile` counters too.
+
+    The counting loop is a separate function so that `mainloop` does not
+    check the profiler at all.
+    """
+
+    def mainloop(program, debug, profile=None, storage=None, io=None):
+        program = jit.promote(program)
+        jit.assert_green(program)
+        pc = 0
+        stacksize = 0
+        is_queue = False
+        if storage is None:
+            storage = Storage()
+        storage = jit.promote(storage)
+        if io is None:
+            io = stdio
+        io = jit.promote(io)
+        selected_idx = 0
+        selected = storage[selected_idx]
+        jit.assert_green(selected)
+
+        # debug_skip = 0
+        # runtime_counter = 0
+        while pc < program.size:
+            '''
+            #  debug.storage(storage, selected)
+            runtime_counter += 1
+            os.write(errfp, b'%8d\t' % runtime_counter)
+            debug.show(pc)
+            if debug_skip <= 0:
+                raw_debug_skip = raw_input()
+                if not raw_debug_skip:
+                    raw_debug_skip = '0'
+                debug_skip = int(raw_debug_skip)
+            else:
+                debug_skip -= 1
+            '''
+            stackok = program.get_req_size(pc) <= stacksize
+            driver.jit_merge_point(
+                pc=pc, stackok=stackok, is_queue=is_queue, program=program,
+                stacksize=stacksize, storage=storage, selected=selected,
+                selected_idx=selected_idx, io=io)
+            op = program.get_op(pc)
+            jit.assert_green(op)
+            if counting:
+                profile.count(pc, op)
+            stacksize += - c.OP_STACKDEL[op] + c.OP_STACKADD[op]
+            if op == c.OP_ADD:
+                selected.add()
+            elif op == c.OP_ADDAT:
+                storage.stacks[program.get_operand(pc)].add()
+            elif op == c.OP_SUB:
+                selected.sub()
+            elif op == c.OP_SUBAT:
+                storage.stacks[program.get_operand(pc)].sub()
+            elif op == c.OP_MUL:
+                selected.mul()
+            elif op == c.OP_MULAT:
+                storage.stacks[program.get_operand(pc)].mul()
+            elif op == c.OP_DIV:
+                selected.div()
+            elif op == c.OP_DIVAT:
+                storage.stacks[program.get_operand(pc)].div()
+            elif op == c.OP_MOD:
+                selected.mod()
+            elif op == c.OP_MODAT:
+                storage.stacks[program.get_operand(pc)].mod()
+            elif op == c.OP_POP:
+                selected.pop()
+            elif op == c.OP_POPAT:
+                storage.stacks[program.get_operand(pc)].pop()
+            elif op == c.OP_PUSH:
+                value = program.get_operand(pc)
+                big_value = bigint.fromint(value)
+                selected.push(big_value)
+            elif op == c.OP_DUP:
+                selected.dup()
+            elif op == c.OP_DUPAT:
+                storage.stacks[program.get_operand(pc)].dup()
+            elif op == c.OP_SWAP:
+                selected.swap()
+            elif op == c.OP_SWAPAT:
+                storage.stacks[program.get_operand(pc)].swap()
+            elif op == c.OP_SEL:
+                value = program.get_operand(pc)
+                if counting:
+                    profile.switch(pc, value != selected_idx)
+                storage.sizes[selected_idx] = stacksize
+                selected_idx = value
+                selected = storage[value]
+                stacksize = storage.sizes[value]
+                is_queue = value == c.VAL_QUEUE
+            elif op == c.OP_MOV:
+                r = selected.pop()
+                value = program.get_operand(pc)
+                targeted = storage[value]
+                targeted.push(r)
+                if value == selected_idx:
+                    stacksize += 1
+                else:
+                    storage.sizes[value] += 1
+            elif op == c.OP_MOVTO:
+                value = program.get_operand(pc)
+                storage[value].push(selected.pop())
+                storage.sizes[value] += 1
+            elif op == c.OP_CMP:
+                selected.cmp()
+            elif op == c.OP_CMPAT:
+                storage.stacks[program.get_operand(pc)].cmp()
+            elif op == c.OP_PUSHADD:
+                value = program.get_operand(pc)
+                selected.push(bigint.fromint(value))
+                selected.add()
+            elif op == c.OP_PUSHSUB:
+                value = program.get_operand(pc)
+                selected.push(bigint.fromint(value))
+                selected.sub()
+            elif op == c.OP_PUSHMUL:
+                value = program.get_operand(pc)
+                selected.push(bigint.fromint(value))
+                selected.mul()
+            elif op == c.OP_SWAPSUB:
+                selected.swap()
+                selected.sub()
+            elif op == c.OP_PUSHSWAPSUB:
+                value = program.get_operand(pc)
+                selected.push(bigint.fromint(value))
+                selected.swap()
+                selected.sub()
+            elif op == c.OP_BRPOP1 or op == c.OP_BRPOP2 or op == c.OP_JMP or op == c.OP_BRZ \
+                    or op == c.OP_DUPBRZ or op == c.OP_CMPBRZ or op == c.OP_SUBBRZ or op == c.OP_SWAPCMPBRZ:
+                if op == c.OP_BRPOP1 or op == c.OP_BRPOP2:
+                    jump = not stackok
+                elif op == c.OP_JMP:
+                    jump = True
+                elif op == c.OP_BRZ:
+                    top = selected.pop()
+                    jump = bigint.is_zero(top)
+                elif op == c.OP_DUPBRZ:
+                    selected.dup()
+                    top = selected.pop()
+                    jump = bigint.is_zero(top)
+                elif op == c.OP_CMPBRZ:
+                    selected.cmp()
+                    top = selected.pop()
+                    jump = bigint.is_zero(top)
+                elif op == c.OP_SUBBRZ:
+                    selected.sub()
+                    top = selected.pop()
+                    jump = bigint.is_zero(top)
+                elif op == c.OP_SWAPCMPBRZ:
+                    selected.swap()
+                    selected.cmp()
+                    top = selected.pop()
+                    jump = bigint.is_zero(top)
+                else:
+                    assert False
+                if counting and op != c.OP_JMP:
+                    profile.branch(pc, jump)
+                if jump:
+                    value = program.get_label(pc)
+                    pc = value
+                    stackok = program.get_req_size(pc) <= stacksize
+                    driver.can_enter_jit(
+                        pc=pc, stackok=stackok, is_queue=is_queue, program=program,
+                        stacksize=stacksize, storage=storage, selected=selected,
+                        selected_idx=selected_idx, io=io)
+                    continue
+            elif op == c.OP_ADDMUL or op == c.OP_POWMUL or op == c.OP_BULKMOV:
+                value = program.get_operand(pc)
+                stacksize = run_bulk(op, value, storage, selected_idx, stacksize)
+            elif op == c.OP_POPNUM:
+                r = selected.pop()
+                write_number(bigint.str(r), io.output)
+            elif op == c.OP_POPCHAR:
+                r = selected.pop()
+                write_utf8(r, io.output)
+            elif op == c.OP_PUSHNUM:
+                num = read_number(io.input, io.output)
+                selected.push(num)
+            elif op == c.OP_PUSHCHAR:
+                char = read_utf8(io.input, io.output)
+                selected.push(char)
+            elif op == c.OP_NONE:
+                pass
+            elif op == c.OP_HALT:
+                break
+            else:
+                os.write(errfp, (u'Missing operator: %s' % _unicode(op)).encode('utf-8'))
+                assert False
+            pc += 1
+
+        if stacksize > 0:
+            return bigint.toint(selected.pop())
+        else:
+            return 0
+
+    return mainloop
+
+
+mainloop = make_mainloop(driver, False)
+profile_mainloop = make_mainloop(profile_driver, True)
+
+
+def get_register_location(pc, program):
+    op = program.get_op(pc)
+    return "#%d_%s_%d_%d_%d" % (
+        pc, register.R_NAMES[op].encode('utf-8'), program.get_a(pc), program.get_b(pc), program.get_c(pc))
+
+
+register_driver = jit.JitDriver(
+    greens=['pc', 'program'],
+    reds=['registers', 'storage', 'io'],
+    get_printable_location=get_register_location)
+
+
+def regloop(program, storage=None, io=None):
+    """Run a `register.RegisterProgram`."""
     program = jit.promote(program)
-    jit.assert_green(program)
     pc = 0
-    stacksize = 0
-    is_queue = False
-    storage = Storage()
+    if storage is None:
+        storage = Storage()
     storage = jit.promote(storage)
-    selected = storage[0]
-    jit.assert_green(selected)
-
-    # debug_skip = 0
-    # runtime_counter = 0
-    while pc < program.size:
-        '''
-        #  debug.storage(storage, selected)
-        runtime_counter += 1
-        os.write(errfp, b'%8d\t' % runtime_counter)
-        debug.show(pc)
-        if debug_skip <= 0:
-            raw_debug_skip = raw_input()
-            if not raw_debug_skip:
-                raw_debug_skip = '0'
-            debug_skip = int(raw_debug_skip)
-        else:
-            debug_skip -= 1
-        '''
-        stackok = program.get_req_size(pc) <= stacksize
-        driver.jit_merge_point(
-            pc=pc, stackok=stackok, is_queue=is_queue, program=program,
-            stacksize=stacksize, storage=storage, selected=selected)
+    if io is None:
+        io = stdio
+    io = jit.promote(io)
+    registers = [bigint.MINUS1] * program.register_count
+
+    while True:
+        register_driver.jit_merge_point(
+            pc=pc, program=program, registers=registers, storage=storage, io=io)
         op = program.get_op(pc)
-        jit.assert_green(op)
-        stacksize += - c.OP_STACKDEL[op] + c.OP_STACKADD[op]
-        if op == c.OP_ADD:
-            selected.add()
-        elif op == c.OP_SUB:
-            selected.sub()
-        elif op == c.OP_MUL:
-            selected.mul()
-        elif op == c.OP_DIV:
-            selected.div()
-        elif op == c.OP_MOD:
-            selected.mod()
-        elif op == c.OP_POP:
-            selected.pop()
-        elif op == c.OP_PUSH:
-            value = program.get_operand(pc)
-            big_value = bigint.fromint(value)
-            selected.push(big_value)
-        elif op == c.OP_DUP:
-            selected.dup()
-        elif op == c.OP_SWAP:
-            selected.swap()
-        elif op == c.OP_SEL:
-            value = program.get_operand(pc)
-            selected = storage[value]
-            stacksize = len(selected)
-            is_queue = value == c.VAL_QUEUE
-        elif op == c.OP_MOV:
-            r = selected.pop()
-            value = program.get_operand(pc)
-            targeted = storage[value]
-            targeted.push(r)
-            if selected == targeted:
-                stacksize += 1
-        elif op == c.OP_CMP:
-            selected.cmp()
-        elif op == c.OP_BRPOP1 or op == c.OP_BRPOP2 or op == c.OP_JMP or op == c.OP_BRZ:
-            if op == c.OP_BRPOP1 or op == c.OP_BRPOP2:
-                jump = not stackok
-            elif op == c.OP_JMP:
-                jump = True
-            elif op == c.OP_BRZ:
-                top = selected.pop()
-                jump = bigint.is_zero(top)
+        a = program.get_a(pc)
+        b = program.get_b(pc)
+        if op == register.R_CONST:
+            registers[a] = bigint.fromint(b)
+        elif op == register.R_POP:
+            r = storage[b].pop()
+            if a >= 0:
+                registers[a] = r
+        elif op == register.R_PUSH:
+            storage[b].push(registers[a])
+        elif op == register.R_ADD:
+            registers[a] = bigint.add(registers[b], registers[program.get_c(pc)])
+        elif op == register.R_SUB:
+            registers[a] = bigint.sub(registers[b], registers[program.get_c(pc)])
+        elif op == register.R_MUL:
+            registers[a] = bigint.mul(registers[b], registers[program.get_c(pc)])
+        elif op == register.R_DIV:
+            registers[a] = bigint.div(registers[b], registers[program.get_c(pc)])
+        elif op == register.R_MOD:
+            registers[a] = bigint.mod(registers[b], registers[program.get_c(pc)])
+        elif op == register.R_CMP:
+            r = int(bigint.ge(registers[b], registers[program.get_c(pc)]))
+            registers[a] = bigint.fromint(r)
+        elif op == register.R_STORAGE:
+            selected = storage[b]
+            if a == c.OP_ADD:
+                selected.add()
+            elif a == c.OP_SUB:
+                selected.sub()
+            elif a == c.OP_MUL:
+                selected.mul()
+            elif a == c.OP_DIV:
+                selected.div()
+            elif a == c.OP_MOD:
+                selected.mod()
+            elif a == c.OP_CMP:
+                selected.cmp()
+            elif a == c.OP_DUP:
+                selected.dup()
+            elif a == c.OP_SWAP:
+                selected.swap()
             else:
                 assert False
+        elif op == register.R_POPNUM:
+            write_number(bigint.str(registers[a]), io.output)
+        elif op == register.R_POPCHAR:
+            write_utf8(registers[a], io.output)
+        elif op == register.R_PUSHNUM:
+            registers[a] = read_number(io.input, io.output)
+        elif op == register.R_PUSHCHAR:
+            registers[a] = read_utf8(io.input, io.output)
+        elif op == register.R_BRZ or op == register.R_BRSIZE or op == register.R_JMP:
+            if op == register.R_BRZ:
+                jump = bigint.is_zero(registers[a])
+            elif op == register.R_BRSIZE:
+                jump = len(storage[b]) < a
+            else:
+                jump = True
             if jump:
-                value = program.get_label(pc)
-                pc = value
-                stackok = program.get_req_size(pc) <= stacksize
-                driver.can_enter_jit(
-                    pc=pc, stackok=stackok, is_queue=is_queue, program=program,
-                    stacksize=stacksize, storage=storage, selected=selected)
+                target = program.get_c(pc)
+                backward = target <= pc
+                pc = target
+                if backward:
+                    register_driver.can_enter_jit(
+                        pc=pc, program=program, registers=registers, storage=storage, io=io)
                 continue
-        elif op == c.OP_POPNUM:
-            r = selected.pop()
-            write_number(bigint.str(r))
-        elif op == c.OP_POPCHAR:
-            r = selected.pop()
-            write_utf8(r)
-        elif op == c.OP_PUSHNUM:
-            num = read_number()
-            selected.push(num)
-        elif op == c.OP_PUSHCHAR:
-            char = read_utf8()
-            selected.push(char)
-        elif op == c.OP_NONE:
-            pass
-        elif op == c.OP_HALT:
-            break
+        elif op == register.R_HALT:
+            selected = storage[b]
+            if len(selected) > 0:
+                return bigint.toint(selected.pop())
+            else:
+                return 0
         else:
-            os.write(errfp, (u'Missing operator: %s' % _unicode(op)).encode('utf-8'))
             assert False
         pc += 1
 
-    if len(selected) > 0:
-        return bigint.toint(selected.pop())
-    else:
-        return 0
-
 
 def open_w(filename):
     return os.open(filename, os.O_WRONLY | os.O_CREAT, 0o644)
 
 
-def prepare_compiler(contents, opt_level=2, source='text', aheuic_output=None, add_debug_info=False):
+def compile_contents(contents, opt_level, source, add_debug_info):
     compiler = compile.Compiler()
     if source == 'bytecode':
         compiler.read_bytecode(contents)
@@ -325,31 +793,79 @@ def prepare_compiler(contents, opt_level=2, source='text', aheuic_output=None, a
         compiler.optimize1()
     elif opt_level == 2:
         compiler.optimize2()
+    elif opt_level == 3:
+        compiler.optimize3()
     else:
         assert False
+    return compiler
 
+
+def prepare_compiler(contents, opt_level=2, source='text', aheuic_output=None, add_debug_info=False, cache_dir=''):
+    """Compile and optimize `contents`.
+
+    With `cache_dir`, a cached compiler is loaded if there is, otherwise the
+    new one is stored there. Programs with debug info and bytecodes are not
+    cached.
+    """
+    use_cache = cache_dir != '' and not add_debug_info and source != 'bytecode'
+    compiler = None
+    if use_cache:
+        cache_key = cache.make_key(contents, opt_level, source)
+        compiler = cache.load(cache_dir, cache_key)
+    else:
+        cache_key = ''
+
+    if compiler is None:
+        compiler = compile_contents(contents, opt_level, source, add_debug_info)
+        if use_cache:
+            cache.store(cache_dir, cache_key, compiler)
     if aheuic_output is not None:
         try:
-            bfp = open_w(aheuic_output)
-            bytecode = compiler.write_bytecode()
-            asm = compiler.write_asm().encode('utf-8')
-            os.write(bfp, bytecode)
-            os.write(bfp, '\n\n')
-            os.write(bfp, asm)
-            os.close(bfp)
-        except Exception:
-            pass
+            code = compiler.write_bytecode()
+        except bytecode.BytecodeError:
+            return compiler  # not serializable. it is only a by-product.
+        asm = compiler.write_asm().encode('utf-8')
+        cache.write_atomic(aheuic_output, code + b'\n\n' + asm)
     return compiler
 
 
-def run_with_compiler(compiler):
+def run_with_compiler(compiler, storage=None, io=None):
+    program = Program(compiler.lines, compiler.label_map)
+    return mainloop(program, compiler.debug, None, storage, io)
+
+
+def run_with_profile(compiler, profile_output, storage=None):
     program = Program(compiler.lines, compiler.label_map)
-    return mainloop(program, compiler.debug)
+    profile = Profile(program.size)
+    exitcode = profile_mainloop(program, compiler.debug, profile, storage)
+    report = profile.report(compiler.lines, compiler.label_map, compiler.debug)
+    output_buffer.flush()
+    fp = 1 if profile_output == '-' else open_w(profile_output)
+    os.write(fp, report.encode('utf-8'))
+    if fp != 1:
+        os.close(fp)
+    return exitcode
+
+
+def run_with_register(compiler, storage=None, io=None):
+    program = register.translate(compiler.lines, compiler.label_map)
+    return regloop(program, storage, io)
+
+
+def run_with_transpiler(compiler, io=stdio):
+    """Run the program as a transpiled Python function. Not for RPython."""
+    main = transpile.build(compiler.lines, compiler.label_map)
+    return main(
+        lambda value_str: write_number(value_str, io.output),
+        lambda value: write_utf8(value, io.output),
+        lambda: read_number(io.input, io.output),
+        lambda: read_utf8(io.input, io.output),
+        bigint.str)
 
 
 def entry_point(argv):
     try:
-        cmd, source, contents, str_opt_level, target, aheuic_output, comment_aheuis, output, warning_limit, trace_limit = process_options(argv, os.environ)
+        cmd, source, contents, str_opt_level, target, aheuic_output, comment_aheuis, output, warning_limit, trace_limit, engine, buffer_mode, profile_output, storage_stats, cache_dir = process_options(argv, os.environ)
     except InformationException:
         return 0
     except OptionError as e:
@@ -357,24 +873,67 @@ def entry_point(argv):
         return 1
 
     warnings.limit = warning_limit
+    if PYR and (engine == 'transpile' or target == 'python'):
+        os.write(errfp, b"%s: error: Python transpiler is not available in RPython build\n" % get_prog(argv[0]))
+        return 1
     if trace_limit >= 0:
         jit.set_param(driver, 'trace_limit', trace_limit)
 
-    add_debug_info = DEBUG or target != 'run'  # debug flag for user program
-    compiler = prepare_compiler(contents, int(str_opt_level), source, aheuic_output, add_debug_info)
+    add_debug_info = DEBUG or target != 'run' or profile_output != ''  # debug flag for user program
+    program = None
+    compiler = None
+    if target == 'run' and engine == 'vm' and profile_output == '' and source == 'bytecode' \
+            and bytecode.is_v2(contents):
+        # run v2 bytecode as it is, without compiling or optimizing it again
+        try:
+            program = load_bytecode(contents)
+        except bytecode.BytecodeError as e:
+            os.write(errfp, b"%s: error: %s\n" % (get_prog(argv[0]), e.message()))
+            return 1
+    else:
+        compiler = prepare_compiler(contents, int(str_opt_level), source, aheuic_output, add_debug_info, cache_dir)
     outfp = 1 if output == '-' else open_w(output)
     if target == 'run':
-        if not PYR:
-            warnings.warn(NoRpythonWarning)
-        exitcode = run_with_compiler(compiler)
+        if buffer_mode == 'auto':
+            buffer_mode = 'line' if os.isatty(output_buffer.fd) else 'full'
+        output_buffer.mode = buffer_mode
+        storage = Storage(storage_stats != 'none')
+        try:
+            if profile_output:
+                exitcode = run_with_profile(compiler, profile_output, storage)
+            elif engine == 'transpile' and not PYR:
+                exitcode = run_with_transpiler(compiler)
+            else:
+                if not PYR:
+                    warnings.warn(NoRpythonWarning)
+                if program is not None:
+                    exitcode = mainloop(program, None, None, storage)
+                elif engine == 'register':
+                    exitcode = run_with_register(compiler, storage)
+                else:
+                    exitcode = run_with_compiler(compiler, storage)
+        finally:
+            # keep the output before a runtime error
+            output_buffer.flush()
+        if storage_stats != 'none' and engine != 'transpile':
+            os.write(errfp, stats.report(storage, storage_stats).encode('utf-8'))
     elif target in ['asm', 'asm+comment']:
         asm = compiler.write_asm(commented=comment_aheuis).encode('utf-8')
         os.write(outfp, asm)
         os.close(outfp)
         exitcode = 0
     elif target == 'bytecode':
-        bytecode = compiler.write_bytecode()
-        os.write(outfp, bytecode)
+        try:
+            code = compiler.write_bytecode()
+        except bytecode.BytecodeError as e:
+            os.write(errfp, b"%s: error: %s\n" % (get_prog(argv[0]), e.message()))
+            return 1
+        os.write(outfp, code)
+        os.close(outfp)
+        exitcode = 0
+    elif target == 'python' and not PYR:
+        code = transpile.transpile(compiler.lines, compiler.label_map).encode('utf-8')
+        os.write(outfp, code)
         os.close(outfp)
         exitcode = 0
     else:
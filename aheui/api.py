@@ -0,0 +1,63 @@
+# coding: utf-8
+"""Run Aheui programs in the current process.
+
+    >>> from aheui.api import run
+    >>> run(u'방망희', b'42')
+    (b'42', 0)
+
+Each call has its own storage and I/O buffers, so programs can run back to
+back without reinitialization. Not for RPython.
+"""
+
+from __future__ import absolute_import
+
+from aheui import aheui
+from aheui import bytecode
+
+
+def load(program, opt=2, source='auto'):
+    """Return a `Compiler` of `program` optimized by `opt` level.
+
+    `program` is Aheui code, asm or bytecode in `bytes` or `unicode`.
+    `source` is one of `auto`, `text`, `asm` and `bytecode` like the
+    `--source` option, except `auto` guesses by the bytecode patterns only.
+    """
+    if not isinstance(program, bytes):
+        program = program.encode('utf-8')
+    if source == 'auto':
+        is_bytecode = bytecode.is_v2(program) or b'\xff\xff\xff\xff' in program
+        source = 'bytecode' if is_bytecode else 'text'
+    if source not in ('text', 'asm', 'bytecode'):
+        raise ValueError('unknown source type: %r' % (source,))
+    if opt not in (0, 1, 2, 3):
+        raise ValueError('unknown optimization level: %r' % (opt,))
+    return aheui.prepare_compiler(program, opt, source)
+
+
+def run(program, stdin=b'', opt=2, source='auto', engine='vm'):
+    """Run `program` with `stdin` and return `(stdout, exitcode)`.
+
+    `program` is anything `load` accepts, a `Compiler` or a `Program`.
+    A `Compiler` or a `Program` is run as it is, without `opt`, so load
+    it once to run it many times. `engine` is one of `vm`, `register` and
+    `transpile` like the `--engine` option; a `Program` runs only on `vm`.
+    """
+    if engine not in ('vm', 'register', 'transpile'):
+        raise ValueError('unknown engine: %r' % (engine,))
+    io = aheui.IO(aheui.MemoryInputBuffer(stdin), aheui.MemoryOutputBuffer())
+    if isinstance(program, aheui.Program):
+        if engine != 'vm':
+            raise ValueError('a Program runs only on vm engine')
+        exitcode = aheui.mainloop(program, None, None, aheui.Storage(), io)
+    else:
+        if isinstance(program, aheui.compile.Compiler):
+            compiler = program
+        else:
+            compiler = load(program, opt, source)
+        if engine == 'transpile':
+            exitcode = aheui.run_with_transpiler(compiler, io)
+        elif engine == 'register':
+            exitcode = aheui.run_with_register(compiler, aheui.Storage(), io)
+        else:
+            exitcode = aheui.run_with_compiler(compiler, aheui.Storage(), io)
+    return io.output.getvalue(), exitcode
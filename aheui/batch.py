@@ -0,0 +1,171 @@
+# coding: utf-8
+"""Run a program over many inputs with a process pool.
+
+The program is compiled and optimized once. Each worker process rebuilds
+the compiled code once and runs it with `api.run` for each input it is given.
+Results are written as JSON lines in the order of the inputs::
+
+    {"input": "tests/1.txt", "stdout": "...", "exitcode": 0, "time": 0.0012}
+
+`stdout` is the output decoded as UTF-8. If the output is not valid UTF-8,
+`stdout_base64` has the raw bytes instead. A run raising an error has
+`error` and a null `exitcode`.
+
+Inputs are one of:
+
+- a directory: each regular file in it, ordered by name.
+- a manifest: a text file listing an input file per line. Relative paths are
+  relative to the manifest.
+- a JSONL stream (`.jsonl` or `-` for standard input): each line is a string
+  or an object with a `stdin` string, given to the program as UTF-8.
+
+Not for RPython.
+"""
+
+from __future__ import absolute_import
+
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from aheui import api
+from aheui import compile
+
+
+clock = getattr(time, 'perf_counter', time.time)
+
+worker_compiler = None
+worker_engine = 'vm'
+
+
+def init_worker(lines, label_map, engine):
+    global worker_compiler, worker_engine
+    compiler = compile.Compiler()
+    compiler.lines = lines
+    compiler.label_map = label_map
+    worker_compiler = compiler
+    worker_engine = engine
+
+
+def run_one(item):
+    """Run an `(input name, stdin bytes)` item and return its result dict."""
+    name, stdin = item
+    result = {'input': name}
+    start = clock()
+    try:
+        stdout, exitcode = api.run(worker_compiler, stdin, engine=worker_engine)
+    except Exception as e:
+        result['exitcode'] = None
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+    else:
+        try:
+            result['stdout'] = stdout.decode('utf-8')
+        except UnicodeDecodeError:
+            result['stdout_base64'] = base64.b64encode(stdout).decode('ascii')
+        result['exitcode'] = exitcode
+    result['time'] = clock() - start
+    return result
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def iter_directory(path):
+    for name in sorted(os.listdir(path)):
+        filename = os.path.join(path, name)
+        if os.path.isfile(filename):
+            yield filename, read_file(filename)
+
+
+def iter_manifest(path):
+    base = os.path.dirname(path)
+    with open(path) as f:
+        for line in f:
+            filename = line.strip()
+            if not filename:
+                continue
+            filename = os.path.join(base, filename)
+            yield filename, read_file(filename)
+
+
+def iter_jsonl(lines, name):
+    for lineno, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        payload = json.loads(line)
+        if isinstance(payload, dict):
+            payload = payload['stdin']
+        yield '%s:%d' % (name, lineno), payload.encode('utf-8')
+
+
+def iter_jsonl_file(path):
+    with open(path) as f:
+        for item in iter_jsonl(f, path):
+            yield item
+
+
+def iter_inputs(path):
+    """Yield `(input name, stdin bytes)` items of `path` in order."""
+    if path == '-':
+        return iter_jsonl(sys.stdin, '-')
+    if os.path.isdir(path):
+        return iter_directory(path)
+    if path.endswith('.jsonl'):
+        return iter_jsonl_file(path)
+    return iter_manifest(path)
+
+
+def run_batch(compiler, inputs, engine='vm', jobs=None):
+    """Yield the result dicts of running `compiler` over `inputs` in order.
+
+    `jobs` is the number of worker processes, one per core by default.
+    """
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    initargs = (compiler.lines, compiler.label_map, engine)
+    if jobs <= 1:
+        init_worker(*initargs)
+        for item in inputs:
+            yield run_one(item)
+        return
+    pool = multiprocessing.Pool(jobs, init_worker, initargs)
+    try:
+        for result in pool.imap(run_one, inputs, 16):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='aheui-batch', description='Run an Aheui program over many inputs.')
+    parser.add_argument('program', help='Aheui code, asm or bytecode file')
+    parser.add_argument('inputs', help='directory, manifest, .jsonl file or - for JSONL from standard input')
+    parser.add_argument('--opt', '-O', type=int, default=2, choices=[0, 1, 2, 3])
+    parser.add_argument('--source', '-S', default='auto', choices=['auto', 'bytecode', 'asm', 'text'])
+    parser.add_argument('--engine', '-E', default='vm', choices=['vm', 'register', 'transpile'])
+    parser.add_argument('--jobs', '-j', type=int, default=None, help='number of workers. Default is the number of cores.')
+    args = parser.parse_args(argv)
+
+    source = args.source
+    if source == 'auto':
+        if args.program.endswith('.aheuis'):
+            source = 'asm'
+        elif args.program.endswith('.aheuic'):
+            source = 'bytecode'
+    compiler = api.load(read_file(args.program), args.opt, source)
+    for result in run_batch(compiler, iter_inputs(args.inputs), args.engine, args.jobs):
+        sys.stdout.write(json.dumps(result, sort_keys=True) + '\n')
+    sys.stdout.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+# coding: utf-8
+"""Binary bytecode format v2.
+
+    offset      size    field
+    0           8       magic `AHEUIC` and the version 2 as uint16
+    8           4       number of instructions `n`
+    12          4       number of jump targets `m`
+    16          4       adler-32 checksum of the rest
+    20          8 * n   instructions: opcode and operand
+    20 + 8 * n  4 * m   jump targets: pc of each target
+
+Every number is a little-endian int32. The operand of a jump instruction is
+an index of the jump target table. Unlike v1, operands are not truncated and
+the instructions can be read as an array at once.
+"""
+
+from __future__ import absolute_import
+
+from aheui import const as c
+from aheui._compat import ord, PYR
+
+
+MAGIC = b'AHEUIC\x02\x00'
+HEADER_SIZE = 20
+INT32_MIN = -0x80000000
+INT32_MAX = 0x7fffffff
+OP_MIN = c.OP_BRPOP2
+OP_MAX = OP_MIN + len(c.OP_REQSIZE) - 1
+OP_UNUSED = [0, 1, 13, 15]  # ㄱ ㄲ ㅉ ㅋ
+
+
+class BytecodeError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+    def message(self):
+        return self.msg
+
+
+def is_v2(data):
+    return len(data) >= len(MAGIC) and data[0:len(MAGIC)] == MAGIC
+
+
+def to_int32(value):
+    value &= 0xffffffff
+    if value > INT32_MAX:
+        value -= 0x100000000
+    return value
+
+
+if PYR:
+    def adler32(data, start, end):
+        a = 1
+        b = 0
+        for idx in range(start, end):
+            a = (a + ord(data[idx])) % 65521
+            b = (b + a) % 65521
+        return (b << 16) | a
+
+    def pack_ints(values):
+        chars = []
+        for value in values:
+            value &= 0xffffffff
+            chars.append(chr(value & 0xff))
+            chars.append(chr((value >> 8) & 0xff))
+            chars.append(chr((value >> 16) & 0xff))
+            chars.append(chr((value >> 24) & 0xff))
+        return ''.join(chars)
+
+    def unpack_int(data, start):
+        value = ord(data[start]) | (ord(data[start + 1]) << 8) | (ord(data[start + 2]) << 16) | (ord(data[start + 3]) << 24)
+        return to_int32(value)
+
+    def unpack_ints(data, start, count):
+        values = [0] * count
+        for idx in range(0, count):
+            values[idx] = unpack_int(data, start + 4 * idx)
+        return values
+
+    def unpack_pairs(data, start, count):
+        firsts = [0] * count
+        seconds = [0] * count
+        for idx in range(0, count):
+            firsts[idx] = unpack_int(data, start + 8 * idx)
+            seconds[idx] = unpack_int(data, start + 8 * idx + 4)
+        return firsts, seconds
+else:
+    import array
+    import sys
+    import zlib
+
+    INT32 = 'i' if array.array('i').itemsize == 4 else 'l'
+
+    def adler32(data, start, end):
+        return zlib.adler32(data[start:end]) & 0xffffffff
+
+    def pack_ints(values):
+        ints = array.array(INT32, values)
+        if sys.byteorder == 'big':
+            ints.byteswap()
+        return ints.tobytes() if hasattr(ints, 'tobytes') else ints.tostring()
+
+    def unpack_ints(data, start, count):
+        ints = array.array(INT32)
+        chunk = data[start:start + 4 * count]
+        if hasattr(ints, 'frombytes'):
+            ints.frombytes(chunk)
+        else:
+            ints.fromstring(chunk)
+        if sys.byteorder == 'big':
+            ints.byteswap()
+        return ints
+
+    def unpack_pairs(data, start, count):
+        ints = unpack_ints(data, start, 2 * count)
+        return ints[0::2], ints[1::2]
+
+
+def dump(lines, label_map):
+    """Return v2 bytecode of `lines`."""
+    records = []
+    targets = []
+    target_index = {}
+    for op, val in lines:
+        if op in c.OP_JUMPS:
+            target = label_map[val]
+            if target not in target_index:
+                target_index[target] = len(targets)
+                targets.append(target)
+            val = target_index[target]
+        elif val < INT32_MIN or val > INT32_MAX:
+            raise BytecodeError('operand %d does not fit in int32' % val)
+        records.append(op)
+        records.append(val)
+    body = pack_ints(records) + pack_ints(targets)
+    header = pack_ints([len(lines), len(targets), to_int32(adler32(body, 0, len(body)))])
+    return MAGIC + header + body
+
+
+def parse(data):
+    """Return opcodes, operands and jump targets of v2 bytecode `data`.
+
+    `data` is bytes or a memory map. The instructions are read as arrays
+    without decoding each of them on CPython.
+    """
+    if not is_v2(data):
+        raise BytecodeError('not a v2 bytecode')
+    if len(data) < HEADER_SIZE:
+        raise BytecodeError('truncated bytecode header')
+    header = unpack_ints(data, len(MAGIC), 3)
+    count = header[0]
+    target_count = header[1]
+    if count < 0 or target_count < 0:
+        raise BytecodeError('broken bytecode header')
+    targets_start = HEADER_SIZE + 8 * count
+    end = targets_start + 4 * target_count
+    if len(data) < end:
+        raise BytecodeError('truncated bytecode')
+    if to_int32(adler32(data, HEADER_SIZE, end)) != header[2]:
+        raise BytecodeError('bytecode checksum mismatch')
+    opcodes, values = unpack_pairs(data, HEADER_SIZE, count)
+    targets = unpack_ints(data, targets_start, target_count)
+    for idx in range(0, count):
+        op = opcodes[idx]
+        if op < OP_MIN or op > OP_MAX or op in OP_UNUSED:
+            raise BytecodeError('unknown opcode %d at %d' % (op, idx))
+        if op in c.OP_JUMPS and (values[idx] < 0 or values[idx] >= target_count):
+            raise BytecodeError('jump target index %d out of range at %d' % (values[idx], idx))
+    for idx in range(0, target_count):
+        if targets[idx] < 0 or targets[idx] >= count:
+            raise BytecodeError('jump target %d out of range' % targets[idx])
+    return opcodes, values, targets
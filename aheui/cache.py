@@ -0,0 +1,100 @@
+# coding: utf-8
+"""Cache of compiled and optimized programs.
+
+An entry is the v2 bytecode of an optimized program at
+`<cache dir>/<key>.aheuic`. The key is the md5 hash of the source, the source
+type, the optimization level and the compiler version, so an entry is never
+stale: a changed source or compiler has another key. The first line of an
+entry repeats its key and an entry without it is ignored.
+
+Entries are written to a temporary file and renamed, so a reader never sees a
+partially written entry.
+"""
+
+from __future__ import absolute_import
+
+import os
+
+from aheui import bytecode
+from aheui import compile
+from aheui._compat import md5_hexdigest, PY3
+from aheui.version import VERSION
+
+
+CACHE_VERSION = 2  # bump when the same source compiles to other codes
+
+
+def make_key(contents, opt_level, source):
+    header = '%s:%d:%s:%d\n' % (VERSION, CACHE_VERSION, source, opt_level)
+    if PY3:
+        header = header.encode('utf-8')
+    return md5_hexdigest(header + contents)
+
+
+def entry_path(cache_dir, key):
+    return cache_dir + '/' + key + '.aheuic'
+
+
+def entry_header(key):
+    header = '; rpaheui cache %s\n' % key
+    if PY3:
+        header = header.encode('utf-8')
+    return header
+
+
+def write_atomic(path, data):
+    """Write `data` to a temporary file and rename it to `path`.
+
+    Return False if it failed. `path` is never partially written.
+    """
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        fp = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            while data:
+                written = os.write(fp, data)
+                data = data[written:]
+        finally:
+            os.close(fp)
+        os.rename(tmp, path)
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def load(cache_dir, key):
+    """Return the cached `Compiler` of `key`, or None if there is not."""
+    try:
+        fp = os.open(entry_path(cache_dir, key), os.O_RDONLY, 0o644)
+    except OSError:
+        return None
+    try:
+        data = compile.read(fp)
+    finally:
+        os.close(fp)
+    header = entry_header(key)
+    if not data.startswith(header):
+        return None
+    compiler = compile.Compiler()
+    try:
+        compiler.read_bytecode(data[len(header):])
+    except bytecode.BytecodeError:
+        return None
+    return compiler
+
+
+def store(cache_dir, key, compiler):
+    """Write `compiler` as the entry of `key`. Return False if it failed."""
+    try:
+        os.mkdir(cache_dir, 0o755)
+    except OSError:
+        pass  # already exists, or the write below fails
+    try:
+        code = compiler.write_bytecode()
+    except bytecode.BytecodeError:
+        return False
+    return write_atomic(entry_path(cache_dir, key), entry_header(key) + code)
@@ -0,0 +1,445 @@
+# coding: utf-8
+"""Basic block IR of the compiled codes.
+
+`Compiler.build_graph` builds a `Graph` from `lines` and `label_map` and
+`Compiler.write_graph` writes it back by `Graph.linearize`. `optimize2`
+builds a graph once, removes deadcode, lays it out, folds the stacks and
+shares tails on it and writes it back once. The peephole passes after it,
+`optimize_operation`, `optimize_loop`, `optimize_fusion` and
+`optimize_storage`, still work on `lines`. The flow analyses of `Compiler`
+run on a graph and `flatten` gives their results to the passes on `lines`.
+
+A block is entered only at its start. It ends with a jump, a branch or
+`OP_HALT`, or before the start of another block. The operand of the jump or
+the branch at the end of a block is the index of its target block. `next` is
+the index of the block it falls through to, or -1 if it falls off the end of
+the code, which is the same as `OP_HALT`.
+"""
+
+from __future__ import absolute_import
+
+from aheui import const as c
+
+
+class Block(object):
+
+    def __init__(self, codes, comments):
+        self.codes = codes  # (op, val) pairs
+        self.comments = comments  # debug comments of each code
+        self.next = -1
+        self.preds = []
+        self.succs = []
+        # stack effect of the codes before the first one using another storage
+        self.stack_req = 0
+        self.stack_diff = 0
+        self.stack_end = 0
+
+    def last_op(self):
+        if not self.codes:
+            return c.OP_NONE
+        return self.codes[-1][0]
+
+    def target(self):
+        """Return the block index of the jump or branch at the end or -1."""
+        if not self.codes:
+            return -1
+        op, val = self.codes[-1]
+        if op in c.OP_JUMPS:
+            return val
+        return -1
+
+    def falls_through(self):
+        op = self.last_op()
+        return op != c.OP_JMP and op != c.OP_HALT
+
+    def compute_stack_effect(self):
+        """Compute the stack effect on the storage selected at the start.
+
+        The codes up to `stack_end`, before the first OP_SEL, OP_MOV or
+        OP_MOVTO, need `stack_req` values on the storage and change its size
+        by `stack_diff`.
+        """
+        depth = 0
+        lowest = 0
+        end = 0
+        for op, _ in self.codes:
+            if op == c.OP_SEL or op == c.OP_MOV or op == c.OP_MOVTO:
+                break
+            depth -= c.OP_STACKDEL[op]
+            if depth < lowest:
+                lowest = depth
+            depth += c.OP_STACKADD[op]
+            end += 1
+        self.stack_req = -lowest
+        self.stack_diff = depth
+        self.stack_end = end
+
+
+class Graph(object):
+
+    def __init__(self, blocks):
+        self.blocks = blocks  # the entry is the first block
+        self.order = [idx for idx in range(0, len(blocks))]  # layout
+
+    def link(self):
+        """Rebuild `succs` and `preds` and the stack effects of blocks."""
+        for block in self.blocks:
+            block.preds = []
+        for idx, block in enumerate(self.blocks):
+            succs = []
+            if block.falls_through() and block.next >= 0:
+                succs.append(block.next)
+            target = block.target()
+            if target >= 0 and target not in succs:
+                succs.append(target)
+            block.succs = succs
+            for succ in succs:
+                self.blocks[succ].preds.append(idx)
+            block.compute_stack_effect()
+
+    def reachability(self):
+        """Return whether each block is reachable from the entry."""
+        reachable = [False] * len(self.blocks)
+        if not self.blocks:
+            return reachable
+        reachable[0] = True
+        job_queue = [0]
+        job_index = 0
+        while job_index < len(job_queue):
+            idx = job_queue[job_index]
+            job_index += 1
+            for succ in self.blocks[idx].succs:
+                if not reachable[succ]:
+                    reachable[succ] = True
+                    job_queue.append(succ)
+        return reachable
+
+    def is_placed(self):
+        """Return whether each block is in `order`."""
+        placed = [False] * len(self.blocks)
+        for idx in self.order:
+            placed[idx] = True
+        return placed
+
+    def chain_layout(self):
+        """Lay out blocks in `order` to remove jumps to the next block.
+
+        Blocks out of `order` stay out of it.
+
+        1. Chain each block with the block it falls through to.
+        2. Chain each block ending with OP_JMP with its target, unless the
+            target is the entry, is already chained after another block or
+            is the head of the chain of the block.
+        3. Place the chains from their heads in the original order.
+        """
+        count = len(self.blocks)
+        placed = self.is_placed()
+        nexts = [-1] * count
+        prevs = [-1] * count
+        for idx, block in enumerate(self.blocks):
+            if not placed[idx]:
+                continue
+            if block.falls_through() and block.next >= 0:
+                nexts[idx] = block.next
+                prevs[block.next] = idx
+        # both ends of each chain, kept only at the ends
+        head_of = [-1] * count
+        tail_of = [-1] * count
+        for head in range(0, count):
+            if not placed[head] or prevs[head] >= 0:
+                continue
+            tail = head
+            while nexts[tail] >= 0:
+                tail = nexts[tail]
+            head_of[tail] = head
+            tail_of[head] = tail
+        for idx, block in enumerate(self.blocks):
+            if not placed[idx] or block.last_op() != c.OP_JMP:
+                continue
+            succ = block.target()
+            if succ <= 0 or prevs[succ] >= 0 or head_of[idx] == succ:
+                continue
+            nexts[idx] = succ
+            prevs[succ] = idx
+            head = head_of[idx]
+            tail = tail_of[succ]
+            head_of[tail] = head
+            tail_of[head] = tail
+
+        order = []
+        for head in range(0, count):
+            if not placed[head] or prevs[head] >= 0:
+                continue
+            idx = head
+            while idx >= 0:
+                order.append(idx)
+                idx = nexts[idx]
+        self.order = order
+
+    def join_chains(self):
+        """Join each block with the next block in `order` if they only go
+        to each other.
+
+        A block joins the next one if it does not end with a branch or
+        OP_HALT and only goes to the next one, which is not the entry and
+        is reached only from the block among the blocks in `order`. OP_JMP
+        at the end of the block is dropped. The joined block is emptied and
+        leaves `order`. Return whether any block is joined.
+        """
+        placed = self.is_placed()
+        order = []
+        head = -1
+        joined = False
+        for idx in self.order:
+            if head >= 0 and idx > 0 and self.joins(head, idx, placed):
+                block = self.blocks[head]
+                succ = self.blocks[idx]
+                if block.last_op() == c.OP_JMP:
+                    block.codes.pop()
+                    comments = block.comments.pop()
+                    if succ.comments:
+                        succ.comments[0] = comments + succ.comments[0]
+                block.codes = block.codes + succ.codes
+                block.comments = block.comments + succ.comments
+                block.next = succ.next
+                block.succs = succ.succs
+                for after in succ.succs:
+                    preds = self.blocks[after].preds
+                    self.blocks[after].preds = [head if pred == idx else pred for pred in preds]
+                succ.codes = []
+                succ.comments = []
+                succ.next = -1
+                succ.preds = []
+                succ.succs = []
+                placed[idx] = False
+                joined = True
+                continue
+            order.append(idx)
+            head = idx
+        self.order = order
+        if joined:
+            self.link()
+        return joined
+
+    def joins(self, idx, succ, placed):
+        block = self.blocks[idx]
+        op = block.last_op()
+        if op in c.OP_BRANCHES or op == c.OP_HALT:
+            return False
+        if len(block.succs) != 1 or block.succs[0] != succ:
+            return False
+        for pred in self.blocks[succ].preds:
+            if pred != idx and placed[pred]:
+                return False
+        return True
+
+    def exit_key(self, idx):
+        """Return where the tail of a block goes as a tuple of ints.
+
+        Blocks with the same key continue the same way after the same tail.
+        The tail is the codes but OP_JMP at the end. See `tail_size`.
+        """
+        block = self.blocks[idx]
+        op = block.last_op()
+        if op == c.OP_JMP:
+            return (op, block.target(), -1)
+        elif op == c.OP_HALT:
+            return (op, -1, -1)
+        return (c.OP_NONE, -1, block.next)
+
+    def tail_size(self, idx):
+        block = self.blocks[idx]
+        if block.last_op() == c.OP_JMP:
+            return len(block.codes) - 1
+        return len(block.codes)
+
+    def tail_code(self, idx, depth):
+        """Return the code at `depth` from the end of the tail of a block."""
+        return self.blocks[idx].codes[self.tail_size(idx) - depth]
+
+    def merge_tails(self, min_size=2):
+        """Share identical tails of blocks with the same `exit_key`.
+
+        Blocks with the same key and the same last code are narrowed down by
+        their codes from the end while at least two of them are left. If
+        they share at least `min_size` codes, they jump to a single copy of
+        the codes. Repeat it until no tails are shared. Only blocks in
+        `order` share tails. Return whether any tail is shared.
+        """
+        merged = False
+        changed = True
+        while changed:
+            changed = False
+            groups = {}
+            keys = []
+            for idx in self.order:
+                if self.tail_size(idx) < min_size:
+                    continue
+                op, val = self.tail_code(idx, 1)
+                exit_op, exit_val, exit_next = self.exit_key(idx)
+                key = (exit_op, exit_val, exit_next, op, val)
+                if key not in groups:
+                    groups[key] = []
+                    keys.append(key)
+                groups[key].append(idx)
+            for key in keys:
+                sharing = groups[key]
+                size = 1
+                while len(sharing) >= 2:
+                    narrowed = self.narrow_tails(sharing, size + 1)
+                    if len(narrowed) < 2:
+                        break
+                    sharing = narrowed
+                    size += 1
+                if len(sharing) < 2 or size < min_size:
+                    continue
+                self.share_tail(sharing, size)
+                changed = True
+                merged = True
+        if merged:
+            self.link()
+        return merged
+
+    def narrow_tails(self, sharing, depth):
+        """Return the most blocks of `sharing` with the same code at `depth`.
+        """
+        parts = {}
+        keys = []
+        for idx in sharing:
+            if self.tail_size(idx) < depth:
+                continue
+            code = self.tail_code(idx, depth)
+            if code not in parts:
+                parts[code] = []
+                keys.append(code)
+            parts[code].append(idx)
+        best = []
+        for code in keys:
+            if len(parts[code]) > len(best):
+                best = parts[code]
+        return best
+
+    def share_tail(self, sharing, size):
+        """Make blocks of `sharing` jump to a copy of their common tail."""
+        first = self.blocks[sharing[0]]
+        copy = -1
+        for idx in sharing:
+            if self.tail_size(idx) == size:
+                copy = idx
+                break
+        if copy < 0:
+            copy = len(self.blocks)
+            start = self.tail_size(sharing[0]) - size
+            codes = first.codes[start:len(first.codes)]
+            block = Block(codes, [[] for _ in codes])
+            block.next = first.next
+            self.blocks.append(block)
+            self.order.append(copy)
+        shared = self.blocks[copy]
+        shared_start = self.tail_size(copy) - size
+        for idx in sharing:
+            if idx == copy:
+                continue
+            block = self.blocks[idx]
+            start = self.tail_size(idx) - size
+            for i in range(0, size):
+                comments = block.comments[start + i]
+                if comments:
+                    shared.comments[shared_start + i] = shared.comments[shared_start + i] + comments
+            block.codes = block.codes[0:start] + [(c.OP_JMP, copy)]
+            block.comments = block.comments[0:start] + [[]]
+
+    def linearize(self):
+        """Return `(lines, label_map, comments)` of blocks in `order`.
+
+        A jump to the next block is dropped and a jump is added where a
+        block does not fall through to the next block any more. Labels are
+        the block indices of jump targets.
+        """
+        lines = []
+        comments = []
+        starts = [-1] * len(self.blocks)
+        order = self.order
+        for i, idx in enumerate(order):
+            block = self.blocks[idx]
+            starts[idx] = len(lines)
+            follow = order[i + 1] if i + 1 < len(order) else -1
+            size = len(block.codes)
+            if block.last_op() == c.OP_JMP and block.target() == follow:
+                size -= 1
+            for j in range(0, size):
+                lines.append(block.codes[j])
+                comments.append(block.comments[j])
+            if block.falls_through() and block.next != follow:
+                if block.next < 0:
+                    lines.append((c.OP_HALT, -1))
+                else:
+                    lines.append((c.OP_JMP, block.next))
+                comments.append([])
+
+        label_map = {}
+        for op, val in lines:
+            if op in c.OP_JUMPS:
+                assert starts[val] >= 0  # a target must be in order
+                label_map[val] = starts[val]
+        return lines, label_map, comments
+
+
+def flatten(block_maps):
+    """Concatenate the lists of each block to a list of each line.
+
+    Only for a graph from `build` which is not changed yet, of which
+    blocks are in the order of the lines.
+    """
+    line_map = []
+    for block_map in block_maps:
+        line_map += block_map
+    return line_map
+
+
+def build(lines, label_map, comments=None):
+    """Return the linked `Graph` of `lines`.
+
+    `comments` are the debug comments of each line if there are.
+    """
+    size = len(lines)
+    leaders = [False] * (size + 1)
+    leaders[0] = True
+    end_targeted = False
+    for target in label_map.values():
+        leaders[target] = True
+        if target == size:
+            end_targeted = True
+    for pc in range(0, size):
+        op = lines[pc][0]
+        if op in c.OP_JUMPS or op == c.OP_HALT:
+            leaders[pc + 1] = True
+
+    block_map = [-1] * (size + 1)
+    blocks = []
+    start = 0
+    for pc in range(1, size + 1):
+        if pc == size or leaders[pc]:
+            block_map[start] = len(blocks)
+            codes = lines[start:pc]
+            if comments is None:
+                block_comments = [[] for _ in codes]
+            else:
+                block_comments = comments[start:pc]
+            blocks.append(Block(codes, block_comments))
+            start = pc
+    if end_targeted:
+        # a jump to the end halts
+        block_map[size] = len(blocks)
+        blocks.append(Block([], []))
+
+    for idx, block in enumerate(blocks):
+        if idx + 1 < len(blocks):
+            block.next = idx + 1
+        if block.codes:
+            op, val = block.codes[-1]
+            if op in c.OP_JUMPS:
+                block.codes[-1] = (op, block_map[label_map[val]])
+    graph = Graph(blocks)
+    graph.link()
+    return graph
@@ -5,13 +5,15 @@ from __future__ import absolute_import
 
 import os
 import aheui.const as c
+from aheui import bytecode
+from aheui import cfg
 from aheui._compat import unichr, _unicode, PY3
 
 
-OP_NAMES = [None, None, u'DIV', u'ADD', u'MUL', u'MOD', u'POP', u'PUSH', u'DUP', u'SEL', u'MOV', None, u'CMP', None, u'BRZ', None, u'SUB', u'SWAP', u'HALT', u'POPNUM', u'POPCHAR', u'PUSHNUM', u'PUSHCHAR', u'BRPOP2', u'BRPOP1', u'JMP']
+OP_NAMES = [None, None, u'DIV', u'ADD', u'MUL', u'MOD', u'POP', u'PUSH', u'DUP', u'SEL', u'MOV', None, u'CMP', None, u'BRZ', None, u'SUB', u'SWAP', u'HALT', u'POPNUM', u'POPCHAR', u'PUSHNUM', u'PUSHCHAR', u'PUSHADD', u'PUSHSUB', u'PUSHMUL', u'SWAPSUB', u'PUSHSWAPSUB', u'DUPBRZ', u'CMPBRZ', u'SUBBRZ', u'SWAPCMPBRZ', u'ADDMUL', u'POWMUL', u'BULKMOV', u'DIVAT', u'ADDAT', u'MULAT', u'MODAT', u'POPAT', u'DUPAT', u'CMPAT', u'SUBAT', u'SWAPAT', u'MOVTO', u'BRPOP2', u'BRPOP1', u'JMP']
 
-OP_HASOP = [0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 1, 0, 1, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1]
-OP_USEVAL = [0, 0, 0, 0, 0, 0, 0, 1, 0, 1, 1, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1]
+OP_HASOP = [0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 1, 0, 1, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1]
+OP_USEVAL = [0, 0, 0, 0, 0, 0, 0, 1, 0, 1, 1, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1]
 VAL_CONSTS = [0, 2, 4, 4, 2, 5, 5, 3, 5, 7, 9, 9, 7, 9, 9, 8, 4, 4, 6, 2, 4, 1, 3, 4, 3, 4, 4, 3]
 #             () ㄱ ㄲ ㄳ ㄴ ㄵ ㄶ ㄷ ㄹ ㄺ ㄻ ㄼ ㄽ ㄾ ㄿ ㅀ ㅁ ㅂ ㅄ ㅅ ㅆ ㅇ ㅈ ㅊ ㅋ ㅌ ㅍ ㅎ
 
@@ -78,10 +80,9 @@ class Debug(object):
         self.comments = []
         for i in range(0, len(self.lines)):
             self.comments.append([])
-        for (pos, dir, step), i in code_map.items():
-            if dir >= 3:
-                continue
-            char = primitive.pane[pos]
+        for key, i in code_map.items():
+            pos, dir, step = primitive.state_of(key)
+            char = primitive.char_at(pos)
             if char != u'\0':
                 self.comments[i].append(char)
 
@@ -114,73 +115,112 @@ class Debug(object):
             os.write(2, (u'%s\n' % _list(space)).encode('utf-8'))
 
 
+NONE_CELL = (c.OP_NONE, MV_NONE, -1)  # not a Hangul character
+
+
 class PrimitiveProgram(object):
+    """Code pane of the source text.
+
+    `rows[r][col]` is the pre-decoded `(op, mv, val)` of a cell. Every row is
+    occupied from column 0 to its end, including non-Hangul characters, so
+    a wrap is found in O(1) with the length of the row or with `col_first`
+    and `col_last`, the first and last rows occupying each column.
+    """
+
     def __init__(self, text):
         self.text = text
-        self.pane = {}
-
-        pc_row = 0
-        pc_col = 0
-        max_col = 0
-        for char in self.text:
+        rows = []
+        row = []
+        for char in text:
             if char == u'\n':
-                pc_row += 1
-                max_col = max(max_col, pc_col)
-                pc_col = 0
+                rows.append(row)
+                row = []
                 continue
             if u'가' <= char <= u'힣':
-                self.pane[pc_row, pc_col] = char
+                base = ord(char) - ord(u'가')
+                row.append((base // 588, (base // 28) % 21, base % 28))
             else:
-                self.pane[pc_row, pc_col] = u'\0'  # to mark empty space
-            pc_col += 1
-        max_col = max(max_col, pc_col)
+                row.append(NONE_CELL)  # to mark empty space
+        rows.append(row)
+        self.rows = rows
 
-        self.max_row = pc_row
+        max_col = 0
+        for row in rows:
+            max_col = max(max_col, len(row))
+        self.max_row = len(rows) - 1
         self.max_col = max_col
 
+        self.col_first = [-1] * (max_col + 1)
+        self.col_last = [-1] * (max_col + 1)
+        width = 0
+        for r in range(0, len(rows)):
+            for col in range(width, len(rows[r])):
+                self.col_first[col] = r
+            width = max(width, len(rows[r]))
+        width = 0
+        for r in range(len(rows) - 1, -1, -1):
+            for col in range(width, len(rows[r])):
+                self.col_last[col] = r
+            width = max(width, len(rows[r]))
+
+    def occupied(self, position):
+        r, col = position
+        return 0 <= r <= self.max_row and 0 <= col < len(self.rows[r])
+
     def decode(self, position):
-        code = self.pane.get(position, u'\0')
-        if code == u'\0':
-            return c.OP_NONE, MV_NONE, -1  # do nothing
-        base = ord(code) - ord(u'가')
-        op_code = base // 588
-        mv_code = (base // 28) % 21
-        val_code = base % 28
-        return op_code, mv_code, val_code
+        if not self.occupied(position):
+            return NONE_CELL  # do nothing
+        r, col = position
+        return self.rows[r][col]
+
+    def char_at(self, position):
+        """Return the Hangul character at `position`, or NUL if there is not."""
+        op_code, mv_code, val_code = self.decode(position)
+        if val_code < 0:
+            return u'\0'
+        return unichr(0xac00 + op_code * 588 + mv_code * 28 + val_code)
+
+    def state_key(self, position, direction, step):
+        """Encode a state of the serializer to an integer."""
+        r, col = position
+        cell = r * self.max_col + col
+        return (cell * 5 + direction + 2) * 2 + step - 1
+
+    def state_of(self, key):
+        """Decode `state_key` to `(position, direction, step)`."""
+        step = key % 2 + 1
+        key //= 2
+        direction = key % 5 - 2
+        cell = key // 5
+        return (cell // self.max_col, cell % self.max_col), direction, step
 
     def advance_position(self, position, direction, step=1):
-        r, c = position
+        """Move by `step` to `direction`, wrapping around at the edge.
+
+        Beyond the last cell of a row or a column, every cell is empty until
+        the wrap, so it goes to the wrap target at once.
+        """
+        r, col = position
         d = direction
         if d == DIR_DOWN:
             r += step
-            if r > self.max_row:
-                r = 0
-                while (r, c) not in self.pane:
-                    r += 1
-            p = r, c
+            if r > self.col_last[col]:
+                r = self.col_first[col]
         elif d == DIR_RIGHT:
-            c += step
-            if c > self.max_col:
-                c = 0
-            p = r, c
+            col += step
+            if col >= len(self.rows[r]):
+                col = 0
         elif d == DIR_UP:
             r -= step
-            if r < 0:
-                r = self.max_row
-                while (r, c) not in self.pane:
-                    r -= 1
-            p = r, c
+            if r < self.col_first[col]:
+                r = self.col_last[col]
         elif d == DIR_LEFT:
-            c -= step
-            if c < 0:
-                c = self.max_col
-                while (r, c) not in self.pane:
-                    c -= 1
-            p = r, c
+            col -= step
+            if col < 0:
+                col = len(self.rows[r]) - 1
         else:
             assert False
-        # print 'move:', position, '->', p, DIR_NAMES[direction], step
-        return p
+        return r, col
 
 
 def dir_from_mv(mv_code, direction, step):
@@ -216,6 +256,411 @@ def dir_from_mv(mv_code, direction, step):
         return direction, step
 
 
+FOLD_MIN = -0x80000000
+FOLD_MAX = 0x7fffffff
+
+
+def fold_constant(op, v2, v1):
+    """Return `v2 op v1` of a binary operation."""
+    if op == c.OP_ADD:
+        return v2 + v1
+    elif op == c.OP_SUB:
+        return v2 - v1
+    elif op == c.OP_MUL:
+        return v2 * v1
+    elif op == c.OP_DIV:
+        return v2 // v1
+    elif op == c.OP_MOD:
+        return v2 % v1
+    elif op == c.OP_CMP:
+        return int(v2 >= v1)
+    else:
+        assert False
+
+
+class StackFolder(object):
+    """Evaluate codes of a block on pending constants of a storage.
+
+    Constants pushed are kept pending and operations on them are done at
+    compile time. Codes which need the real storage get the pending
+    constants pushed first. An emitted OP_DUP followed by OP_POP and two
+    emitted OP_SWAPs cancel each other.
+
+    On a stack, the pending constants are on the top. On the queue, they
+    are at the tail and operations reach them only after the values before
+    them are popped, so the exact size of the queue must be known.
+    """
+
+    def __init__(self):
+        self.codes = []
+        self.comments = []
+        self.pending = []
+        self.buffer = []  # comments of dropped codes for the next code
+        self.barrier = 0  # codes before it are not cancelled
+
+    def emit(self, op, val, comments):
+        self.codes.append((op, val))
+        self.comments.append(self.buffer + comments)
+        self.buffer = []
+
+    def flush(self):
+        for value in self.pending:
+            self.emit(c.OP_PUSH, value, [])
+        self.pending = []
+
+    def cancel(self, op):
+        """Drop the last code if `op` after it does nothing together."""
+        if len(self.codes) <= self.barrier:
+            return False
+        last = self.codes[-1][0]
+        if not ((op == c.OP_POP and last == c.OP_DUP) or (op == c.OP_SWAP and last == c.OP_SWAP)):
+            return False
+        self.codes.pop()
+        self.buffer = self.comments.pop() + self.buffer
+        return True
+
+    def add(self, op, val, comments):
+        """Evaluate an instruction of the stack selected region."""
+        pending = self.pending
+        if op == c.OP_NONE:
+            self.buffer += comments
+            return
+        elif op == c.OP_PUSH:
+            pending.append(val)
+            self.buffer += comments
+            return
+        elif op == c.OP_DUP and pending:
+            pending.append(pending[-1])
+            self.buffer += comments
+            return
+        elif op == c.OP_POP and pending:
+            pending.pop()
+            self.buffer += comments
+            return
+        elif op == c.OP_SWAP and len(pending) >= 2:
+            pending[-1], pending[-2] = pending[-2], pending[-1]
+            self.buffer += comments
+            return
+        elif op in c.OP_BINARYOPS and len(pending) >= 2:
+            # division by zero is left to the runtime and results out of
+            # int32 are not folded to keep them in machine integers
+            if not ((op == c.OP_DIV or op == c.OP_MOD) and pending[-1] == 0):
+                v = fold_constant(op, pending[-2], pending[-1])
+                if FOLD_MIN <= v <= FOLD_MAX:
+                    pending.pop()
+                    pending[-1] = v
+                    self.buffer += comments
+                    return
+        elif (op == c.OP_BRPOP1 or op == c.OP_BRPOP2) and len(pending) >= c.OP_REQSIZE[op]:
+            self.buffer += comments
+            return  # never taken
+        elif op == c.OP_BRZ and pending:
+            v = pending.pop()
+            self.flush()
+            if v == 0:
+                self.emit(c.OP_JMP, val, comments)
+            else:
+                self.buffer += comments
+            return
+        self.flush()
+        if (op == c.OP_POP or op == c.OP_SWAP) and self.cancel(op):
+            self.buffer += comments
+            return
+        self.emit(op, val, comments)
+        if op not in [c.OP_POP, c.OP_SWAP, c.OP_DUP] and op not in c.OP_BINARYOPS:
+            self.barrier = len(self.codes)
+
+    def add_queue(self, op, val, comments, size):
+        """Evaluate an instruction of the queue selected region.
+
+        `size` is the size of the queue before the instruction, including
+        the pending constants.
+        """
+        pending = self.pending
+        real = size - len(pending)  # values before the pending constants
+        assert real >= 0
+        if op == c.OP_NONE:
+            self.buffer += comments
+            return
+        elif op == c.OP_PUSH:
+            pending.append(val)
+            self.buffer += comments
+            return
+        elif op == c.OP_POP and real == 0 and pending:
+            pending.pop(0)
+            self.buffer += comments
+            return
+        elif op == c.OP_DUP and real == 0 and pending:
+            pending.insert(0, pending[0])
+            self.buffer += comments
+            return
+        elif op == c.OP_SWAP and real == 0 and len(pending) >= 2:
+            pending[0], pending[1] = pending[1], pending[0]
+            self.buffer += comments
+            return
+        elif op in c.OP_BINARYOPS and real == 0 and len(pending) >= 2:
+            if not ((op == c.OP_DIV or op == c.OP_MOD) and pending[0] == 0):
+                v = fold_constant(op, pending[1], pending[0])
+                if FOLD_MIN <= v <= FOLD_MAX:
+                    pending.pop(0)
+                    pending.pop(0)
+                    pending.append(v)
+                    self.buffer += comments
+                    return
+        elif op == c.OP_BRPOP1 or op == c.OP_BRPOP2:
+            self.flush()
+            if size >= c.OP_REQSIZE[op]:
+                self.buffer += comments
+            else:
+                self.emit(c.OP_JMP, val, comments)
+            return
+        elif op == c.OP_BRZ and real == 0 and pending:
+            v = pending.pop(0)
+            self.flush()
+            if v == 0:
+                self.emit(c.OP_JMP, val, comments)
+            else:
+                self.buffer += comments
+            return
+        elif (op in [c.OP_POP, c.OP_DUP, c.OP_POPNUM, c.OP_POPCHAR] and real >= 1) or (op == c.OP_SWAP and real >= 2):
+            # only values before the pending constants are used
+            if (op == c.OP_POP or op == c.OP_SWAP) and self.cancel(op):
+                self.buffer += comments
+                return
+            self.emit(op, val, comments)
+            if op == c.OP_POPNUM or op == c.OP_POPCHAR:
+                self.barrier = len(self.codes)
+            return
+        self.flush()
+        if (op == c.OP_POP or op == c.OP_SWAP) and self.cancel(op):
+            self.buffer += comments
+            return
+        self.emit(op, val, comments)
+        if op not in [c.OP_POP, c.OP_SWAP, c.OP_DUP] and op not in c.OP_BINARYOPS:
+            self.barrier = len(self.codes)
+
+    def add_raw(self, op, val, comments):
+        """Add an instruction as it is."""
+        self.flush()
+        self.emit(op, val, comments)
+        self.barrier = len(self.codes)
+
+
+LINEAR_UNKNOWN = (-2, 0, 0)
+
+
+def combine_linear(op, v2, v1):
+    """Return `v2 op v1` of linear values or `LINEAR_UNKNOWN`.
+
+    A linear value `(var, mul, add)` is `mul * var + add` of a variable, or
+    the constant `add` if `var` is -1. See `match_loop`.
+    """
+    var2, mul2, add2 = v2
+    var1, mul1, add1 = v1
+    if var2 >= 0 and var1 >= 0:
+        return LINEAR_UNKNOWN
+    if var2 < 0 and var1 < 0:
+        if (op == c.OP_DIV or op == c.OP_MOD) and add1 == 0:
+            return LINEAR_UNKNOWN
+        return (-1, 0, fold_constant(op, add2, add1))
+    if op == c.OP_ADD:
+        if var2 >= 0:
+            return (var2, mul2, add2 + add1)
+        return (var1, mul1, add1 + add2)
+    elif op == c.OP_SUB:
+        if var2 >= 0:
+            return (var2, mul2, add2 - add1)
+        return (var1, -mul1, add2 - add1)
+    elif op == c.OP_MUL:
+        if var2 >= 0:
+            return (var2, mul2 * add1, add2 * add1)
+        return (var1, mul1 * add2, add1 * add2)
+    return LINEAR_UNKNOWN
+
+
+def match_loop(codes):
+    """Return the bulk operation of the body of a counting loop.
+
+    `codes` run on a stack with the counter on the top. Each value is
+    evaluated as a linear value of the values at the start, where the
+    variable 0 is the counter, 1 is the value below it and so on. Return
+    `(OP_NONE, -1)` if they do not make any of the loops of
+    `Compiler.optimize_loop`.
+
+    An OP_BRPOP is allowed only if it never jumps with 2 values on the stack
+    at the start, which the bulk operations check.
+    """
+    stack = []
+    depth = 0  # variables used from the start
+    moves = []  # (storage, value) of OP_MOVs
+    for op, val in codes:
+        if op == c.OP_NONE:
+            continue
+        elif op == c.OP_PUSH:
+            stack.append((-1, 0, val))
+            continue
+        elif op == c.OP_BRPOP1 or op == c.OP_BRPOP2:
+            if c.OP_REQSIZE[op] - len(stack) + depth > 2:
+                return c.OP_NONE, -1
+            continue
+        while len(stack) < c.OP_REQSIZE[op]:
+            stack.insert(0, (depth, 1, 0))
+            depth += 1
+        if op == c.OP_POP:
+            stack.pop()
+        elif op == c.OP_DUP:
+            stack.append(stack[-1])
+        elif op == c.OP_SWAP:
+            stack[-1], stack[-2] = stack[-2], stack[-1]
+        elif op == c.OP_MOV:
+            moves.append((val, stack.pop()))
+        elif op in c.OP_BINARYOPS:
+            v1 = stack.pop()
+            v2 = stack.pop()
+            value = combine_linear(op, v2, v1)
+            if value[0] == LINEAR_UNKNOWN[0]:
+                return c.OP_NONE, -1
+            for number in value:
+                if not FOLD_MIN <= number <= FOLD_MAX:
+                    return c.OP_NONE, -1
+            stack.append(value)
+        else:
+            return c.OP_NONE, -1
+    if depth < 2 or not stack or stack[-1] != (0, 1, -1):
+        return c.OP_NONE, -1
+
+    if not moves and len(stack) == depth:
+        for idx in range(2, depth):
+            if stack[-1 - idx] != (idx, 1, 0):
+                return c.OP_NONE, -1
+        var, mul, add = stack[-2]
+        if var == 1 and mul == 1:
+            return c.OP_ADDMUL, add
+        elif var == 1 and add == 0:
+            return c.OP_POWMUL, mul
+    elif len(moves) == 1 and moves[0][1] == (1, 1, 0) and len(stack) == depth - 1:
+        for idx in range(1, depth - 1):
+            if stack[-1 - idx] != (idx + 1, 1, 0):
+                return c.OP_NONE, -1
+        return c.OP_BULKMOV, moves[0][0]
+    return c.OP_NONE, -1
+
+
+PREFIX_FUEL = 100000  # codes `optimize_prefix` runs at most
+PREFIX_LIMIT = 4096  # values and outputs `optimize_prefix` keeps at most
+MERGE_MIN = 2  # codes `optimize_merge` shares at least
+
+
+class PrefixEvaluator(object):
+    """Run primitive codes at compile time from the start of the program.
+
+    It stops before the first code which depends on the input or the port,
+    or which it cannot run exactly like `mainloop`: an underflow, a division
+    by zero or a value out of the 32-bit range. It also stops when the
+    stored values and outputs exceed `PREFIX_LIMIT`.
+    """
+
+    def __init__(self, lines, label_map):
+        self.lines = lines
+        self.label_map = label_map
+        self.storages = [[] for _ in range(0, c.STORAGE_COUNT)]
+        self.selected = 0
+        self.outputs = []  # (OP_POPNUM or OP_POPCHAR, value)
+        self.pc = 0
+        self.steps = 0
+        self.count = 0  # values in storages and outputs
+        self.halted = False
+
+    def run(self, fuel):
+        while self.steps < fuel:
+            if self.pc >= len(self.lines):
+                self.halted = True
+                return
+            if not self.step():
+                return
+            self.steps += 1
+
+    def pop(self):
+        storage = self.storages[self.selected]
+        if self.selected == c.VAL_QUEUE:
+            return storage.pop(0)
+        return storage.pop()
+
+    def step(self):
+        """Run the code at `pc` and return True, or return False to stop."""
+        op, val = self.lines[self.pc]
+        storage = self.storages[self.selected]
+        is_queue = self.selected == c.VAL_QUEUE
+        if len(storage) < c.OP_REQSIZE[op]:
+            if op == c.OP_BRPOP1 or op == c.OP_BRPOP2:
+                self.pc = self.label_map[val]
+                return True
+            return False
+        if c.OP_STACKADD[op] > c.OP_STACKDEL[op] and self.count >= PREFIX_LIMIT:
+            return False
+
+        if op == c.OP_NONE or op == c.OP_BRPOP1 or op == c.OP_BRPOP2:
+            pass
+        elif op == c.OP_PUSH:
+            storage.append(val)
+            self.count += 1
+        elif op == c.OP_POP:
+            self.pop()
+            self.count -= 1
+        elif op == c.OP_DUP:
+            if is_queue:
+                storage.insert(0, storage[0])
+            else:
+                storage.append(storage[-1])
+            self.count += 1
+        elif op == c.OP_SWAP:
+            if is_queue:
+                storage[0], storage[1] = storage[1], storage[0]
+            else:
+                storage[-1], storage[-2] = storage[-2], storage[-1]
+        elif op in c.OP_BINARYOPS:
+            if is_queue:
+                v1 = storage[0]
+                v2 = storage[1]
+            else:
+                v1 = storage[-1]
+                v2 = storage[-2]
+            if (op == c.OP_DIV or op == c.OP_MOD) and v1 == 0:
+                return False
+            value = fold_constant(op, v2, v1)
+            if not FOLD_MIN <= value <= FOLD_MAX:
+                return False
+            self.pop()
+            self.pop()
+            storage.append(value)
+            self.count -= 1
+        elif op == c.OP_POPNUM or op == c.OP_POPCHAR:
+            self.outputs.append((op, self.pop()))
+        elif op == c.OP_SEL:
+            if val == c.VAL_PORT:
+                return False
+            self.selected = val
+        elif op == c.OP_MOV:
+            if val == c.VAL_PORT:
+                return False
+            self.storages[val].append(self.pop())
+        elif op == c.OP_BRZ:
+            self.count -= 1
+            if self.pop() == 0:
+                self.pc = self.label_map[val]
+                return True
+        elif op == c.OP_JMP:
+            self.pc = self.label_map[val]
+            return True
+        else:
+            # OP_HALT, inputs and superinstructions
+            if op == c.OP_HALT:
+                self.halted = True
+            return False
+        self.pc += 1
+        return True
+
+
 class Compiler(object):
     """Compiler manipulate any kinds of aheui related code representation.
 
@@ -253,26 +698,26 @@ class Compiler(object):
             2. Stop the job and go to next job in the queue.
         4. If there is `OP_HALT`, go to next job in the queue.
         5. If `job_queue` is empty, drop any other instructions not on the path.
+
+        A visited state of position, direction and step is keyed by
+        `primitive.state_key`. `code_map` maps it to the address of its code
+        and `branch_map` to the address of its `OP_BRPOP*` check.
         """
         job_queue = [((0, 0), DIR_DOWN, 1, -1)]
+        job_index = 0
 
         lines = []
         label_map = {}
         code_map = {}
+        branch_map = {}
 
-        def add(lines, op, operand, debug='unknown'):
-            idx = len(lines)
-            lines.append((op, operand))
-            #  print idx, OP_NAMES[op], operand, debug
-            return idx
-
-        while job_queue:
-            position, direction, step, marker = job_queue.pop(0)
-            #  print 'dequeue:', position, DIR_NAMES[direction], step, marker
+        while job_index < len(job_queue):
+            position, direction, step, marker = job_queue[job_index]
+            job_index += 1
             if marker >= 0:
                 label_map[marker] = len(lines)
             while True:
-                if position not in primitive.pane:
+                if not primitive.occupied(position):
                     position = primitive.advance_position(position, direction, step)
                     continue
 
@@ -281,20 +726,16 @@ class Compiler(object):
                 if mv in MV_DETERMINISTICS:
                     direction = new_direction
                     step = new_step
-                if (position, direction, step) in code_map:
-                    index = code_map[position, direction, step]
-                    posdir = position, direction + 10, step
-                    code_map[position, direction + 5, step] = len(lines)
-                    if posdir in code_map:
-                        target = code_map[posdir]
-                    else:
-                        target = index
+                key = primitive.state_key(position, direction, step)
+                if key in code_map:
+                    # jump to the branch check of the code if there is
+                    target = branch_map.get(key, code_map[key])
                     label_id = len(lines)
                     label_map[label_id] = target
-                    add(lines, c.OP_JMP, label_id, 'jump label for %s %s' % (position, direction))
+                    lines.append((c.OP_JMP, label_id))
                     break
 
-                code_map[position, direction, step] = len(lines)
+                code_map[key] = len(lines)
 
                 direction = new_direction
                 step = new_step
@@ -317,63 +758,196 @@ class Compiler(object):
                         pass
 
                     if op == c.OP_PUSH:
-                        add(lines, op, VAL_CONSTS[val])
+                        lines.append((op, VAL_CONSTS[val]))
                     else:
                         req_size = c.OP_REQSIZE[op]
                         if req_size > 0:
                             brop = c.OP_BRPOP1 if req_size == 1 else c.OP_BRPOP2
                             idx = len(lines)
-                            code_map[position, direction + 10, step] = idx  # mark branch
-                            add(lines, brop, idx, 'brpop')
-                            code_map[position, direction, step] = idx + 1  # mark code
+                            key = primitive.state_key(position, direction, step)
+                            branch_map[key] = idx  # mark branch
+                            lines.append((brop, idx))
+                            code_map[key] = idx + 1  # mark code
                             if OP_USEVAL[op]:
                                 if op == c.OP_BRZ:
-                                    add(lines, op, idx, 'brpop-brz')
+                                    lines.append((op, idx))
                                     alt_position = primitive.advance_position(position, -direction, step)
-                                    #  print 'enqueue:', alt_position, DIR_NAMES[-direction], step, idx
                                     job_queue.append((alt_position, -direction, step, idx))
                                 else:
-                                    add(lines, op, val, 'brpop-useval')
+                                    lines.append((op, val))
                             else:
-                                add(lines, op, -1, 'brpop-noval')
+                                lines.append((op, -1))
 
                             alt_position = primitive.advance_position(position, -direction, step)
-                            #  print 'enqueue:', alt_position, DIR_NAMES[-direction], step, idx
                             job_queue.append((alt_position, -direction, step, idx))
                         else:
                             if OP_USEVAL[op]:
-                                add(lines, op, val, 'safe-useval')
+                                lines.append((op, val))
                             else:
-                                add(lines, op, -1, 'safe-noval')
+                                lines.append((op, -1))
                                 if op == c.OP_HALT:
                                     break
                 position = primitive.advance_position(position, direction, step)
         return lines, label_map, code_map
 
     def optimize1(self):
+        self.optimize_split()
         self.optimize_jump()
-        reachability = self.optimize_deadcode1()
-        self.optimize_adjust(reachability)
+        graph = self.build_graph()
+        self.optimize_deadcode1(graph)
+        self.write_graph(graph)
 
         reachability = self.optimize_operation(True)
         self.optimize_jump()
         self.optimize_adjust(reachability)
 
+        reachability = self.optimize_fusion()
+        self.optimize_adjust(reachability)
+
     def optimize2(self):
         """Optimize generated codes.
 
         Do not decouple each steps or change the order. It is important.
         """
+        self.optimize_split()
         self.optimize_jump()
-        reachability = self.optimize_deadcode2()
-        self.optimize_adjust(reachability)
-
-        self.optimize_order()
+        graph = self.build_graph()
+        self.optimize_deadcode2(graph)
+        self.optimize_order(graph)
+        self.optimize_stack(graph)
+        self.optimize_merge(graph)
+        self.write_graph(graph)
 
         reachability = self.optimize_operation(True)
         self.optimize_jump()
         self.optimize_adjust(reachability)
 
+        self.optimize_loop()
+        reachability = self.optimize_fusion()
+        self.optimize_adjust(reachability)
+        self.optimize_storage()
+
+    def optimize3(self):
+        """Optimize like `optimize2` and evaluate the prefix of the program."""
+        self.optimize2()
+        if self.optimize_prefix():
+            self.optimize2()
+
+    def build_graph(self):
+        """Return the `cfg.Graph` of the codes and their debug comments."""
+        comments = self.debug.comments if self.debug else None
+        return cfg.build(self.lines, self.label_map, comments)
+
+    def write_graph(self, graph):
+        """Replace the codes by the blocks of `graph` in its layout."""
+        self.lines, self.label_map, comments = graph.linearize()
+        if self.debug:
+            self.debug = Debug(self.lines, comments)
+
+    def label_targets(self):
+        """Return the set of jump targets as a dict of pcs."""
+        label_targets = {}
+        for target in self.label_map.values():
+            label_targets[target] = True
+        return label_targets
+
+    def optimize_split(self):
+        """Split superinstructions back to primitive instructions.
+
+        Other optimizers only understand primitive instructions. Bytecodes
+        loaded from `.aheuic` may already be fused, so split them first and
+        let `optimize_fusion` fuse them again at the end. Bulk operations
+        are dropped because the loops after them do the same, and
+        `optimize_loop` adds them again. Specialized operations are turned
+        back to generic ones for `optimize_storage` to specialize them
+        again.
+        """
+        fused_parts = {}
+        for fused, parts in c.OP_FUSIONS:
+            fused_parts[fused] = parts
+        generics = {}
+        for specialized, generic in c.OP_SPECIALIZATIONS:
+            generics[specialized] = generic
+
+        new_index = [0] * (len(self.lines) + 1)
+        new = []
+        new_comments = []
+        changed = False
+        for i, (op, val) in enumerate(self.lines):
+            new_index[i] = len(new)
+            comments = self.debug.comments[i] if self.debug else []
+            if op in c.OP_BULKS:
+                changed = True
+                continue
+            if op in generics:
+                changed = True
+                op = generics[op]
+                val = val if OP_USEVAL[op] else -1
+            if op not in fused_parts:
+                new.append((op, val))
+                new_comments.append(comments)
+                continue
+            changed = True
+            for part in fused_parts[op]:
+                new.append((part, val if OP_USEVAL[part] else -1))
+                new_comments.append(comments)
+                comments = []
+        new_index[len(self.lines)] = len(new)
+        if not changed:
+            return
+
+        for label, target in self.label_map.items():
+            self.label_map[label] = new_index[target]
+        self.lines = new
+        if self.debug:
+            self.debug = Debug(new, new_comments)
+
+    def optimize_fusion(self):
+        """Fuse frequent instruction sequences to superinstructions.
+
+        Each superinstruction saves dispatches and stack size bookkeeping of
+        `mainloop`. See `OP_FUSIONS` for the patterns.
+
+        1. Scan the code from the start to the end.
+        2. Try the longest pattern first at each instruction.
+        3. Parts except the first one must not be a jump target.
+        4. Replace the first part to the superinstruction and drop the others.
+        """
+        lines = self.lines
+        label_targets = self.label_targets()
+
+        removed = [0] * len(lines)
+        i = 0
+        while i < len(lines):
+            for fused, parts in c.OP_FUSIONS:
+                size = len(parts)
+                if i + size > len(lines):
+                    continue
+                value = -1
+                for j in range(0, size):
+                    op, val = lines[i + j]
+                    if op != parts[j]:
+                        break
+                    if j > 0 and (i + j) in label_targets:
+                        break
+                    if OP_USEVAL[op]:
+                        value = val
+                else:
+                    break
+            else:
+                i += 1
+                continue
+
+            lines[i] = (fused, value)
+            for j in range(1, size):
+                removed[i + j] = 1
+                if self.debug:
+                    self.debug.comments[i] += self.debug.comments[i + j]
+                    self.debug.comments[i + j] = []
+            i += size
+
+        return [int(not r) for r in removed]
+
     def optimize_adjust(self, reachability):
         useless_map = [0] * len(reachability)
         count = 0
@@ -426,225 +1000,268 @@ class Compiler(object):
             if not changed:
                 break
 
-    def optimize_deadcode1(self):
+    def optimize_deadcode1(self, graph):
         """Optimize codes by removing unreachable codes.
 
         Because unreachable path is already removed by `serialize`, this path
         mainly remove useless OP_BRPOPs and its branches.
 
-        1. Trace current stack size from first line.
-        2. If there is enough stack, do not trace OP_BRPOPs' jumps.
-        3. If optimizer met OP_SEL, assume stacksize is 0 from there.
-        4. If optimizer passes same codes,
-            1. If assumed stacksize is smaller than before, keep going to trace.
-            2. Otherwise it is not worth to do. Stop.
-        5. Stop if OP_HALT.
-        6. Drop useless OP_BRPOPs and any codes out of path.
+        1. Trace the least stack size at the start of each block from the
+            entry block. See `compute_useless_brpops`.
+        2. If optimizer met OP_SEL, assume stacksize is 0 from there.
+        3. Drop useless OP_BRPOPs and the blocks out of path.
         """
-        min_stacksize_map = [-1] * len(self.lines)
-        job_queue = [(0, 0)]
-        job_index = 0
-
-        while job_index < len(job_queue):
-            pc, stacksize = job_queue[job_index]
-            job_index += 1
-            while pc < len(self.lines):
-                op, val = self.lines[pc]
-                min_stacksize = min_stacksize_map[pc]
-                if min_stacksize >= 0:
-                    min_diff = min_stacksize - stacksize
-                    if min_diff <= 0 and min_diff <= c.OP_STACKADD[op] - c.OP_STACKDEL[op]:
-                        break
-                if op == c.OP_BRPOP1 or op == c.OP_BRPOP2:
-                    reqsize = c.OP_REQSIZE[op]
-                    if stacksize >= reqsize:
-                        pc += 1
-                        continue
-                    else:
-                        min_stacksize_map[pc] = stacksize
-                        job_queue.append((self.label_map[val], stacksize))
-                else:
-                    min_stacksize_map[pc] = stacksize  # min(min_stacksize, stacksize)
-                    stacksize -= c.OP_STACKDEL[op]
-                    if stacksize < 0:
-                        stacksize = 0
-                    stacksize += c.OP_STACKADD[op]
-                    if op == c.OP_BRZ:
-                        job_queue.append((self.label_map[val], stacksize))
-                    elif op == c.OP_JMP:
-                        pc = self.label_map[val]
-                        continue
-                    elif op == c.OP_SEL:
-                        min_stacksize_map[pc] = stacksize
-                        stacksize = 0
-                    elif op == c.OP_MOV:
-                        pass  # stacksize += 1
-                    elif op == c.OP_HALT:
-                        break
-                pc += 1
+        useless = self.compute_useless_brpops(graph, False)
+        self.remove_deadcode(graph, useless)
 
-        reachability = [int(size >= 0) for size in min_stacksize_map]
-        return reachability
-
-    def optimize_deadcode2(self):
-        min_stacksize_map = [[-1] * c.STORAGE_COUNT] * len(self.lines)
-        label_targets = list(self.label_map.values())
-        job_queue = [(0, 0, [0] * c.STORAGE_COUNT)]
-        job_index = 0
+    def optimize_deadcode2(self, graph):
+        """Optimize codes by removing unreachable codes.
 
-        def min_list(l1, l2):
-            if l1[0] == -1:
-                return l2[:]
-            return [min(l1[i], l2[i]) for i in range(0, c.STORAGE_COUNT)]
+        Like `optimize_deadcode1`, but the sizes of all storages are traced
+        over OP_SEL and OP_MOV.
+        """
+        useless = self.compute_useless_brpops(graph, True)
+        self.remove_deadcode(graph, useless)
 
-        while job_index < len(job_queue):
-            pc, selected, stacksizes = job_queue[job_index]
-            job_index += 1
-            while pc < len(self.lines):
-                stacksize = stacksizes[selected]
-                assert stacksize >= 0
-                op, val = self.lines[pc]
-                min_stacksizes = min_stacksize_map[pc]
-                if min_stacksizes[selected] >= 0:
-                    min_diff = min_stacksizes[selected] - stacksizes[selected]
-                    if min_diff <= - c.OP_STACKDEL[op] + c.OP_STACKADD[op] and min_list(min_stacksizes, stacksizes) == min_stacksizes:
-                        break
-                if op == c.OP_BRPOP1 or op == c.OP_BRPOP2:
-                    reqsize = c.OP_REQSIZE[op]
-                    if stacksize >= reqsize and pc not in label_targets:
-                        pc += 1
-                        continue
-                    else:
-                        min_stacksize_map[pc] = min_list(min_stacksizes, stacksizes)
-                        job_queue.append((self.label_map[val], selected, stacksizes[:]))
-                else:
-                    min_stacksize_map[pc] = min_list(min_stacksizes, stacksizes)
-                    stacksize -= c.OP_STACKDEL[op]
-                    if stacksize < 0:
-                        stacksize = 0
-                    stacksize += c.OP_STACKADD[op]
-                    stacksizes[selected] = stacksize
-                    if op == c.OP_BRZ:
-                        job_queue.append((self.label_map[val], selected, stacksizes[:]))
-                    elif op == c.OP_JMP:
-                        pc = self.label_map[val]
-                        continue
-                    elif op == c.OP_SEL:
-                        min_stacksize_map[pc] = min_list(min_stacksizes, stacksizes)
-                        selected = val
-                    elif op == c.OP_MOV:
-                        stacksizes[val] += 1
-                    elif op == c.OP_HALT:
-                        break
-                pc += 1
+    def remove_deadcode(self, graph, useless):
+        """Drop OP_BRPOPs at the end of `useless` blocks and the blocks out of
+        path from the layout of `graph`.
 
-        reachability = [int(sizes[0] >= 0) for sizes in min_stacksize_map]
-        return reachability
+        Debug comments of a dropped OP_BRPOP are moved to the code before it
+        or the first code of the next block.
+        """
+        blocks = graph.blocks
+        for idx, block in enumerate(blocks):
+            op = block.last_op()
+            if not useless[idx] or (op != c.OP_BRPOP1 and op != c.OP_BRPOP2):
+                continue
+            block.codes.pop()
+            comments = block.comments.pop()
+            if block.comments:
+                block.comments[-1] = block.comments[-1] + comments
+            elif block.next >= 0 and blocks[block.next].comments:
+                next_comments = blocks[block.next].comments
+                next_comments[0] = comments + next_comments[0]
+        graph.link()
+        reachable = graph.reachability()
+        graph.order = [idx for idx in graph.order if reachable[idx]]
+
+    def optimize_order(self, graph):
+        """Lay out blocks to remove jumps to the next block.
+
+        See `Graph.chain_layout` for the layout. Blocks chained only to each
+        other are joined by `Graph.join_chains`, so the passes after it see
+        the codes between them in a block.
+        """
+        graph.chain_layout()
+        graph.join_chains()
 
-    def optimize_order(self):
-        lines = self.lines
-        hints = [x for x in range(0, len(lines))]
-        while True:
-            jump_map = {}
-            jump_rmap = {}
-            for dep, (op, v) in enumerate(lines):
-                if op == c.OP_JMP:
-                    dest = self.label_map[v]
-                    jump_map[dep] = dest
-                    if dest in jump_rmap:
-                        jump_rmap[dest] = -1
-                    else:
-                        jump_rmap[dest] = dep
+    def optimize_merge(self, graph):
+        """Share identical code paths.
 
-            for i in range(1, len(lines)):
+        Codes before the same jump, or falling through to the same code, are
+        run only in a copy and the others jump to it. Serialized programs
+        have many of them from the same cells read in different directions.
+        See `Graph.merge_tails`.
+        """
+        if graph.merge_tails(MERGE_MIN):
+            graph.chain_layout()
+
+    def optimize_stack(self, graph):
+        """Optimize codes by evaluating each block on an abstract stack.
+
+        1. Build basic blocks. Only the first code of a block can be a jump
+            target.
+        2. Run each code which runs only with a stack selected on
+            `StackFolder`, which keeps pushed constants pending and folds
+            operations, OP_DUP, OP_POP and OP_SWAP on them.
+        3. Push the pending constants before any other code, so the stack
+            has the same values at the end of the block and at each
+            OP_BRPOP as before.
+        4. A branch on pending constants is resolved at compile time.
+
+        The codes are analyzed by `compute_queue_map` and
+        `compute_queue_sizes` on `graph`.
+        """
+        queue_map = self.compute_queue_map(graph)
+        queue_sizes = self.compute_queue_sizes(graph)
+        for idx, block in enumerate(graph.blocks):
+            folder = StackFolder()
+            in_queue = False
+            for i, (op, val) in enumerate(block.codes):
+                queue_size = queue_sizes[idx][i]
+                if in_queue != (queue_size >= 0):
+                    folder.flush()
+                    in_queue = queue_size >= 0
+                if queue_size >= 0:
+                    folder.add_queue(op, val, block.comments[i], queue_size)
+                elif queue_map[idx][i] == 0:
+                    folder.add(op, val, block.comments[i])
+                else:
+                    folder.add_raw(op, val, block.comments[i])
+            folder.flush()
+            if folder.buffer and folder.codes:
+                folder.comments[-1] += folder.buffer
+            block.codes = folder.codes
+            block.comments = folder.comments
+        graph.link()
+
+    def optimize_prefix(self, fuel=PREFIX_FUEL):
+        """Replace the start of the program by its result at compile time.
+
+        `PrefixEvaluator` runs the codes until the first code it cannot run,
+        up to `fuel` codes. The codes are replaced by:
+
+        1. OP_PUSH and OP_POPNUM or OP_POPCHAR of each output.
+        2. If the program halted, OP_PUSH of its exit code and OP_HALT.
+        3. Otherwise, OP_SEL and OP_PUSHes of each storage with values,
+            OP_SEL of the selected storage and OP_JMP to the code it stopped
+            at.
+
+        Return whether the codes are changed. The codes left unreachable are
+        removed by the next `optimize2`.
+        """
+        self.optimize_split()
+        evaluator = PrefixEvaluator(self.lines, self.label_map)
+        evaluator.run(fuel)
+        if evaluator.steps == 0:
+            return False
 
-                if i not in jump_rmap:
-                    continue
-                f = jump_rmap[i]
-                if f == -1:
-                    continue
-                if i - 1 not in jump_map:
-                    continue
-                ix = i
-                while ix + 1 < len(lines):
-                    ix += 1
-                    if ix in jump_map:
-                        break
-                    if ix in jump_rmap:
-                        ix = -1
-                        break
-                    if lines[ix][0] in c.OP_BRANCHES:
-                        ix = -1
-                        break
+        lines = []
+        for op, value in evaluator.outputs:
+            lines.append((c.OP_PUSH, value))
+            lines.append((op, -1))
+        label_map = {}
+        if evaluator.halted:
+            storage = evaluator.storages[evaluator.selected]
+            if storage:
+                if evaluator.selected == c.VAL_QUEUE:
+                    lines.append((c.OP_PUSH, storage[0]))
                 else:
-                    ix = -1
-                if ix < 0:
-                    continue
-                if ix == f:
+                    lines.append((c.OP_PUSH, storage[-1]))
+            lines.append((c.OP_HALT, -1))
+            prefix_size = len(lines)
+        else:
+            selected = 0
+            for idx, storage in enumerate(evaluator.storages):
+                if not storage:
                     continue
+                if idx != selected:
+                    lines.append((c.OP_SEL, idx))
+                    selected = idx
+                for value in storage:
+                    lines.append((c.OP_PUSH, value))
+            if selected != evaluator.selected:
+                lines.append((c.OP_SEL, evaluator.selected))
+            prefix_size = len(lines) + 1
+            resume = 0
+            for label, target in self.label_map.items():
+                label_map[label] = target + prefix_size
+                if label >= resume:
+                    resume = label + 1
+            label_map[resume] = evaluator.pc + prefix_size
+            lines.append((c.OP_JMP, resume))
+            lines += self.lines
 
-                assert f > 0  # rpython hint
-                if ix < f:
-                    """
-                    ... JMP(i-1) | XXX(i) ... JMP(ix) | ... | JMP->i(f) | ...
-                       b1                  b2           b3        x       b4
-                    """
-                    size = ix - i + 1
-                    diff = f - ix
-                    for label, dest in self.label_map.items():
-                        if i <= dest <= ix:  # b2
-                            self.label_map[label] += diff - 1
-                        elif ix < dest <= f:  # b3
-                            self.label_map[label] -= size
-                        elif f < dest:  # b4
-                            self.label_map[label] -= 1
-                    b1 = lines[:i]
-                    b2 = lines[i:ix + 1]
-                    b3 = lines[ix + 1:f]
-                    b4 = lines[f + 1:]
-                    lines = b1 + b3 + b2 + b4
-                    hints = (
-                        hints[:i] + hints[ix + 1:f] + hints[i:ix + 1] + hints[f + 1:]
-                    )
-                else:
-                    """
-                    ... | JMP->i(f) | ... JMP(i-1) | XXX(i) ... JMP(ix) | ...
-                     b1      x            b2                 b3            b4
-                    """
-                    size = ix - i + 1
-                    diff = i - f
-                    for label, dest in self.label_map.items():
-                        if i <= dest <= ix:  # b3
-                            self.label_map[label] -= diff
-                        elif f <= dest < i:  # b2
-                            self.label_map[label] += size - 1
-                        elif ix < dest:  # b4
-                            self.label_map[label] -= 1
-                    b1 = lines[:f]
-                    b2 = lines[f + 1:i]
-                    b3 = lines[i:ix + 1]
-                    b4 = lines[ix + 1:]
-                    lines = b1 + b3 + b2 + b4
-                    hints = (
-                        hints[:f] + hints[i:ix + 1] + hints[f + 1:i] + hints[ix + 1:]
-                    )
-                break
-            else:
-                break
-        labels = []
-        for op, v in lines:
-            if op in c.OP_JUMPS:
-                labels.append(v)
-        unused_labels = []
-        for label in self.label_map.keys():
-            if label not in labels:
-                unused_labels.append(label)
-        for label in unused_labels:
-            del self.label_map[label]
+        if self.debug:
+            comments = [[] for _ in range(0, prefix_size)]
+            if not evaluator.halted:
+                comments += self.debug.comments
+            self.debug = Debug(lines, comments)
         self.lines = lines
+        self.label_map = label_map
+        return True
+
+    def optimize_loop(self):
+        """Add bulk operations to counting loops of stacks.
+
+        A loop is:
+
+            L:  DUP
+                BRZ <exit>
+                <codes without jumps, I/O and OP_SEL>
+                JMP L
+
+        with OP_BRPOPs which never jump while there are 2 values or more.
+
+        and the codes decrease the counter on the top by 1 and keep the
+        other values but the value below the counter, which is:
+
+        1. OP_ADDMUL: added by the operand.
+        2. OP_POWMUL: multiplied by the operand.
+        3. OP_BULKMOV: moved to the storage of the operand.
+
+        The bulk operation at L runs the rest of the loop at once and leaves
+        0 on the top, so the loop exits at once. It does nothing if it may
+        not do the same as the loop, then the loop runs as it is.
+        """
+        lines = self.lines
+        queue_map = cfg.flatten(self.compute_queue_map(self.build_graph()))
+        label_targets = self.label_targets()
+
+        bulks = {}
+        for i in range(0, len(lines) - 1):
+            if i not in label_targets or queue_map[i] != 0:
+                continue
+            start = i
+            while start < len(lines) and (lines[start][0] == c.OP_BRPOP1 or lines[start][0] == c.OP_BRPOP2):
+                start += 1
+            if start + 1 >= len(lines) or lines[start][0] != c.OP_DUP or lines[start + 1][0] != c.OP_BRZ:
+                continue
+            end = start + 2
+            while end < len(lines) and lines[end][0] not in c.OP_BRZS \
+                    and lines[end][0] != c.OP_JMP and lines[end][0] != c.OP_HALT:
+                end += 1
+            if end >= len(lines) or lines[end][0] != c.OP_JMP or self.label_map[lines[end][1]] != i:
+                continue
+            op, val = match_loop(lines[start + 2:end])
+            if op != c.OP_NONE:
+                bulks[i] = (op, val)
+        if not bulks:
+            return
+
+        new_index = [0] * (len(lines) + 1)
+        new = []
+        new_comments = []
+        for i, line in enumerate(lines):
+            new_index[i] = len(new)
+            if i in bulks:
+                new.append(bulks[i])
+                new_comments.append([])
+            new.append(line)
+            new_comments.append(self.debug.comments[i] if self.debug else [])
+        new_index[len(lines)] = len(new)
+        for label, target in self.label_map.items():
+            self.label_map[label] = new_index[target]
+        self.lines = new
         if self.debug:
-            new_comments = [self.debug.comments[h] for h in hints]
-            self.debug = Debug(lines, new_comments)
+            self.debug = Debug(new, new_comments)
+
+    def optimize_storage(self):
+        """Specialize codes on the storage selected at compile time.
+
+        Where every path agrees on the selected storage by
+        `compute_selected_map`, operations on a stack without operands are
+        replaced by their `AT` versions with the index of the stack, and
+        OP_MOV to another storage by OP_MOVTO. They run on the stack or
+        move to the target without looking up the selected storage. Codes
+        on the queue, the port or an unknown storage are kept generic.
+        """
+        specialized_ops = {}
+        for specialized, generic in c.OP_SPECIALIZATIONS:
+            specialized_ops[generic] = specialized
+        selected_map = cfg.flatten(self.compute_selected_map(self.build_graph()))
+        lines = self.lines
+        for pc in range(0, len(lines)):
+            op, val = lines[pc]
+            selected = selected_map[pc]
+            if selected < 0 or op not in specialized_ops:
+                continue
+            if op == c.OP_MOV:
+                if val != selected:
+                    lines[pc] = (c.OP_MOVTO, val)
+            elif selected != c.VAL_QUEUE and selected != c.VAL_PORT:
+                lines[pc] = (specialized_ops[op], selected)
 
     def optimize_operation(self, optimize_dup=False):
         """Optimize codes by removing constant operation.
@@ -664,40 +1281,15 @@ class Compiler(object):
         7. If 3 instructions don't includes labels for jump, potential queue
             codes and consists of only constants instructions, merge it.
         """
-        job_queue = [(0, 0)]
-        job_index = 0
-
         lines = self.lines
-        queue_map = [-1] * len(lines)
-        while job_index < len(job_queue):
-            pc, in_queue = job_queue[job_index]
-            job_index += 1
-            while pc < len(lines):
-                op, val = lines[pc]
-                if queue_map[pc] >= 0:
-                    if in_queue == 0 or queue_map[pc] == 1:
-                        break
-                queue_map[pc] = in_queue
-                if op in [c.OP_BRZ, c.OP_BRPOP1, c.OP_BRPOP2]:
-                    job_queue.append((pc + 1, in_queue))
-                    job_queue.append((self.label_map[val], in_queue))
-                    break
-                elif op == c.OP_JMP:
-                    job_queue.append((self.label_map[val], in_queue))
-                    break
-                else:
-                    pc += 1
-                    if op == c.OP_SEL:
-                        in_queue = int(val == c.VAL_QUEUE or val == c.VAL_PORT)
-                    elif op == c.OP_HALT:
-                        break
+        queue_map = cfg.flatten(self.compute_queue_map(self.build_graph()))
 
         if self.debug:
             for pc, queueable in enumerate(queue_map):
                 if queueable and u'QUEUE' not in self.debug.comments[pc]:
                     self.debug.comments[pc].append(u'QUEUE')
 
-        label_targets = list(self.label_map.values())
+        label_targets = self.label_targets()
         label_rmap = {}
         for k, v in self.label_map.items():
             if v in label_rmap:
@@ -767,21 +1359,12 @@ class Compiler(object):
             if op not in c.OP_BINARYOPS:
                 #  print 'not binops'
                 continue
+            if (op == c.OP_DIV or op == c.OP_MOD) and v1 == 0:
+                continue
 
-            if op == c.OP_ADD:
-                v = v2 + v1
-            elif op == c.OP_SUB:
-                v = v2 - v1
-            elif op == c.OP_MUL:
-                v = v2 * v1
-            elif op == c.OP_DIV:
-                v = v2 // v1
-            elif op == c.OP_MOD:
-                v = v2 % v1
-            elif op == c.OP_CMP:
-                v = int(v2 >= v1)
-            else:
-                assert False
+            v = fold_constant(op, v2, v1)
+            if not FOLD_MIN <= v <= FOLD_MAX:
+                continue
 
             #  print 'optimized!'
             if is_jmp:
@@ -837,33 +1420,223 @@ class Compiler(object):
             for i in range(0, len(lines))
         ]
 
-    def compute_control_reachability(self):
-        reachability = [0 for _ in range(0, len(self.lines))]
-        job_queue = [0]
-        job_index = 0
+    def compute_queue_map(self, graph):
+        """Return whether each code may run with a queue or a port selected,
+        as a list for each block of `graph`.
 
+        1 if it may, 0 if it runs only with stacks selected and -1 if it is
+        unreachable.
+        """
+        blocks = graph.blocks
+        queue_map = [[-1] * len(block.codes) for block in blocks]
+        entries = [-1] * len(blocks)
+        job_queue = []
+        if blocks:
+            job_queue.append((0, 0))
+        job_index = 0
         while job_index < len(job_queue):
-            pc = job_queue[job_index]
+            idx, in_queue = job_queue[job_index]
             job_index += 1
-            while pc < len(self.lines) and not reachability[pc]:
-                reachability[pc] = 1
-                op, val = self.lines[pc]
-                if op in [c.OP_BRZ, c.OP_BRPOP1, c.OP_BRPOP2]:
-                    job_queue.append(pc + 1)
-                    job_queue.append(self.label_map[val])
-                    break
-                elif op == c.OP_JMP:
-                    job_queue.append(self.label_map[val])
-                    break
-                elif op == c.OP_HALT:
-                    break
-                else:
-                    pc += 1
+            if entries[idx] >= 0 and (in_queue == 0 or entries[idx] == 1):
+                continue
+            entries[idx] = in_queue
+            block_map = queue_map[idx]
+            for i, (op, val) in enumerate(blocks[idx].codes):
+                if block_map[i] < in_queue:
+                    block_map[i] = in_queue
+                if op == c.OP_SEL:
+                    in_queue = int(val == c.VAL_QUEUE or val == c.VAL_PORT)
+            for succ in blocks[idx].succs:
+                job_queue.append((succ, in_queue))
+
+        return queue_map
+
+    def compute_selected_map(self, graph):
+        """Return the index of the storage selected before each code, as a
+        list for each block of `graph`.
+
+        -1 if paths disagree and -2 if it is unreachable.
+        """
+        blocks = graph.blocks
+        selected_map = [[-2] * len(block.codes) for block in blocks]
+        entries = [-2] * len(blocks)
+        job_queue = []
+        if blocks:
+            job_queue.append((0, 0))
+        job_index = 0
+        while job_index < len(job_queue):
+            idx, selected = job_queue[job_index]
+            job_index += 1
+            known = entries[idx]
+            if known != -2:
+                if known != selected:
+                    selected = -1
+                if known == selected:
+                    continue
+            entries[idx] = selected
+            block_map = selected_map[idx]
+            for i, (op, val) in enumerate(blocks[idx].codes):
+                if block_map[i] != -2 and block_map[i] != selected:
+                    selected = -1
+                block_map[i] = selected
+                if op == c.OP_SEL:
+                    selected = val
+            for succ in blocks[idx].succs:
+                job_queue.append((succ, selected))
+
+        return selected_map
+
+    def compute_queue_sizes(self, graph):
+        """Return the exact size of the queue before each code which runs
+        only with the queue selected, or -1 if it is not known, as a list for
+        each block of `graph`.
+
+        Every storage is empty at the start. The selected storage and the
+        size of the queue are traced on every path and become unknown where
+        paths disagree.
+        """
+        blocks = graph.blocks
+        selected_map = [[-2] * len(block.codes) for block in blocks]  # -2 if unreachable, -1 if unknown
+        size_map = [[-1] * len(block.codes) for block in blocks]
+        entries = [(-2, -1)] * len(blocks)
+        job_queue = []
+        if blocks:
+            job_queue.append((0, 0, 0))
+        job_index = 0
+        while job_index < len(job_queue):
+            idx, selected, size = job_queue[job_index]
+            job_index += 1
+            known_selected, known_size = entries[idx]
+            if known_selected != -2:
+                if known_selected != selected:
+                    selected = -1
+                if known_size != size:
+                    size = -1
+                if selected == known_selected and size == known_size:
+                    continue
+            entries[idx] = (selected, size)
+            block_selected = selected_map[idx]
+            block_size = size_map[idx]
+            for i, (op, val) in enumerate(blocks[idx].codes):
+                if block_selected[i] != -2:
+                    if block_selected[i] != selected:
+                        selected = -1
+                    if block_size[i] != size:
+                        size = -1
+                block_selected[i] = selected
+                block_size[i] = size
+                if op == c.OP_SEL:
+                    selected = val
+                elif op == c.OP_MOV:
+                    if selected == c.VAL_QUEUE or selected == -1:
+                        size = -1 if size <= 0 or selected == -1 else size - 1
+                    if val == c.VAL_QUEUE and size >= 0:
+                        size += 1
+                elif selected == c.VAL_QUEUE:
+                    if size >= 0:
+                        size -= c.OP_STACKDEL[op]
+                        if size < 0:
+                            size = -1
+                        else:
+                            size += c.OP_STACKADD[op]
+                elif selected == -1:
+                    if c.OP_STACKDEL[op] or c.OP_STACKADD[op]:
+                        size = -1
+            for succ in blocks[idx].succs:
+                job_queue.append((succ, selected, size))
+
+        queue_sizes = []
+        for idx, block_size in enumerate(size_map):
+            block_selected = selected_map[idx]
+            queue_sizes.append([
+                block_size[i] if block_selected[i] == c.VAL_QUEUE else -1
+                for i in range(0, len(block_size))])
+        return queue_sizes
+
+    def compute_useless_brpops(self, graph, keep_sizes):
+        """Return whether OP_BRPOP at the end of each block never branches.
+
+        1. Trace the least size of each storage at the start of each block
+            from the entry, for each storage selected there.
+        2. Trace a block again only if a path reaches it with a smaller size.
+        3. Skip the codes of `Block.stack_end` by the stack effect of the
+            block if the selected storage has `Block.stack_req` values.
+        4. Without `keep_sizes`, forget the sizes at OP_SEL and do not count
+            values moved by OP_MOV.
+
+        Blocks out of path are useless too. Nothing reaches them once the
+        useless OP_BRPOPs are dropped.
+        """
+        blocks = graph.blocks
+        useless = [True] * len(blocks)
+        min_sizes = {}  # (block index, selected storage) -> least sizes
+        job_queue = []
+        if blocks:
+            job_queue.append((0, 0, [0] * c.STORAGE_COUNT))
+        job_index = 0
+        while job_index < len(job_queue):
+            idx, selected, sizes = job_queue[job_index]
+            job_index += 1
+            key = (idx, selected)
+            if key in min_sizes:
+                known = min_sizes[key]
+                lowered = False
+                for i in range(0, c.STORAGE_COUNT):
+                    if sizes[i] < known[i]:
+                        lowered = True
+                    else:
+                        sizes[i] = known[i]
+                if not lowered:
+                    continue
+            min_sizes[key] = sizes[:]
+
+            block = blocks[idx]
+            start = 0
+            if sizes[selected] >= block.stack_req:
+                sizes[selected] += block.stack_diff
+                start = block.stack_end
+            for i in range(start, len(block.codes)):
+                op, val = block.codes[i]
+                size = sizes[selected] - c.OP_STACKDEL[op]
+                if size < 0:
+                    size = 0
+                sizes[selected] = size + c.OP_STACKADD[op]
+                if op == c.OP_SEL:
+                    selected = val
+                    if not keep_sizes:
+                        sizes = [0] * c.STORAGE_COUNT
+                elif op == c.OP_MOV and keep_sizes:
+                    sizes[val] += 1
+
+            op = block.last_op()
+            target = block.target()
+            if op == c.OP_BRPOP1 or op == c.OP_BRPOP2:
+                if sizes[selected] < c.OP_REQSIZE[op]:
+                    useless[idx] = False
+                    job_queue.append((target, selected, sizes[:]))
+            elif target >= 0:
+                job_queue.append((target, selected, sizes[:]))
+            if block.falls_through() and block.next >= 0:
+                job_queue.append((block.next, selected, sizes))
+        return useless
 
+    def compute_control_reachability(self):
+        graph = cfg.build(self.lines, self.label_map)
+        reachable = graph.reachability()
+        reachability = []
+        for idx, block in enumerate(graph.blocks):
+            reachability += [int(reachable[idx])] * len(block.codes)
         return reachability
 
     def write_bytecode(self):
-        """Write bytecodes data text."""
+        """Write bytecodes in the v2 format of `aheui.bytecode`."""
+        return bytecode.dump(self.lines, self.label_map)
+
+    def write_bytecode_v1(self):
+        """Write bytecodes data text in the v1 format.
+
+        Operands are truncated to 24 bits and negative operands are 0.
+        """
         codes = []
         for op, val in self.lines:
             if op in c.OP_JUMPS:
@@ -888,7 +1661,21 @@ class Compiler(object):
         return code
 
     def read_bytecode(self, text):
-        """Read bytecodes from data text."""
+        """Read bytecodes from data text in either v1 or v2 format."""
+        if bytecode.is_v2(text):
+            opcodes, values, targets = bytecode.parse(text)
+            self.debug = None
+            self.lines = []
+            for idx in range(0, len(opcodes)):
+                self.lines.append((opcodes[idx], values[idx]))
+            self.label_map = {}
+            for idx in range(0, len(targets)):
+                self.label_map[idx] = targets[idx]
+        else:
+            self.read_bytecode_v1(text)
+
+    def read_bytecode_v1(self, text):
+        """Read bytecodes from data text in the v1 format."""
         if PY3:
             text = text.decode('utf-8')
         self.debug = None
@@ -912,9 +1699,12 @@ class Compiler(object):
 
     def write_asm(self, commented=True):
         """Write assembly representation with comments."""
+        label_targets = {}
+        for target in self.label_map.values():
+            label_targets[target] = True
         codes = []
         for i, (op, val) in enumerate(self.lines):
-            if i in self.label_map.values():
+            if i in label_targets:
                 label_str = u'L%s:' % _unicode(i)
                 codes.append(padding(label_str, 8))
             else:
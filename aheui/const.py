@@ -1,10 +1,10 @@
 # coding: utf-8
 # flake8: noqa: E501
 
-OP_REQSIZE = [0, 0, 2, 2, 2, 2, 1, 0, 1, 0, 1, 0, 2, 0, 1, 0, 2, 2, 0, 1, 1, 0, 0, 2, 1, 0]
-OP_STACKDEL = [0, 0, 2, 2, 2, 2, 1, 0, 1, 0, 1, 0, 2, 0, 1, 0, 2, 2, 0, 1, 1, 0, 0, 0, 0, 0]
-OP_STACKADD = [0, 0, 1, 1, 1, 1, 0, 1, 2, 0, 0, 0, 1, 0, 0, 0, 1, 2, 0, 0, 0, 1, 1, 0, 0, 0]
-#              ㄱ ㄲ ㄴ ㄷ ㄸ ㄹ ㅁ ㅂ ㅃ ㅅ ㅆ ㅇ ㅈ ㅉ ㅊ ㅋ ㅌ ㅍ ㅎ ln lc pn pc b2 b1 j
+OP_REQSIZE = [0, 0, 2, 2, 2, 2, 1, 0, 1, 0, 1, 0, 2, 0, 1, 0, 2, 2, 0, 1, 1, 0, 0, 1, 1, 1, 2, 1, 1, 2, 2, 2, 0, 0, 0, 2, 2, 2, 2, 1, 1, 2, 2, 2, 1, 2, 1, 0]
+OP_STACKDEL = [0, 0, 2, 2, 2, 2, 1, 0, 1, 0, 1, 0, 2, 0, 1, 0, 2, 2, 0, 1, 1, 0, 0, 1, 1, 1, 2, 1, 1, 2, 2, 2, 0, 0, 0, 2, 2, 2, 2, 1, 1, 2, 2, 2, 1, 0, 0, 0]
+OP_STACKADD = [0, 0, 1, 1, 1, 1, 0, 1, 2, 0, 0, 0, 1, 0, 0, 0, 1, 2, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 0, 2, 1, 1, 2, 0, 0, 0, 0]
+#              ㄱ ㄲ ㄴ ㄷ ㄸ ㄹ ㅁ ㅂ ㅃ ㅅ ㅆ ㅇ ㅈ ㅉ ㅊ ㅋ ㅌ ㅍ ㅎ ln lc pn pc pa ps pm ws pw db cb sb wc am pm bm n@ d@ t@ r@ m@ p@ j@ t@ p@ mt b2 b1 j
 VAL_QUEUE = 21
 VAL_PORT = 27
 STORAGE_COUNT = 28
@@ -34,10 +34,71 @@ OP_POPNUM = 19
 OP_POPCHAR = 20
 OP_PUSHNUM = 21
 OP_PUSHCHAR = 22
+
+# superinstructions
+OP_PUSHADD = 23
+OP_PUSHSUB = 24
+OP_PUSHMUL = 25
+OP_SWAPSUB = 26
+OP_PUSHSWAPSUB = 27
+OP_DUPBRZ = 28
+OP_CMPBRZ = 29
+OP_SUBBRZ = 30
+OP_SWAPCMPBRZ = 31
+
+# bulk operations of loops, see `Compiler.optimize_loop`
+OP_ADDMUL = 32
+OP_POWMUL = 33
+OP_BULKMOV = 34
+
+# operations on a storage known at compile time, see
+# `Compiler.optimize_storage`. The operand is the index of the stack, or the
+# target storage of OP_MOVTO.
+OP_DIVAT = 35
+OP_ADDAT = 36
+OP_MULAT = 37
+OP_MODAT = 38
+OP_POPAT = 39
+OP_DUPAT = 40
+OP_CMPAT = 41
+OP_SUBAT = 42
+OP_SWAPAT = 43
+OP_MOVTO = 44
+
 OP_BRPOP2 = -3  # special
 OP_BRPOP1 = -2  # special
 OP_JMP = -1  # special
 
-OP_BRANCHES = [OP_BRZ, OP_BRPOP1, OP_BRPOP2]
+OP_BRZS = [OP_BRZ, OP_DUPBRZ, OP_CMPBRZ, OP_SUBBRZ, OP_SWAPCMPBRZ]
+OP_BRANCHES = OP_BRZS + [OP_BRPOP1, OP_BRPOP2]
 OP_JUMPS = OP_BRANCHES + [OP_JMP]
 OP_BINARYOPS = [OP_DIV, OP_ADD, OP_MUL, OP_MOD, OP_CMP, OP_SUB]
+OP_BULKS = [OP_ADDMUL, OP_POWMUL, OP_BULKMOV]
+
+# (specialized, generic) opcodes
+OP_SPECIALIZATIONS = [
+    (OP_DIVAT, OP_DIV),
+    (OP_ADDAT, OP_ADD),
+    (OP_MULAT, OP_MUL),
+    (OP_MODAT, OP_MOD),
+    (OP_POPAT, OP_POP),
+    (OP_DUPAT, OP_DUP),
+    (OP_CMPAT, OP_CMP),
+    (OP_SUBAT, OP_SUB),
+    (OP_SWAPAT, OP_SWAP),
+    (OP_MOVTO, OP_MOV),
+]
+
+# Longer patterns first. Each fused opcode carries the operand of its only
+# operand-using part, so it still fits in a single (op, value) line.
+OP_FUSIONS = [
+    (OP_SWAPCMPBRZ, [OP_SWAP, OP_CMP, OP_BRZ]),
+    (OP_PUSHSWAPSUB, [OP_PUSH, OP_SWAP, OP_SUB]),
+    (OP_PUSHADD, [OP_PUSH, OP_ADD]),
+    (OP_PUSHSUB, [OP_PUSH, OP_SUB]),
+    (OP_PUSHMUL, [OP_PUSH, OP_MUL]),
+    (OP_SWAPSUB, [OP_SWAP, OP_SUB]),
+    (OP_DUPBRZ, [OP_DUP, OP_BRZ]),
+    (OP_CMPBRZ, [OP_CMP, OP_BRZ]),
+    (OP_SUBBRZ, [OP_SUB, OP_BRZ]),
+]
@@ -74,4 +74,9 @@ def is_unicodepoint(r):
     return 0 <= r._size and r.int_le(0x110000)
 
 
+def nbytes(big):
+    """Approximate heap bytes of the object and its digits."""
+    return 32 + 8 * big.numdigits()
+
+
 MINUS1 = fromlong(-1)
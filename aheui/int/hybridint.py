@@ -0,0 +1,174 @@
+"""Machine integers promoted to `rbigint` only when they overflow.
+
+An `Int` holds a machine integer in `value` while `big` is None. Otherwise
+`big` holds an `rbigint` which does not fit in a machine integer, so a value
+has only one representation and a zero is always a machine integer.
+
+Arithmetic on two machine integers is checked by `ovfcheck` and only an
+overflowing operation is done again with `rbigint`. Every `rbigint` result is
+demoted back to a machine integer when it fits.
+"""
+
+from __future__ import absolute_import
+
+from rpython.rlib import jit
+from rpython.rlib.rarithmetic import ovfcheck, r_longlong
+from rpython.rlib.rbigint import rbigint
+
+from aheui._compat import _bytestr
+
+
+NAME = 'hybridint'
+
+INT_BYTES = 24  # header, value and big
+
+
+class Int(object):
+    _immutable_fields_ = ['value', 'big']
+
+    def __init__(self, value, big=None):
+        self.value = value
+        self.big = big
+
+
+def _demote(big):
+    try:
+        return Int(big.toint())
+    except OverflowError:
+        return Int(0, big)
+
+
+def _tobig(r):
+    if r.big is None:
+        return rbigint.fromint(r.value)
+    return r.big
+
+
+def fromstr(s):
+    return _demote(rbigint.fromstr(s))
+
+
+def fromint(v):
+    return Int(v)
+
+
+def fromlong(v):
+    return _demote(rbigint.fromlong(v))
+
+
+def toint(r):
+    if r.big is None:
+        return r.value
+    return r.big.toint()
+
+
+def tolonglong(r):
+    if r.big is None:
+        return r_longlong(r.value)
+    return r.big.tolonglong()
+
+
+def str(r):
+    if r.big is None:
+        return _bytestr(r.value)
+    return r.big.str()
+
+
+@jit.elidable
+def _big_add(r1, r2):
+    return _demote(_tobig(r1).add(_tobig(r2)))
+
+
+@jit.elidable
+def _big_sub(r1, r2):
+    return _demote(_tobig(r1).sub(_tobig(r2)))
+
+
+@jit.elidable
+def _big_mul(r1, r2):
+    return _demote(_tobig(r1).mul(_tobig(r2)))
+
+
+@jit.elidable
+def _big_div(r1, r2):
+    return _demote(_tobig(r1).div(_tobig(r2)))
+
+
+@jit.elidable
+def _big_mod(r1, r2):
+    return _demote(_tobig(r1).mod(_tobig(r2)))
+
+
+def add(r1, r2):
+    if r1.big is None and r2.big is None:
+        try:
+            return Int(ovfcheck(r1.value + r2.value))
+        except OverflowError:
+            pass
+    return _big_add(r1, r2)
+
+
+def sub(r1, r2):
+    if r1.big is None and r2.big is None:
+        try:
+            return Int(ovfcheck(r1.value - r2.value))
+        except OverflowError:
+            pass
+    return _big_sub(r1, r2)
+
+
+def mul(r1, r2):
+    if r1.big is None and r2.big is None:
+        try:
+            return Int(ovfcheck(r1.value * r2.value))
+        except OverflowError:
+            pass
+    return _big_mul(r1, r2)
+
+
+def div(r1, r2):
+    # division by zero raises ZeroDivisionError from rbigint as bigint does
+    if r1.big is None and r2.big is None and r2.value != 0:
+        try:
+            return Int(ovfcheck(r1.value // r2.value))
+        except OverflowError:
+            pass
+    return _big_div(r1, r2)
+
+
+def mod(r1, r2):
+    if r1.big is None and r2.big is None and r2.value != 0:
+        try:
+            return Int(ovfcheck(r1.value % r2.value))
+        except OverflowError:
+            pass
+    return _big_mod(r1, r2)
+
+
+@jit.elidable
+def _big_ge(r1, r2):
+    return _tobig(r1).ge(_tobig(r2))
+
+
+def ge(r1, r2):
+    if r1.big is None and r2.big is None:
+        return r1.value >= r2.value
+    return _big_ge(r1, r2)
+
+
+def is_zero(r):
+    return r.big is None and r.value == 0
+
+
+def is_unicodepoint(r):
+    return r.big is None and 0 <= r.value <= 0x110000
+
+
+def nbytes(r):
+    """Approximate heap bytes of the object and its digits."""
+    if r.big is None:
+        return INT_BYTES
+    return INT_BYTES + 32 + 8 * r.big.numdigits()
+
+
+MINUS1 = fromint(-1)
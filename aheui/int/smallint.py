@@ -73,4 +73,9 @@ def is_unicodepoint(r):
     return 0 < r <= 0x110000
 
 
+def nbytes(r):
+    """Machine integers are stored inline in their containers."""
+    return 0
+
+
 MINUS1 = Int(-1)
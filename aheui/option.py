@@ -4,35 +4,62 @@ from __future__ import absolute_import
 
 import os
 from aheui._argparse import ArgumentParser, ParserError
-from aheui._compat import bigint, PY3
+from aheui._compat import bigint, mmap_input, PY3
 from aheui.version import VERSION
 from aheui.warning import CommandLineArgumentWarning, warnings
+from aheui import bytecode
 from aheui import compile
 
 
 parser = ArgumentParser(prog='aheui')
-parser.add_argument('--opt', '-O', default='1', choices='0,1,2', description='Set optimization level.', full_description="""\t0: No optimization.
+parser.add_argument('--opt', '-O', default='1', choices='0,1,2,3', description='Set optimization level.', full_description="""\t0: No optimization.
 \t1: Quickly resolve deadcode by rough stacksize emulation and merge constant operations.
 \t2: Perfectly resolve deadcode by stacksize emulation, reserialize code chunks and merge constant operations.
+\t3: Optimize as 2 and run the program until the first input at compile time, then replace the run by its outputs and the values left in storages.
 """)
-parser.add_argument('--source', '-S', default='auto', choices='auto,bytecode,asm,text', description='Set source filetype.', full_description="""\t- `auto`: Guess the source type. `bytecode` if `.aheuic` or `End of bytecode` pattern in source. `asm` is `.aheuis`. `text` if `.aheui`. `text` is default.
+parser.add_argument('--source', '-S', default='auto', choices='auto,bytecode,asm,text', description='Set source filetype.', full_description="""\t- `auto`: Guess the source type. `bytecode` if `.aheuic`, the v2 bytecode header or `End of bytecode` pattern in source. `asm` is `.aheuis`. `text` if `.aheui`. `text` is default.
 \t- `bytecode`: Aheui bytecode. (Bytecode representation of `ahsembly`.
 \t- `asm`: See `ahsembly`.
 \t- `asm+comment`: Same as `asm` with comments.
 \t- usage: `--source=asm`, `-Sbytecode` or `-S text`
 """)
-parser.add_argument('--target', '-T', default='run', choices='run,bytecode,asm,asm+comment', description='Set target filetype.', full_description="""\t- `run`: Run given code.
+parser.add_argument('--target', '-T', default='run', choices='run,bytecode,asm,asm+comment,python', description='Set target filetype.', full_description="""\t- `run`: Run given code.
 \t- `bytecode`: Aheui bytecode. (Bytecode representation of `ahsembly`.
 \t- `asm`: See `ahsembly`.
+\t- `python`: Python source code generated by `--engine=transpile`. Not available in RPython build.
 \t- usage: `--target=asm`, `-Tbytecode` or `-T run`
 """)
 parser.add_argument('--output', '-o', default='', description='Output file. Default is ``. See details for each target. If the value is `-`, it is standard output.', full_description="""\t- `run` target: This option is not availble and ignored.
 \t- `bytecode` target: Default value is `.aheuic`
 \t- `asm` target: Default value is `.aheuis`
+\t- `python` target: Default value is `.py`
+""")
+parser.add_argument('--engine', '-E', default='vm', choices='vm,register,transpile', description='Set execution engine of `run` target.', full_description="""\t- `vm`: Run bytecodes on the virtual machine. JIT is enabled in RPython build.
+\t- `register`: Translate basic blocks to register codes and run them. Intermediate values in a block are not stored. JIT is enabled in RPython build.
+\t- `transpile`: Transpile bytecodes to a Python function and run it. It is much faster than `vm` on CPython. Not available in RPython build.
+\t- usage: `--engine=transpile`, `-Evm` or `-E vm`
 """)
 parser.add_argument('--cmd', '-c', default='', description='Program passed in as string')
 parser.add_argument('--no-c', '--no-c', narg='0', default='no', description='Do not generate `.aheuic` file automatically.', full_description='\tWhat is .aheuic? https://github.com/aheui/snippets/commit/cbb5a12e7cd2db771538ab28dfbc9ad1ada86f35\n')
 parser.add_argument('--warning-limit', '--warning-limit', default='', description='Set repetitive warning limit. '' fallbacks to environment variable `RPAHEUI_WARNING_LIMIT`. 0 means no warning. -1 means no limit. Default is 3.')
+parser.add_argument('--buffer', '--buffer', default='', choices='auto,line,full', description='Set output buffering of `run` target. '' fallbacks to environment variable `RPAHEUI_BUFFER`. Default is `auto`.', full_description="""\t- `auto`: `line` if the output is a terminal, otherwise `full`.
+\t- `line`: Flush the output when a newline is written.
+\t- `full`: Flush the output only when the buffer is full.
+\t- The output is always flushed before reading input and at exit.
+""")
+parser.add_argument('--profile', '--profile', default='', description='Run `run` target with execution counters and write the report to the given file.', full_description="""\t- The report has execution counts per opcode and per pc, taken and not-taken counts of branches and storage switches of `sel`.
+\t- Each pc is followed by its grid coordinates.
+\t- It always runs on the `vm` engine.
+""")
+parser.add_argument('--storage-stats', '--storage-stats', default='', choices='none,text,json', description='Write statistics of storages to standard error at exit of `run` target. '' fallbacks to environment variable `RPAHEUI_STORAGE_STATS`. Default is `none`.', full_description="""\t- Depth at exit, peak depth, total pushes and pops and approximate bytes of each storage.
+\t- `text`: Human-readable table of used storages.
+\t- `json`: JSON document of all storages.
+\t- Not available with `--engine=transpile`.
+""")
+parser.add_argument('--cache-dir', '--cache-dir', default='', description='Cache compiled programs in the given directory. '' fallbacks to environment variable `RPAHEUI_CACHE_DIR`. Default is no cache.', full_description="""\t- An entry is keyed by a hash of the source, the optimization level and the compiler version.
+\t- A matching entry is loaded instead of compiling and optimizing the source again.
+\t- Bytecode sources and programs compiled with debug information are not cached.
+""")
 parser.add_argument('--trace-limit', '--trace-limit', default='', description='Set JIT trace limit. '' fallbacks to environment variable `RPAHEUI_TRACE_LIMIT`.')
 parser.add_argument('--version', '-v', narg='-1', default='no', description='Show program version', message=('%s %s' % (VERSION, bigint.NAME)).encode('utf-8'))
 parser.add_argument('--help', '-h', narg='-1', default='no', description='Show this help text')
@@ -100,6 +127,15 @@ def open_input(filename):
     return os.open(filename, os.O_RDONLY, 0o777)
 
 
+def read_input(fp, may_be_bytecode):
+    """Read `fp`, or map it if it is a v2 bytecode file and mapping is supported."""
+    if may_be_bytecode:
+        mapped = mmap_input(fp)
+        if mapped is not None and bytecode.is_v2(mapped):
+            return mapped
+    return compile.read(fp)
+
+
 def process_options(argv, environ):
     try:
         kwargs, args = parser.parse_args(argv)
@@ -115,8 +151,10 @@ def process_options(argv, environ):
             fp = 0
             contents = compile.read(fp)
         else:
+            source = kwargs['source']
+            may_be_bytecode = source == 'bytecode' or (source == 'auto' and not filename.endswith('.aheui') and not filename.endswith('.aheuis'))
             fp = open_input(filename)
-            contents = compile.read(fp)
+            contents = read_input(fp, may_be_bytecode)
             os.close(fp)
     else:
         if len(args) != 1:
@@ -134,7 +172,7 @@ def process_options(argv, environ):
             source = 'bytecode'
         elif filename.endswith('.aheuis'):
             source = 'asm'
-        elif b'\xff\xff\xff\xff' in contents:
+        elif bytecode.is_v2(contents) or b'\xff\xff\xff\xff' in contents:
             source = 'bytecode'
         else:
             source = 'text'
@@ -173,6 +211,14 @@ def process_options(argv, environ):
                 else:
                     output += '.aheuis'
             comment_aheuis = target == 'asm+comment'
+        elif target == 'python':
+            output = filename
+            if output != '-':
+                if output.endswith('.aheui'):
+                    end = len(output) - len('.aheui')
+                    assert end >= 0
+                    output = output[:end]
+                output += '.py'
         elif target == 'run':
             output = '-'
         else:
@@ -185,4 +231,22 @@ def process_options(argv, environ):
     warning_limit = kwarg_or_environ_int(kwargs, environ, 'warning-limit', 'RPAHEUI_WARNING_LIMIT', 3)
     trace_limit = kwarg_or_environ_int(kwargs, environ, 'trace-limit', 'RPAHEUI_TRACE_LIMIT', -1)
 
-    return cmd, source, contents, opt_level, target, aheuic_output, comment_aheuis, output, warning_limit, trace_limit
+    engine = kwargs['engine']
+
+    buffer_source, buffer_mode = kwarg_or_environ(kwargs, environ, 'buffer', 'RPAHEUI_BUFFER')
+    if buffer_source == 0:
+        buffer_mode = 'auto'
+    elif buffer_mode not in ['auto', 'line', 'full']:
+        raise ParsingError('The value of RPAHEUI_BUFFER="%s" is not one of auto,line,full' % buffer_mode)
+
+    profile = kwargs['profile']
+
+    stats_source, storage_stats = kwarg_or_environ(kwargs, environ, 'storage-stats', 'RPAHEUI_STORAGE_STATS')
+    if stats_source == 0:
+        storage_stats = 'none'
+    elif storage_stats not in ['none', 'text', 'json']:
+        raise ParsingError('The value of RPAHEUI_STORAGE_STATS="%s" is not one of none,text,json' % storage_stats)
+
+    cache_dir = kwarg_or_environ(kwargs, environ, 'cache-dir', 'RPAHEUI_CACHE_DIR')[1]
+
+    return cmd, source, contents, opt_level, target, aheuic_output, comment_aheuis, output, warning_limit, trace_limit, engine, buffer_mode, profile, storage_stats, cache_dir
@@ -0,0 +1,72 @@
+# coding: utf-8
+"""Execution counters of `profile_mainloop` and their report."""
+
+from __future__ import absolute_import
+
+from aheui import const as c
+from aheui._compat import _unicode
+from aheui.compile import OP_NAMES, OP_USEVAL
+
+
+class Profile(object):
+
+    def __init__(self, size):
+        self.pc_counts = [0] * size
+        self.op_counts = [0] * len(OP_NAMES)
+        self.taken = [0] * size
+        self.not_taken = [0] * size
+        self.switches = [0] * size
+
+    def count(self, pc, op):
+        self.pc_counts[pc] += 1
+        self.op_counts[op] += 1
+
+    def branch(self, pc, jump):
+        if jump:
+            self.taken[pc] += 1
+        else:
+            self.not_taken[pc] += 1
+
+    def switch(self, pc, switched):
+        if switched:
+            self.switches[pc] += 1
+
+    def report(self, lines, label_map, debug=None):
+        """Return the report of counters of `lines` as a text.
+
+        With `debug`, each pc is followed by its grid coordinates.
+        """
+        total = 0
+        for count in self.pc_counts:
+            total += count
+        reports = [u'# total: %s\n' % _unicode(total), u'# opcode\tcount\n']
+        for op in range(-3, len(OP_NAMES) - 3):
+            count = self.op_counts[op]
+            if count > 0:
+                name = OP_NAMES[op]
+                assert name is not None
+                reports.append(u'%s\t%s\n' % (name, _unicode(count)))
+        reports.append(u'# pc\tcount\tcode\ttaken\tnot-taken\tswitches\tlocation\n')
+        for pc in range(0, len(lines)):
+            count = self.pc_counts[pc]
+            if count == 0:
+                continue
+            op, value = lines[pc]
+            name = OP_NAMES[op]
+            assert name is not None
+            if op in c.OP_BRANCHES or op == c.OP_JMP:
+                code = u'%s L%s' % (name, _unicode(label_map[value]))
+            elif OP_USEVAL[op]:
+                code = u'%s %s' % (name, _unicode(value))
+            else:
+                code = name
+            if op in c.OP_BRANCHES:
+                taken = _unicode(self.taken[pc])
+                not_taken = _unicode(self.not_taken[pc])
+            else:
+                taken = not_taken = u'-'
+            switches = _unicode(self.switches[pc]) if op == c.OP_SEL else u'-'
+            location = debug.comment(pc) if debug is not None else u''
+            reports.append(u'L%s\t%s\t%s\t%s\t%s\t%s\t%s\n' % (
+                _unicode(pc), _unicode(count), code, taken, not_taken, switches, location))
+        return u''.join(reports)
@@ -0,0 +1,369 @@
+# coding: utf-8
+"""Translate stack bytecodes to register codes.
+
+The stack bytecode pushes every intermediate value to a storage. With the
+linked list storages, that is a node allocation for each `OP_PUSH`, `OP_DUP`
+and arithmetic result. This module translates each basic block to a flat
+register code, where values pushed and popped in a block live in virtual
+registers. Only the values still alive at the exits of a block are stored.
+
+1. Split the code into blocks by jump targets. Conditional branches are
+    side exits in the middle of a block.
+2. Because every `OP_SEL` operand is a constant, the selected storage is
+    also a constant in each block once the selection at the entry is known.
+    Generate a version of a block for each selected storage it is entered
+    with, starting from the first block with the storage 0.
+3. Values pushed to stacks are kept as pending registers of each stack.
+    Queue and port are accessed directly, because their pushes are visible
+    to the other end or to `OP_DUP`.
+4. At a side exit, a stub stores the pending registers before jumping to
+    the target block.
+
+`regloop` in `aheui.aheui` runs the translated code.
+"""
+
+from __future__ import absolute_import
+
+from aheui import const as c
+from aheui._compat import jit
+
+
+R_CONST = 0  # regs[a] = b
+R_POP = 1  # regs[a] = storage[b].pop(), or just pop if a < 0
+R_PUSH = 2  # storage[b].push(regs[a])
+R_ADD = 3  # regs[a] = regs[b] + regs[cc]
+R_SUB = 4
+R_MUL = 5
+R_DIV = 6
+R_MOD = 7
+R_CMP = 8
+R_STORAGE = 9  # storage[b].<op a>() for queue and port
+R_POPNUM = 10  # write regs[a]
+R_POPCHAR = 11
+R_PUSHNUM = 12  # regs[a] = read
+R_PUSHCHAR = 13
+R_BRZ = 14  # if regs[a] == 0: goto cc
+R_BRSIZE = 15  # if len(storage[b]) < a: goto cc
+R_JMP = 16  # goto cc
+R_HALT = 17  # exit with storage[b]
+
+R_NAMES = [u'CONST', u'POP', u'PUSH', u'ADD', u'SUB', u'MUL', u'DIV', u'MOD', u'CMP', u'STORAGE', u'POPNUM', u'POPCHAR', u'PUSHNUM', u'PUSHCHAR', u'BRZ', u'BRSIZE', u'JMP', u'HALT']
+
+R_BINARY = {
+    c.OP_ADD: R_ADD,
+    c.OP_SUB: R_SUB,
+    c.OP_MUL: R_MUL,
+    c.OP_DIV: R_DIV,
+    c.OP_MOD: R_MOD,
+    c.OP_CMP: R_CMP,
+}
+
+
+def is_stack(idx):
+    return idx != c.VAL_QUEUE and idx != c.VAL_PORT
+
+
+def expand(op, val):
+    """Expand a superinstruction to its primitive parts.
+
+    A bulk operation is expanded to nothing, because the loop after it does
+    the same. A specialized operation is expanded to its generic version.
+    """
+    if op in c.OP_BULKS:
+        return []
+    for specialized, generic in c.OP_SPECIALIZATIONS:
+        if specialized == op:
+            return [(generic, val if generic == c.OP_MOV else -1)]
+    for fused, parts in c.OP_FUSIONS:
+        if fused == op:
+            expanded = []
+            for part in parts:
+                uses_value = part in c.OP_BRZS or part == c.OP_PUSH
+                expanded.append((part, val if uses_value else -1))
+            return expanded
+    return [(op, val)]
+
+
+def split_blocks(lines, label_map):
+    """Split the code into blocks with a single entry.
+
+    Conditional branches are side exits of a block. Only jump targets and
+    instructions after `OP_JMP` or `OP_HALT` start a new block.
+    Return the list of `(start, end)` ranges and a map from leader pc to
+    block index.
+    """
+    size = len(lines)
+    leaders = [False] * (size + 1)
+    leaders[0] = True
+    for target in label_map.values():
+        if target < size:
+            leaders[target] = True
+    for pc in range(0, size):
+        op = lines[pc][0]
+        if op == c.OP_JMP or op == c.OP_HALT:
+            leaders[pc + 1] = True
+    blocks = []
+    block_map = {}
+    start = 0
+    for pc in range(1, size + 1):
+        if pc == size or leaders[pc]:
+            block_map[start] = len(blocks)
+            blocks.append((start, pc))
+            start = pc
+    return blocks, block_map
+
+
+class RegisterProgram(object):
+    _immutable_fields_ = ['opcodes[*]', 'args_a[*]', 'args_b[*]', 'args_c[*]', 'size', 'register_count']
+
+    def __init__(self, opcodes, args_a, args_b, args_c, register_count):
+        self.opcodes = opcodes
+        self.args_a = args_a
+        self.args_b = args_b
+        self.args_c = args_c
+        self.size = len(opcodes)
+        self.register_count = register_count
+
+    @jit.elidable
+    def get_op(self, pc):
+        return self.opcodes[pc]
+
+    @jit.elidable
+    def get_a(self, pc):
+        return self.args_a[pc]
+
+    @jit.elidable
+    def get_b(self, pc):
+        return self.args_b[pc]
+
+    @jit.elidable
+    def get_c(self, pc):
+        return self.args_c[pc]
+
+    def write_asm(self):
+        codes = []
+        for pc in range(0, self.size):
+            codes.append(u'%d\t%s\t%d %d %d\n' % (
+                pc, R_NAMES[self.opcodes[pc]], self.args_a[pc], self.args_b[pc], self.args_c[pc]))
+        return u''.join(codes)
+
+
+class Translator(object):
+    """Translate stack bytecodes to a `RegisterProgram`."""
+
+    def __init__(self, lines, label_map):
+        self.lines = lines
+        self.label_map = label_map
+        self.size = len(lines)
+        self.blocks, self.block_map = split_blocks(lines, label_map)
+        self.opcodes = []
+        self.args_a = []
+        self.args_b = []
+        self.args_c = []
+        self.versions = {}  # (block * STORAGE_COUNT + selected) -> version index
+        self.version_keys = []
+        self.version_pcs = []
+        self.fixups = []  # (code index, version index)
+        self.register_count = 0
+        # states of the block in translation
+        self.selected = 0
+        self.pendings = [[] for _ in range(0, c.STORAGE_COUNT)]
+        self.next_register = 0
+
+    def emit(self, op, a=-1, b=-1, cc=-1):
+        self.opcodes.append(op)
+        self.args_a.append(a)
+        self.args_b.append(b)
+        self.args_c.append(cc)
+        return len(self.opcodes) - 1
+
+    def version_of(self, pc, selected):
+        if pc >= self.size:
+            block = len(self.blocks)  # virtual block to halt
+        else:
+            block = self.block_map[pc]
+        key = block * c.STORAGE_COUNT + selected
+        try:
+            return self.versions[key]
+        except KeyError:
+            version = len(self.version_keys)
+            self.versions[key] = version
+            self.version_keys.append(key)
+            self.version_pcs.append(-1)
+            return version
+
+    def jump_to(self, idx, pc, selected):
+        """Set the target of the branch at code `idx` to the block at `pc`."""
+        self.fixups.append((idx, self.version_of(pc, selected)))
+
+    def new_register(self):
+        register = self.next_register
+        self.next_register += 1
+        if self.next_register > self.register_count:
+            self.register_count = self.next_register
+        return register
+
+    def pop(self, idx):
+        pending = self.pendings[idx]
+        if pending:
+            return pending.pop()
+        register = self.new_register()
+        self.emit(R_POP, register, idx)
+        return register
+
+    def push(self, idx, register):
+        if is_stack(idx):
+            self.pendings[idx].append(register)
+        else:
+            self.emit(R_PUSH, register, idx)
+
+    def flush(self, pendings):
+        for idx in range(0, c.STORAGE_COUNT):
+            for register in pendings[idx]:
+                self.emit(R_PUSH, register, idx)
+
+    def snapshot(self):
+        return [pending[:] for pending in self.pendings]
+
+    def halt(self):
+        self.flush(self.pendings)
+        self.emit(R_HALT, -1, self.selected)
+
+    def goto(self, pc):
+        self.flush(self.pendings)
+        idx = self.emit(R_JMP)
+        self.jump_to(idx, pc, self.selected)
+
+    def translate(self):
+        if self.size > 0:
+            self.version_of(0, 0)
+        else:
+            self.emit(R_HALT, -1, 0)
+        version = 0
+        while version < len(self.version_keys):
+            key = self.version_keys[version]
+            block = key // c.STORAGE_COUNT
+            selected = key % c.STORAGE_COUNT
+            self.version_pcs[version] = len(self.opcodes)
+            if block < len(self.blocks):
+                start, end = self.blocks[block]
+            else:
+                start, end = self.size, self.size
+            self.block(start, end, selected)
+            version += 1
+        for idx, version in self.fixups:
+            self.args_c[idx] = self.version_pcs[version]
+        return RegisterProgram(self.opcodes, self.args_a, self.args_b, self.args_c, self.register_count)
+
+    def block(self, start, end, selected):
+        self.selected = selected
+        self.pendings = [[] for _ in range(0, c.STORAGE_COUNT)]
+        self.next_register = 0
+        stubs = []  # (code index, pendings, target pc, selected)
+        closed = False
+        for pc in range(start, end):
+            op, val = self.lines[pc]
+            for part, part_val in expand(op, val):
+                if part in c.OP_BRZS:
+                    register = self.pop(self.selected)
+                    idx = self.emit(R_BRZ, register)
+                    stubs.append((idx, self.snapshot(), self.label_map[part_val], self.selected))
+                elif part == c.OP_BRPOP1 or part == c.OP_BRPOP2:
+                    reqsize = c.OP_REQSIZE[part] - len(self.pendings[self.selected])
+                    if reqsize > 0:
+                        idx = self.emit(R_BRSIZE, reqsize, self.selected)
+                        stubs.append((idx, self.snapshot(), self.label_map[part_val], self.selected))
+                elif part == c.OP_JMP:
+                    self.goto(self.label_map[part_val])
+                    closed = True
+                elif part == c.OP_HALT:
+                    self.halt()
+                    closed = True
+                else:
+                    self.instruction(part, part_val)
+                if closed:
+                    break
+            if closed:
+                break
+        if not closed:
+            if end >= self.size:
+                self.halt()
+            else:
+                self.goto(end)
+        for idx, pendings, target, selected in stubs:
+            empty = True
+            for pending in pendings:
+                if pending:
+                    empty = False
+            if empty:
+                self.jump_to(idx, target, selected)
+            else:
+                self.args_c[idx] = len(self.opcodes)
+                self.flush(pendings)
+                jump = self.emit(R_JMP)
+                self.jump_to(jump, target, selected)
+
+    def instruction(self, op, val):
+        selected = self.selected
+        stack = is_stack(selected)
+        if op == c.OP_ADD or op == c.OP_SUB or op == c.OP_MUL or op == c.OP_DIV or op == c.OP_MOD or op == c.OP_CMP:
+            if stack:
+                right = self.pop(selected)
+                left = self.pop(selected)
+                register = self.new_register()
+                self.emit(R_BINARY[op], register, left, right)
+                self.push(selected, register)
+            else:
+                self.emit(R_STORAGE, op, selected)
+        elif op == c.OP_POP:
+            if stack and self.pendings[selected]:
+                self.pendings[selected].pop()
+            else:
+                self.emit(R_POP, -1, selected)
+        elif op == c.OP_PUSH:
+            register = self.new_register()
+            self.emit(R_CONST, register, val)
+            self.push(selected, register)
+        elif op == c.OP_DUP:
+            if stack:
+                register = self.pop(selected)
+                self.push(selected, register)
+                self.push(selected, register)
+            else:
+                self.emit(R_STORAGE, op, selected)
+        elif op == c.OP_SWAP:
+            if stack:
+                first = self.pop(selected)
+                second = self.pop(selected)
+                self.push(selected, first)
+                self.push(selected, second)
+            else:
+                self.emit(R_STORAGE, op, selected)
+        elif op == c.OP_SEL:
+            self.selected = val
+        elif op == c.OP_MOV:
+            register = self.pop(selected)
+            self.push(val, register)
+        elif op == c.OP_POPNUM:
+            register = self.pop(selected)
+            self.emit(R_POPNUM, register)
+        elif op == c.OP_POPCHAR:
+            register = self.pop(selected)
+            self.emit(R_POPCHAR, register)
+        elif op == c.OP_PUSHNUM:
+            register = self.new_register()
+            self.emit(R_PUSHNUM, register)
+            self.push(selected, register)
+        elif op == c.OP_PUSHCHAR:
+            register = self.new_register()
+            self.emit(R_PUSHCHAR, register)
+            self.push(selected, register)
+        elif op == c.OP_NONE:
+            pass
+        else:
+            assert False
+
+
+def translate(lines, label_map):
+    """Return a `RegisterProgram` running the same program as `lines`."""
+    return Translator(lines, label_map).translate()
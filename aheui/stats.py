@@ -0,0 +1,45 @@
+# coding: utf-8
+"""Occupancy and memory statistics of the storages."""
+
+from __future__ import absolute_import
+
+from aheui import const as c
+from aheui._compat import unichr, _unicode
+
+
+def storage_name(idx):
+    """Return the final consonant of the storage, or `-` for the empty one."""
+    if idx == 0:
+        return u'-'
+    return unichr(0x11a8 + idx - 1)
+
+
+def report_text(storage):
+    """Return a human-readable table of storages which have been used."""
+    reports = [u'# storage\tdepth\tpeak\tpushes\tpops\tbytes\n']
+    for idx in range(0, c.STORAGE_COUNT):
+        pool = storage[idx]
+        if pool.pushes == 0:
+            continue
+        reports.append(u'%s (%s)\t%s\t%s\t%s\t%s\t%s\n' % (
+            storage_name(idx), _unicode(idx), _unicode(len(pool)), _unicode(pool.peak),
+            _unicode(pool.pushes), _unicode(pool.pops()), _unicode(pool.nbytes())))
+    return u''.join(reports)
+
+
+def report_json(storage):
+    """Return a JSON document of all storages."""
+    items = []
+    for idx in range(0, c.STORAGE_COUNT):
+        pool = storage[idx]
+        items.append(u'{"index": %s, "depth": %s, "peak": %s, "pushes": %s, "pops": %s, "bytes": %s}' % (
+            _unicode(idx), _unicode(len(pool)), _unicode(pool.peak),
+            _unicode(pool.pushes), _unicode(pool.pops()), _unicode(pool.nbytes())))
+    return u'{"storages": [%s]}\n' % u', '.join(items)
+
+
+def report(storage, format):
+    if format == 'json':
+        return report_json(storage)
+    else:
+        return report_text(storage)
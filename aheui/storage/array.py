@@ -1,13 +1,41 @@
 from collections import deque
-from aheui._compat import PYR
+from aheui._compat import PYR, bigint
 
 
 assert not PYR, 'RPython must use linkedlist'
 
 
-class Stack(list):
+SLOT_BYTES = 8
+
+
+class Counter(object):
+    """Push counters shared by the storages."""
+
     __slots__ = ()
 
+    def _count_push(self):
+        """Count a push. Only counted storages call it after a push."""
+        self.pushes += 1
+        if len(self) > self.peak:
+            self.peak = len(self)
+
+    def pops(self):
+        """Number of removed values. A binary operation removes one."""
+        return self.pushes - len(self)
+
+    def nbytes(self):
+        """Approximate heap bytes of the current slots and values."""
+        return sum(SLOT_BYTES + bigint.nbytes(value) for value in self)
+
+
+class Stack(Counter, list):
+    __slots__ = ('pushes', 'peak')
+
+    def __init__(self):
+        list.__init__(self)
+        self.pushes = 0
+        self.peak = 0
+
     def push(self, value):
         self.append(value)
 
@@ -42,9 +70,14 @@ class Stack(list):
         self[-1] = self[-1] >= top
 
 
-class Queue(deque):
-    __slots__ = ()
-    
+class Queue(Counter, deque):
+    __slots__ = ('pushes', 'peak')
+
+    def __init__(self):
+        deque.__init__(self)
+        self.pushes = 0
+        self.peak = 0
+
     def push(self, value):
         self.appendleft(value)
 
@@ -56,27 +89,55 @@ class Queue(deque):
 
     def add(self):
         top = self.pop()
-        self.appendleft(self.pop() + top)
+        self.push(self.pop() + top)
 
     def sub(self):
         top = self.pop()
-        self.appendleft(self.pop() - top)
+        self.push(self.pop() - top)
 
     def mul(self):
         top = self.pop()
-        self.appendleft(self.pop() * top)
+        self.push(self.pop() * top)
 
     def div(self):
         top = self.pop()
-        self.appendleft(self.pop() / top)
+        self.push(self.pop() / top)
 
     def mod(self):
         top = self.pop()
-        self.appendleft(self.pop() % top)
+        self.push(self.pop() % top)
 
     def cmp(self):
         top = self.pop()
-        self.appendleft(self.pop() >= top)
+        self.push(self.pop() >= top)
+
+
+class CountedStack(Stack):
+    """Stack counting pushes and the peak depth for `--storage-stats`."""
+
+    __slots__ = ()
+
+    def push(self, value):
+        Stack.push(self, value)
+        self._count_push()
+
+    def dup(self):
+        Stack.dup(self)
+        self._count_push()
+
+
+class CountedQueue(Queue):
+
+    __slots__ = ()
+
+    def push(self, value):
+        Queue.push(self, value)
+        self._count_push()
+
+    def dup(self):
+        Queue.dup(self)
+        self._count_push()
 
 
 Port = Stack
+CountedPort = CountedStack
@@ -0,0 +1,255 @@
+from aheui._compat import bigint
+
+
+MIN_CAPACITY = 16
+SLOT_BYTES = 8  # a value or a reference to it
+
+
+class Contiguous(object):
+    """Common array for storages.
+
+    `items` grows twice when it is full and shrinks half when it is less
+    than a quarter full, so both are amortized O(1).
+    """
+
+    __slots__ = ('items', 'size', 'pushes', 'peak')
+
+    def __len__(self):
+        return self.size
+
+    def _count_push(self):
+        """Count a push. Only counted storages call it after a push."""
+        self.pushes += 1
+        if self.size > self.peak:
+            self.peak = self.size
+
+    def pops(self):
+        """Number of removed values. A binary operation removes one."""
+        return self.pushes - self.size
+
+    def capacity(self):
+        return len(self.items)
+
+    def add(self):
+        r1, r2 = self._get_2_values()
+        r = bigint.add(r2, r1)
+        self._put_value(r)
+
+    def sub(self):
+        r1, r2 = self._get_2_values()
+        r = bigint.sub(r2, r1)
+        self._put_value(r)
+
+    def mul(self):
+        r1, r2 = self._get_2_values()
+        r = bigint.mul(r2, r1)
+        self._put_value(r)
+
+    def div(self):
+        r1, r2 = self._get_2_values()
+        r = bigint.div(r2, r1)
+        self._put_value(r)
+
+    def mod(self):
+        r1, r2 = self._get_2_values()
+        r = bigint.mod(r2, r1)
+        self._put_value(r)
+
+    def cmp(self):
+        r1, r2 = self._get_2_values()
+        r = int(bigint.ge(r2, r1))
+        big_r = bigint.fromint(r)
+        self._put_value(big_r)
+
+
+class Stack(Contiguous):
+    """Base data storage for Aheui, except for ieung and hieuh.
+
+    The top is `items[size - 1]`.
+    """
+
+    __slots__ = ('items', 'size', 'pushes', 'peak')
+
+    def __init__(self):
+        self.items = [bigint.MINUS1] * MIN_CAPACITY
+        self.size = 0
+        self.pushes = 0
+        self.peak = 0
+
+    def _resize(self, capacity):
+        items = [bigint.MINUS1] * capacity
+        for i in range(0, self.size):
+            items[i] = self.items[i]
+        self.items = items
+
+    def push(self, value):
+        # assert(isinstance(value, bigint.Int))
+        size = self.size
+        if size == len(self.items):
+            self._resize(size * 2)
+        self.items[size] = value
+        self.size = size + 1
+
+    def pop(self):
+        size = self.size - 1
+        assert size >= 0
+        value = self.items[size]
+        self.items[size] = bigint.MINUS1
+        self.size = size
+        capacity = len(self.items)
+        if capacity > MIN_CAPACITY and size < capacity // 4:
+            self._resize(capacity // 2)
+        return value
+
+    def top(self):
+        size = self.size - 1
+        assert size >= 0
+        return self.items[size]
+
+    def dup(self):
+        self.push(self.top())
+
+    def swap(self):
+        size = self.size
+        assert size >= 2
+        items = self.items
+        items[size - 1], items[size - 2] = items[size - 2], items[size - 1]
+
+    def nbytes(self):
+        """Approximate heap bytes of the array and the values."""
+        total = SLOT_BYTES * len(self.items)
+        for i in range(0, self.size):
+            total += bigint.nbytes(self.items[i])
+        return total
+
+    def _get_2_values(self):
+        return self.pop(), self.top()
+
+    def _put_value(self, value):
+        size = self.size - 1
+        assert size >= 0
+        self.items[size] = value
+
+
+class Queue(Contiguous):
+    """Ring buffer of a power-of-two capacity.
+
+    The head is `items[head]` and the tail is the last of `size` values
+    from there. Index arithmetic wraps with `mask`.
+    """
+
+    __slots__ = ('items', 'size', 'pushes', 'peak', 'head', 'mask')
+
+    def __init__(self):
+        self.items = [bigint.MINUS1] * MIN_CAPACITY
+        self.mask = MIN_CAPACITY - 1
+        self.head = 0
+        self.size = 0
+        self.pushes = 0
+        self.peak = 0
+
+    def _resize(self, capacity):
+        items = [bigint.MINUS1] * capacity
+        for i in range(0, self.size):
+            items[i] = self.items[(self.head + i) & self.mask]
+        self.items = items
+        self.mask = capacity - 1
+        self.head = 0
+
+    def push(self, value):
+        # assert(isinstance(value, bigint.Int))
+        size = self.size
+        if size == len(self.items):
+            self._resize(size * 2)
+        self.items[(self.head + size) & self.mask] = value
+        self.size = size + 1
+
+    def pop(self):
+        assert self.size > 0
+        head = self.head
+        value = self.items[head]
+        self.items[head] = bigint.MINUS1
+        self.head = (head + 1) & self.mask
+        self.size -= 1
+        capacity = len(self.items)
+        if capacity > MIN_CAPACITY and self.size < capacity // 4:
+            self._resize(capacity // 2)
+        return value
+
+    def dup(self):
+        assert self.size > 0
+        value = self.items[self.head]
+        if self.size == len(self.items):
+            self._resize(self.size * 2)
+        head = (self.head - 1) & self.mask
+        self.items[head] = value
+        self.head = head
+        self.size += 1
+
+    def swap(self):
+        assert self.size >= 2
+        items = self.items
+        first = self.head
+        second = (first + 1) & self.mask
+        items[first], items[second] = items[second], items[first]
+
+    def nbytes(self):
+        """Approximate heap bytes of the array and the values."""
+        total = SLOT_BYTES * len(self.items)
+        for i in range(0, self.size):
+            total += bigint.nbytes(self.items[(self.head + i) & self.mask])
+        return total
+
+    def _get_2_values(self):
+        return self.pop(), self.pop()
+
+    def _put_value(self, value):
+        self.push(value)
+
+
+class Port(Stack):
+
+    __slots__ = ('items', 'size', 'pushes', 'peak', 'last_push')
+
+    def __init__(self):
+        Stack.__init__(self)
+        self.last_push = bigint.fromint(0)
+
+    def push(self, value):
+        Stack.push(self, value)
+        self.last_push = value
+
+    def dup(self):
+        self.push(self.last_push)
+
+
+class CountedStack(Stack):
+    """Stack counting pushes and the peak depth for `--storage-stats`."""
+
+    __slots__ = ('items', 'size', 'pushes', 'peak')
+
+    def push(self, value):
+        Stack.push(self, value)
+        self._count_push()
+
+
+class CountedQueue(Queue):
+
+    __slots__ = ('items', 'size', 'pushes', 'peak', 'head', 'mask')
+
+    def push(self, value):
+        Queue.push(self, value)
+        self._count_push()
+
+    def dup(self):
+        Queue.dup(self)
+        self._count_push()
+
+
+class CountedPort(Port):
+
+    __slots__ = ('items', 'size', 'pushes', 'peak', 'last_push')
+
+    def push(self, value):
+        Port.push(self, value)
+        self._count_push()
@@ -1,6 +1,9 @@
 from aheui._compat import bigint
 
 
+NODE_BYTES = 32  # object header, value and next
+
+
 class Node(object):
     """Element unit for stack and queue."""
 
@@ -14,11 +17,30 @@ class Node(object):
 class LinkedList(object):
     """Common linked list for storages"""
 
-    __slots__ = ('head', 'size')
+    __slots__ = ('head', 'size', 'pushes', 'peak')
 
     def __len__(self):
         return self.size
 
+    def _count_push(self):
+        """Count a push. Only counted storages call it after a push."""
+        self.pushes += 1
+        if self.size > self.peak:
+            self.peak = self.size
+
+    def pops(self):
+        """Number of removed values. A binary operation removes one."""
+        return self.pushes - self.size
+
+    def nbytes(self):
+        """Approximate heap bytes of the current nodes and values."""
+        total = 0
+        node = self.head
+        for _ in range(0, self.size):
+            total += NODE_BYTES + bigint.nbytes(node.value)
+            node = node.next
+        return total
+
     def pop(self):
         node = self.head
         self.head = node.next
@@ -67,11 +89,13 @@ class LinkedList(object):
 class Stack(LinkedList):
     """Base data storage for Aheui, except for ieung and hieuh."""
 
-    __slots__ = ('head', 'size')
+    __slots__ = ('head', 'size', 'pushes', 'peak')
 
     def __init__(self):
         self.head = None
         self.size = 0
+        self.pushes = 0
+        self.peak = 0
 
     def push(self, value):
         # assert(isinstance(value, bigint.Int))
@@ -93,12 +117,14 @@ class Stack(LinkedList):
 
 class Queue(LinkedList):
 
-    __slots__ = ('head', 'tail', 'size')
+    __slots__ = ('head', 'tail', 'size', 'pushes', 'peak')
 
     def __init__(self):
         self.tail = Node(None)
         self.head = self.tail
         self.size = 0
+        self.pushes = 0
+        self.peak = 0
 
     def push(self, value):
         # assert(isinstance(value, bigint.Int))
@@ -124,11 +150,13 @@ class Queue(LinkedList):
 
 class Port(LinkedList):
 
-    __slots__ = ('head', 'size', 'last_push')
+    __slots__ = ('head', 'size', 'pushes', 'peak', 'last_push')
 
     def __init__(self):
         self.head = None
         self.size = 0
+        self.pushes = 0
+        self.peak = 0
         self.last_push = bigint.fromint(0)
 
     def push(self, value):
@@ -146,3 +174,35 @@ class Port(LinkedList):
 
     def _put_value(self, value):
         self.head.value = value
+
+
+class CountedStack(Stack):
+    """Stack counting pushes and the peak depth for `--storage-stats`."""
+
+    __slots__ = ('head', 'size', 'pushes', 'peak')
+
+    def push(self, value):
+        Stack.push(self, value)
+        self._count_push()
+
+
+class CountedQueue(Queue):
+
+    __slots__ = ('head', 'tail', 'size', 'pushes', 'peak')
+
+    def push(self, value):
+        Queue.push(self, value)
+        self._count_push()
+
+    def dup(self):
+        Queue.dup(self)
+        self._count_push()
+
+
+class CountedPort(Port):
+
+    __slots__ = ('head', 'size', 'pushes', 'peak', 'last_push')
+
+    def push(self, value):
+        Port.push(self, value)
+        self._count_push()
@@ -0,0 +1,338 @@
+# coding: utf-8
+"""Transpile optimized bytecodes to a Python function.
+
+This is an engine for CPython hosts where the RPython binary is not available.
+The generic `mainloop` pays a dispatch for every instruction. Instead, the
+code is split into basic blocks and each block is generated as straight-line
+Python code. The blocks are connected by a block-id state machine.
+
+1. Split the code into blocks by jump targets. Conditional branches are
+    side exits in the middle of a block.
+2. Because every `OP_SEL` operand is a constant, the kind of the selected
+    storage (stack, queue or port) is also a constant in each block once the
+    kind at the entry is known. Generate a version of a block for each kind
+    it is entered with, starting from the first block with a stack.
+3. In stack versions, pushed values are kept in local variables until the
+    end of the block or until they must be visible in the storage.
+4. Stack size checks of `OP_BRPOP1` and `OP_BRPOP2` are inlined and take
+    the pending local values into account.
+
+RPython does not support this module. It is not reachable from the RPython
+entry point.
+"""
+
+from __future__ import absolute_import
+
+from aheui import const as c
+from aheui.register import expand, split_blocks
+
+
+KIND_STACK = 0
+KIND_QUEUE = 1
+KIND_PORT = 2
+KIND_COUNT = 3
+
+BINARY_EXPRS = {
+    c.OP_ADD: u'%s + %s',
+    c.OP_SUB: u'%s - %s',
+    c.OP_MUL: u'%s * %s',
+    c.OP_DIV: u'%s // %s',
+    c.OP_MOD: u'%s %% %s',
+    c.OP_CMP: u'int(%s >= %s)',
+}
+
+
+def storage_kind(idx):
+    if idx == c.VAL_QUEUE:
+        return KIND_QUEUE
+    elif idx == c.VAL_PORT:
+        return KIND_PORT
+    else:
+        return KIND_STACK
+
+
+class BlockWriter(object):
+    """Generate a version of a block for the given selected storage kind."""
+
+    def __init__(self, transpiler, kind):
+        self.transpiler = transpiler
+        self.kind = kind
+        self.code = []
+        self.pending = []  # values pushed to the stack but not stored yet
+        self.temp_count = 0
+
+    def emit(self, line):
+        self.code.append(line)
+
+    def temp(self):
+        name = u't%d' % self.temp_count
+        self.temp_count += 1
+        return name
+
+    def flush(self):
+        if len(self.pending) == 1:
+            self.emit(u's.append(%s)' % self.pending[0])
+        elif self.pending:
+            self.emit(u's.extend((%s))' % u', '.join(self.pending))
+        self.pending = []
+
+    def pop(self):
+        """Return an atomic expression of the popped value."""
+        if self.kind == KIND_STACK:
+            if self.pending:
+                return self.pending.pop()
+            name = self.temp()
+            self.emit(u'%s = s.pop()' % name)
+            return name
+        elif self.kind == KIND_QUEUE:
+            name = self.temp()
+            self.emit(u'%s = s.popleft()' % name)
+            return name
+        else:
+            name = self.temp()
+            self.emit(u'%s = s.pop()' % name)
+            return name
+
+    def push(self, value):
+        if self.kind == KIND_STACK:
+            self.pending.append(value)
+        elif self.kind == KIND_QUEUE:
+            self.emit(u's.append(%s)' % value)
+        else:
+            self.emit(u's.append(%s)' % value)
+            self.emit(u'lp = %s' % value)
+
+    def push_to(self, idx, value):
+        kind = storage_kind(idx)
+        self.emit(u'st[%d].append(%s)' % (idx, value))
+        if kind == KIND_PORT:
+            self.emit(u'lp = %s' % value)
+
+    def binary(self, op):
+        expr = BINARY_EXPRS[op]
+        if self.kind == KIND_STACK and len(self.pending) < 2:
+            right = self.pop()
+            self.emit(u's[-1] = %s' % (expr % (u's[-1]', right)))
+            return
+        right = self.pop()
+        left = self.pop()
+        if self.kind == KIND_STACK:
+            name = self.temp()
+            self.emit(u'%s = %s' % (name, expr % (left, right)))
+            self.pending.append(name)
+        elif self.kind == KIND_QUEUE:
+            self.emit(u's.append(%s)' % (expr % (left, right)))
+        else:
+            self.emit(u's.append(%s)' % (expr % (left, right)))
+
+    def size_check(self, reqsize):
+        """Return a condition for a stack underflow or None if it never happens."""
+        reqsize -= len(self.pending)
+        if reqsize <= 0:
+            return None
+        return u'len(s) < %d' % reqsize
+
+    def instruction(self, op, val):
+        if op in BINARY_EXPRS:
+            self.binary(op)
+        elif op == c.OP_POP:
+            if self.kind == KIND_STACK and self.pending:
+                self.pending.pop()
+            elif self.kind == KIND_QUEUE:
+                self.emit(u's.popleft()')
+            else:
+                self.emit(u's.pop()')
+        elif op == c.OP_PUSH:
+            self.push(u'%d' % val)
+        elif op == c.OP_DUP:
+            if self.kind == KIND_STACK:
+                if self.pending:
+                    self.pending.append(self.pending[-1])
+                else:
+                    name = self.temp()
+                    self.emit(u'%s = s[-1]' % name)
+                    self.pending.append(name)
+            elif self.kind == KIND_QUEUE:
+                self.emit(u's.appendleft(s[0])')
+            else:
+                self.emit(u's.append(lp)')
+        elif op == c.OP_SWAP:
+            if self.kind == KIND_STACK and len(self.pending) >= 2:
+                self.pending[-1], self.pending[-2] = self.pending[-2], self.pending[-1]
+            elif self.kind == KIND_STACK and self.pending:
+                name = self.temp()
+                self.emit(u'%s = s.pop()' % name)
+                self.pending.insert(len(self.pending) - 1, name)
+                self.pending[-1], self.pending[-2] = self.pending[-2], self.pending[-1]
+            elif self.kind == KIND_QUEUE:
+                self.emit(u's[0], s[1] = s[1], s[0]')
+            else:
+                self.emit(u's[-1], s[-2] = s[-2], s[-1]')
+        elif op == c.OP_SEL:
+            self.flush()
+            self.emit(u's = st[%d]' % val)
+            self.kind = storage_kind(val)
+        elif op == c.OP_MOV:
+            value = self.pop()
+            self.flush()
+            self.push_to(val, value)
+        elif op == c.OP_POPNUM:
+            value = self.pop()
+            self.emit(u'write_number(bigint_str(%s))' % value)
+        elif op == c.OP_POPCHAR:
+            value = self.pop()
+            self.emit(u'write_utf8(%s)' % value)
+        elif op == c.OP_PUSHNUM:
+            name = self.temp()
+            self.emit(u'%s = read_number()' % name)
+            self.push(name)
+        elif op == c.OP_PUSHCHAR:
+            name = self.temp()
+            self.emit(u'%s = read_utf8()' % name)
+            self.push(name)
+        elif op == c.OP_NONE:
+            pass
+        else:
+            assert False, op
+
+    def exit(self):
+        """Halt with the top of the selected storage as the exit code."""
+        if self.kind == KIND_STACK and self.pending:
+            self.emit(u'return %s' % self.pending[-1])
+            self.pending = []
+        elif self.kind == KIND_QUEUE:
+            self.emit(u'return s.popleft() if s else 0')
+        else:
+            self.emit(u'return s.pop() if s else 0')
+
+    def goto(self, pc):
+        transpiler = self.transpiler
+        if pc >= transpiler.size:
+            self.exit()
+        else:
+            state = transpiler.state_of(pc, self.kind)
+            self.emit(u'state = %d' % state)
+            self.emit(u'continue')
+
+    def side_exit(self, pc):
+        """Leave the block to `pc` with the pending values, but keep them."""
+        pending = self.pending[:]
+        self.flush()
+        self.goto(pc)
+        self.pending = pending
+
+    def block(self, start, end):
+        transpiler = self.transpiler
+        lines = transpiler.lines
+        for pc in range(start, end):
+            op, val = lines[pc]
+            for part, part_val in expand(op, val):
+                if part in c.OP_BRZS:
+                    value = self.pop()
+                    target = transpiler.label_map[part_val]
+                    if value.lstrip(u'-').isdigit():
+                        if int(value) == 0:
+                            self.flush()
+                            self.goto(target)
+                            return
+                        continue
+                    self.emit(u'if %s == 0:' % value)
+                    self.indent(lambda: self.side_exit(target))
+                elif part == c.OP_BRPOP1 or part == c.OP_BRPOP2:
+                    cond = self.size_check(c.OP_REQSIZE[part])
+                    if cond is not None:
+                        target = transpiler.label_map[part_val]
+                        self.emit(u'if %s:' % cond)
+                        self.indent(lambda: self.side_exit(target))
+                elif part == c.OP_JMP:
+                    self.flush()
+                    self.goto(transpiler.label_map[part_val])
+                    return
+                elif part == c.OP_HALT:
+                    self.exit()
+                    return
+                else:
+                    self.instruction(part, part_val)
+        self.flush()
+        self.goto(end)
+
+    def indent(self, func):
+        code = self.code
+        self.code = []
+        func()
+        code.extend(u'    ' + line for line in self.code)
+        self.code = code
+
+
+class Transpiler(object):
+    """Generate Python source code of a whole program."""
+
+    def __init__(self, lines, label_map):
+        self.lines = lines
+        self.label_map = label_map
+        self.size = len(lines)
+        self.blocks, self.block_map = split_blocks(lines, label_map)
+        self.states = {}
+        self.job_queue = []
+
+    def state_of(self, pc, kind):
+        key = self.block_map[pc] * KIND_COUNT + kind
+        if key not in self.states:
+            self.states[key] = len(self.states)
+            self.job_queue.append(key)
+        return self.states[key]
+
+    def generate(self, name=u'aheui_main'):
+        bodies = []
+        if self.size > 0:
+            self.state_of(0, KIND_STACK)
+        job_index = 0
+        while job_index < len(self.job_queue):
+            key = self.job_queue[job_index]
+            job_index += 1
+            block_idx, kind = divmod(key, KIND_COUNT)
+            start, end = self.blocks[block_idx]
+            writer = BlockWriter(self, kind)
+            writer.emit(u'# L%d-L%d %s' % (start, end - 1, (u'stack', u'queue', u'port')[kind]))
+            writer.block(start, end)
+            bodies.append(writer.code)
+
+        code = [
+            u'def %s(write_number, write_utf8, read_number, read_utf8, bigint_str):' % name,
+            u'    from collections import deque',
+            u'    st = [[] for _ in range(%d)]' % c.STORAGE_COUNT,
+            u'    st[%d] = deque()' % c.VAL_QUEUE,
+            u'    lp = 0',
+            u'    s = st[0]',
+            u'    state = 0',
+        ]
+        if not bodies:
+            code.append(u'    return 0')
+        else:
+            code.append(u'    while True:')
+            self.dispatch(code, bodies, 0, len(bodies), u'        ')
+        return u'\n'.join(code) + u'\n'
+
+    def dispatch(self, code, bodies, low, high, indent):
+        """Generate a binary decision tree over states in [low, high)."""
+        if high - low == 1:
+            code.extend(indent + line for line in bodies[low])
+            return
+        mid = (low + high) // 2
+        code.append(indent + u'if state < %d:' % mid)
+        self.dispatch(code, bodies, low, mid, indent + u'    ')
+        code.append(indent + u'else:')
+        self.dispatch(code, bodies, mid, high, indent + u'    ')
+
+
+def transpile(lines, label_map, name=u'aheui_main'):
+    """Return Python source code of a function running the program."""
+    return Transpiler(lines, label_map).generate(name)
+
+
+def build(lines, label_map):
+    """Compile the program to a Python function."""
+    source = transpile(lines, label_map)
+    namespace = {}
+    exec(compile(source, '<aheui>', 'exec'), namespace)
+    return namespace['aheui_main']
@@ -0,0 +1,18 @@
+#!/bin/bash
+# Run each benchmark with each given aheui binary and report wall clock times.
+# usage: bash bench.sh ../rpaheui-c ../rpaheui-contiguous-c
+
+if [ $# -eq 0 ]; then
+    echo "usage: $0 <aheui binary>..." >&2
+    exit 1
+fi
+
+cd "$(dirname "$0")"
+TIMEFORMAT='%3R'
+for bench in *.aheuis; do
+    echo "benchmark: $bench"
+    for aheui in "$@"; do
+        elapsed=$( { time "$aheui" --no-c "$bench" > /dev/null; } 2>&1 )
+        printf '  %-32s %ss\n' "$aheui" "$elapsed"
+    done
+done
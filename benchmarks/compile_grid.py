@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Show the compile time of a program as its grid grows.
+
+`grid` walks every other row of a `rows` x `cols` grid to the right, from the
+column where it entered the row to the column before it, so every row wraps
+around once. The rows between them are shorter rows of spaces, which are
+passed by moves down.
+
+`branches` zigzags through the grid with `OP_DUP` on every cell. Each of them
+is a branch of the stack size check, so the serializer has a job per cell.
+
+usage: python benchmarks/compile_grid.py [max rows]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aheui import compile  # noqa: E402
+
+
+def make_grid(rows, cols):
+    lines = []
+    for row in range(0, rows):
+        if row % 2 == 1:
+            lines.append(u' ' * (cols // 2))
+            continue
+        cells = [u'아'] * cols
+        entry = -(row // 2) % cols  # the column entered from above
+        cells[(entry - 1) % cols] = u'희' if row + 2 >= rows else u'우'
+        lines.append(u''.join(cells))
+    return u'\n'.join(lines)
+
+
+def make_branches(rows, cols):
+    lines = []
+    for row in range(0, rows):
+        if row % 2 == 0:
+            lines.append(u'빠' * (cols - 1) + u'우')
+        else:
+            lines.append(u'우' + u'뻐' * (cols - 1))
+    lines.append(u'희')
+    return u'\n'.join(lines)
+
+
+def main(argv):
+    max_rows = int(argv[1]) if len(argv) > 1 else 2048
+    print('program\trows\tcols\tcells\tcompile(s)')
+    for name, make in [('grid', make_grid), ('branches', make_branches)]:
+        rows = 16
+        while rows <= max_rows:
+            cols = rows
+            text = make(rows, cols)
+            start = time.time()
+            compiler = compile.Compiler()
+            compiler.compile(text)
+            elapsed = time.time() - start
+            print('%s\t%d\t%d\t%d\t%.3f' % (name, rows, cols, rows * cols, elapsed))
+            rows *= 2
+
+
+if __name__ == '__main__':
+    main(sys.argv)
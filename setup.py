@@ -46,6 +46,7 @@ setup(
         'bin/aheui-py',
         'bin/aheui',
         'bin/ahsembler',
+        'bin/aheui-batch',
     ],
     classifiers=[
         'Intended Audience :: Developers',
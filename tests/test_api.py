@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from aheui import aheui
+from aheui import api
+from aheui.api import run
+
+
+def test_run_source():
+    assert run(u'방망희', b'42') == (b'42', 0)
+    assert run(u'밣희'.encode('utf-8')) == (b'', 8)
+    for engine in ['vm', 'register', 'transpile']:
+        assert run(u'방방다망희', b'3 4', engine=engine) == (b'7', 0)
+
+
+def test_run_asm():
+    assert run(u'PUSH 2\nPUSH 3\nMUL\nPOPNUM\nHALT\n', source='asm') == (b'6', 0)
+
+
+def test_run_precompiled_back_to_back():
+    compiler = api.load(u'밯맣밯망희')
+    program = aheui.Program(compiler.lines, compiler.label_map)
+    for _ in range(3):
+        assert run(compiler, u'가 7'.encode('utf-8')) == (u'가32'.encode('utf-8'), 0)
+        assert run(program, b'3 4') == (b'332', 0)
+
+
+def test_run_invalid():
+    with pytest.raises(ValueError):
+        run(u'희', engine='jit')
+    with pytest.raises(ValueError):
+        run(u'희', source='python')
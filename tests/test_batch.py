@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from aheui import api
+from aheui import batch
+
+
+def test_batch_in_input_order(tmpdir):
+    tmpdir.mkdir('inputs')
+    for name, data in [('b', b'10 -2'), ('a', b'3 4'), ('c', b'\xff')]:
+        tmpdir.join('inputs', name).write_binary(data)
+    tmpdir.join('manifest').write('inputs/c\ninputs/a\n\ninputs/b\n')
+    compiler = api.load(u'방방다망희')
+
+    for jobs in [1, 2]:
+        results = list(batch.run_batch(compiler, batch.iter_inputs(str(tmpdir.join('inputs'))), jobs=jobs))
+        assert [r.get('stdout') for r in results] == ['7', '8', None]
+        assert [r['exitcode'] for r in results] == [0, 0, None]
+        assert 'error' in results[2]
+        assert all(r['time'] >= 0 for r in results)
+
+    results = list(batch.run_batch(compiler, batch.iter_inputs(str(tmpdir.join('manifest'))), 'register', 2))
+    assert [r.get('stdout') for r in results] == [None, '7', '8']
+
+
+def test_batch_jsonl(tmpdir):
+    tmpdir.join('payloads.jsonl').write('"1 2"\n{"stdin": "5 5"}\n')
+    compiler = api.load(u'방방다망희')
+    results = list(batch.run_batch(compiler, batch.iter_inputs(str(tmpdir.join('payloads.jsonl'))), jobs=1))
+    assert [(r['input'][-2:], r['stdout']) for r in results] == [(':1', '3'), (':2', '10')]
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from aheui import aheui
+from aheui import api
+from aheui import bytecode
+from aheui import compile
+from aheui import const as c
+from aheui import option
+
+
+ASM = u'''PUSH 3
+loop:
+DUP
+POPNUM
+PUSH 1
+SUB
+DUP
+BRZ end
+JMP loop
+end:
+HALT
+'''
+
+
+def load():
+    return api.load(ASM, 0, 'asm')
+
+
+def resolved(compiler):
+    return [(op, compiler.label_map[val] if op in c.OP_JUMPS else val) for op, val in compiler.lines]
+
+
+def test_bytecode_v2_roundtrip():
+    compiler = load()
+    compiler.lines.insert(0, (c.OP_PUSH, -(1 << 30)))
+    compiler.lines.insert(0, (c.OP_POP, -1))
+    data = compiler.write_bytecode()
+    assert data.startswith(bytecode.MAGIC)
+    assert len(data) == bytecode.HEADER_SIZE + 8 * len(compiler.lines) + 4 * len(set(compiler.label_map.values()))
+
+    loaded = compile.Compiler()
+    loaded.read_bytecode(data)
+    assert resolved(loaded) == resolved(compiler)
+
+    with pytest.raises(bytecode.BytecodeError):
+        bytecode.parse(data[:-1])
+    with pytest.raises(bytecode.BytecodeError):
+        bytecode.parse(data[:-1] + b'\x7f')
+    with pytest.raises(bytecode.BytecodeError):
+        bytecode.dump([(c.OP_PUSH, 1 << 31)], {})
+    with pytest.raises(bytecode.BytecodeError):
+        bytecode.parse(bytecode.dump([(0, 0), (c.OP_HALT, 0)], {}))
+    with pytest.raises(bytecode.BytecodeError):
+        bytecode.parse(bytecode.dump([(c.OP_JMP, 0), (c.OP_HALT, 0)], {0: 2}))
+
+
+def test_bytecode_v1_compatibility():
+    compiler = load()
+    loaded = compile.Compiler()
+    loaded.read_bytecode(compiler.write_bytecode_v1())
+    assert [op for op, _ in loaded.lines] == [op for op, _ in compiler.lines]
+    assert api.run(loaded) == (b'321', 0)
+
+
+def test_load_bytecode(tmpdir):
+    compiler = load()
+    path = tmpdir.join('x.aheuic')
+    path.write_binary(compiler.write_bytecode() + b'\n\n' + compiler.write_asm().encode('utf-8'))
+    program = aheui.load_bytecode(path.read_binary())
+    assert list(program.opcodes) == [op for op, _ in compiler.lines]
+    assert api.run(program) == (b'321', 0)
+    assert api.run(path.read_binary()) == api.run(compiler)
+
+
+def test_read_input_maps_bytecode(tmpdir):
+    compiler = load()
+    path = tmpdir.join('x.aheuic')
+    path.write_binary(compiler.write_bytecode())
+    fp = os.open(str(path), os.O_RDONLY)
+    try:
+        data = option.read_input(fp, True)
+    finally:
+        os.close(fp)
+    assert not isinstance(data, bytes)
+    assert api.run(aheui.load_bytecode(data)) == (b'321', 0)
+
+
+def test_entry_point_loads_bytecode(tmpdir, monkeypatch):
+    compiler = load()
+    path = tmpdir.join('x.aheuic')
+    path.write_binary(compiler.write_bytecode())
+    written = []
+
+    def write(fd, data):
+        written.append(data)
+        return len(data)
+
+    def prepare_compiler(*args):
+        assert False, 'v2 bytecode runs without compiling'
+    monkeypatch.setattr(aheui.output_buffer, 'write_fd', write)
+    monkeypatch.setattr(aheui.warnings, 'limit', aheui.warnings.limit)  # set by entry_point
+    monkeypatch.setattr(aheui, 'prepare_compiler', prepare_compiler)
+    assert aheui.entry_point(['aheui', str(path)]) == 0
+    assert b''.join(written) == b'321'
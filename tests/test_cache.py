@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import os
+
+from aheui import aheui
+from aheui import cache
+from aheui import const as c
+
+
+def resolved(compiler):
+    return [(op, compiler.label_map[val] if op in c.OP_JUMPS else val) for op, val in compiler.lines]
+
+
+def test_cache_hit_and_key(tmpdir, mocker):
+    cache_dir = str(tmpdir.join('cache'))
+    code = u'반받망빠뿌빠뿌빠뿌주빠빠따따맣희'.encode('utf-8')
+    compiler = aheui.prepare_compiler(code, 2, 'text', cache_dir=cache_dir)
+    key = cache.make_key(code, 2, 'text')
+    assert os.listdir(cache_dir) == [key + '.aheuic']
+
+    optimize2 = mocker.patch('aheui.compile.Compiler.optimize2')
+    cached = aheui.prepare_compiler(code, 2, 'text', cache_dir=cache_dir)
+    assert not optimize2.called
+    assert resolved(cached) == resolved(compiler)
+
+    assert cache.make_key(code, 1, 'text') != key
+    assert cache.make_key(code + b' ', 2, 'text') != key
+
+
+def test_cache_ignores_broken_entry(tmpdir):
+    cache_dir = str(tmpdir)
+    code = u'밣희'.encode('utf-8')
+    key = cache.make_key(code, 2, 'text')
+    tmpdir.join(key + '.aheuic').write(b'HALT\n')
+    assert cache.load(cache_dir, key) is None
+    compiler = aheui.prepare_compiler(code, 2, 'text', cache_dir=cache_dir)
+    assert resolved(cache.load(cache_dir, key)) == resolved(compiler)
+
+
+def test_cache_hit_writes_aheuic(tmpdir, monkeypatch):
+    cache_dir = str(tmpdir.join('cache'))
+    code = u'밣희'.encode('utf-8')
+    aheui.prepare_compiler(code, 2, 'text', cache_dir=cache_dir)
+
+    monkeypatch.setattr('aheui.compile.Compiler.optimize2', None)
+    output = tmpdir.join('x.aheuic')
+    cached = aheui.prepare_compiler(code, 2, 'text', aheuic_output=str(output), cache_dir=cache_dir)
+    assert output.read_binary() == cached.write_bytecode() + b'\n\n' + cached.write_asm().encode('utf-8')
@@ -0,0 +1,125 @@
+# coding: utf-8
+from aheui import cfg
+from aheui import const as c
+
+
+LINES = [
+    (c.OP_PUSH, 3),
+    (c.OP_DUP, -1),
+    (c.OP_BRZ, 1),
+    (c.OP_PUSH, 1),
+    (c.OP_SUB, -1),
+    (c.OP_JMP, 2),
+    (c.OP_POP, -1),
+    (c.OP_HALT, -1),
+]
+LABEL_MAP = {1: 6, 2: 1}
+
+
+def test_build():
+    graph = cfg.build(LINES, LABEL_MAP)
+
+    assert [len(block.codes) for block in graph.blocks] == [1, 2, 3, 2]
+    assert [block.succs for block in graph.blocks] == [[1], [2, 3], [1], []]
+    assert [block.preds for block in graph.blocks] == [[], [0, 2], [1], [1]]
+    assert graph.blocks[1].codes[-1] == (c.OP_BRZ, 3)
+    assert graph.blocks[2].codes[-1] == (c.OP_JMP, 1)
+
+    assert (graph.blocks[1].stack_req, graph.blocks[1].stack_diff) == (1, 0)
+    assert (graph.blocks[2].stack_req, graph.blocks[2].stack_diff) == (1, 0)
+
+
+def test_stack_effect():
+    block = cfg.Block([
+        (c.OP_PUSH, 1),
+        (c.OP_ADD, -1),
+        (c.OP_SEL, 1),
+        (c.OP_POP, -1),
+    ], [[], [], [], []])
+    block.compute_stack_effect()
+
+    # the codes on the storage selected at the start end at OP_SEL
+    assert (block.stack_req, block.stack_diff, block.stack_end) == (1, 0, 2)
+
+
+def test_linearize():
+    graph = cfg.build(LINES, LABEL_MAP)
+    lines, label_map, comments = graph.linearize()
+
+    resolved = [
+        (op, label_map[val]) if op in c.OP_JUMPS else (op, val) for op, val in lines]
+    assert resolved == [
+        (op, LABEL_MAP[val]) if op in c.OP_JUMPS else (op, val) for op, val in LINES]
+    assert len(comments) == len(lines)
+
+    graph.order = [0, 1, 3, 2]
+    lines, label_map, _ = graph.linearize()
+    assert [op for op, _ in lines] == [
+        c.OP_PUSH, c.OP_DUP, c.OP_BRZ, c.OP_JMP, c.OP_POP, c.OP_HALT,
+        c.OP_PUSH, c.OP_SUB, c.OP_JMP]
+    assert label_map[lines[3][1]] == 6
+
+
+def test_chain_layout_keeps_order():
+    graph = cfg.build(LINES, LABEL_MAP)
+    graph.blocks[1].codes[-1] = (c.OP_JMP, 2)
+    graph.link()
+    graph.order = [0, 1, 2]  # the block of OP_POP is out of path
+
+    graph.chain_layout()
+    assert graph.order == [0, 1, 2]
+    lines, _, _ = graph.linearize()
+    assert c.OP_POP not in [op for op, _ in lines]
+
+
+def test_join_chains():
+    graph = cfg.build(LINES, LABEL_MAP)
+    assert not graph.join_chains()  # the loop enters the second block too
+
+    lines = [
+        (c.OP_PUSH, 1),
+        (c.OP_JMP, 1),
+        (c.OP_POP, -1),
+        (c.OP_PUSH, 2),
+        (c.OP_ADD, -1),
+        (c.OP_HALT, -1),
+    ]
+    graph = cfg.build(lines, {1: 3})
+    reachable = graph.reachability()
+    graph.order = [idx for idx in graph.order if reachable[idx]]
+    assert graph.join_chains()
+    assert graph.order == [0]
+    assert graph.blocks[0].codes == [(c.OP_PUSH, 1), (c.OP_PUSH, 2), (c.OP_ADD, -1), (c.OP_HALT, -1)]
+    lines, _, _ = graph.linearize()
+    assert lines == graph.blocks[0].codes
+
+
+def test_merge_tails():
+    lines = [
+        (c.OP_PUSHNUM, -1),
+        (c.OP_BRZ, 1),
+        (c.OP_PUSH, 2),
+        (c.OP_PUSH, 3),
+        (c.OP_MUL, -1),
+        (c.OP_POPNUM, -1),
+        (c.OP_HALT, -1),
+        (c.OP_PUSH, 4),
+        (c.OP_PUSH, 3),
+        (c.OP_MUL, -1),
+        (c.OP_POPNUM, -1),
+        (c.OP_HALT, -1),
+    ]
+    graph = cfg.build(lines, {1: 7})
+
+    assert graph.merge_tails(2)
+    assert [block.codes for block in graph.blocks] == [
+        [(c.OP_PUSHNUM, -1), (c.OP_BRZ, 2)],
+        [(c.OP_PUSH, 2), (c.OP_JMP, 3)],
+        [(c.OP_PUSH, 4), (c.OP_JMP, 3)],
+        [(c.OP_PUSH, 3), (c.OP_MUL, -1), (c.OP_POPNUM, -1), (c.OP_HALT, -1)],
+    ]
+    assert not graph.merge_tails(2)
+
+    graph.chain_layout()
+    lines, _, comments = graph.linearize()
+    assert len(lines) == len(comments) == 9
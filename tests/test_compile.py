@@ -1,5 +1,6 @@
 
 # -*- coding: utf-8 -*-
+from aheui import api
 from aheui import compile
 
 
@@ -58,6 +59,248 @@ def test_optimize_jump_resolves_chains():
     assert compiler.label_map[2] == 3
 
 
+def test_optimize2_traces_each_selected_storage():
+    # both paths reach L6 with 1 value in the stack 0, but the taken one
+    # selects the empty stack 1 and needs the OP_BRPOP1
+    asm = u'''
+        PUSH 5
+        PUSH 0
+        BRZ L4
+        JMP L6
+L4:     SEL 1
+L6:     PUSH 7
+        POP
+        BRPOP1 L11
+        POPNUM
+        HALT
+L11:    PUSH 3
+        POPNUM
+        HALT
+'''
+    compiler = api.load(asm, 2, source='asm')
+    assert compile.c.OP_BRPOP1 in [op for op, _ in compiler.lines]
+    for opt in (0, 1, 2, 3):
+        assert api.run(asm, opt=opt, source='asm') == (b'3', 0)
+
+
+def test_optimize_order_chains_runs():
+    compiler = compile.Compiler()
+    compiler.lines = [
+        (compile.c.OP_PUSH, 1),
+        (compile.c.OP_JMP, 1),
+        (compile.c.OP_PUSH, 3),
+        (compile.c.OP_BRZ, 3),
+        (compile.c.OP_HALT, -1),
+        (compile.c.OP_PUSH, 2),
+        (compile.c.OP_JMP, 2),
+    ]
+    compiler.label_map = {1: 5, 2: 2, 3: 0}
+
+    graph = compiler.build_graph()
+    compiler.optimize_order(graph)
+    compiler.write_graph(graph)
+
+    assert compiler.lines[:3] == [
+        (compile.c.OP_PUSH, 1),
+        (compile.c.OP_PUSH, 2),
+        (compile.c.OP_PUSH, 3),
+    ]
+    op, label = compiler.lines[3]
+    assert op == compile.c.OP_BRZ
+    assert compiler.label_map == {label: 0}
+    assert compiler.lines[4:] == [(compile.c.OP_HALT, -1)]
+
+
+def test_optimize_stack():
+    compiler = compile.Compiler()
+    compiler.lines = [
+        (compile.c.OP_PUSHNUM, -1),
+        (compile.c.OP_PUSH, 2),
+        (compile.c.OP_PUSH, 3),
+        (compile.c.OP_SWAP, -1),
+        (compile.c.OP_SUB, -1),
+        (compile.c.OP_NONE, -1),
+        (compile.c.OP_PUSH, 4),
+        (compile.c.OP_MUL, -1),
+        (compile.c.OP_ADD, -1),
+        (compile.c.OP_DUP, -1),
+        (compile.c.OP_POP, -1),
+        (compile.c.OP_PUSH, 0),
+        (compile.c.OP_BRZ, 1),
+        (compile.c.OP_PUSH, 5),
+        (compile.c.OP_POPNUM, -1),
+        (compile.c.OP_HALT, -1),
+    ]
+    compiler.label_map = {1: 14}
+
+    graph = compiler.build_graph()
+    compiler.optimize_stack(graph)
+    compiler.write_graph(graph)
+
+    assert compiler.lines[:3] == [
+        (compile.c.OP_PUSHNUM, -1),
+        (compile.c.OP_PUSH, 4),
+        (compile.c.OP_ADD, -1),
+    ]
+    assert compiler.lines[3][0] == compile.c.OP_JMP
+    assert compiler.label_map[compiler.lines[3][1]] == 5
+    assert compiler.lines[5:] == [
+        (compile.c.OP_POPNUM, -1),
+        (compile.c.OP_HALT, -1),
+    ]
+
+
+def test_optimize_stack_queue():
+    compiler = compile.Compiler()
+    compiler.lines = [
+        (compile.c.OP_SEL, compile.c.VAL_QUEUE),
+        (compile.c.OP_PUSHNUM, -1),
+        (compile.c.OP_PUSH, 2),
+        (compile.c.OP_PUSH, 3),
+        (compile.c.OP_POPNUM, -1),  # pops the input at the head
+        (compile.c.OP_PUSH, 4),
+        (compile.c.OP_SWAP, -1),
+        (compile.c.OP_SUB, -1),
+        (compile.c.OP_MUL, -1),
+        (compile.c.OP_POPNUM, -1),
+        (compile.c.OP_HALT, -1),
+    ]
+    compiler.label_map = {}
+
+    graph = compiler.build_graph()
+    assert compiler.compute_queue_sizes(graph)[0][1:5] == [0, 1, 2, 3]
+
+    compiler.optimize_stack(graph)
+    compiler.write_graph(graph)
+
+    # the head 3 and the next 2 are popped and 2 - 3 is pushed to the tail
+    assert compiler.lines == [
+        (compile.c.OP_SEL, compile.c.VAL_QUEUE),
+        (compile.c.OP_PUSHNUM, -1),
+        (compile.c.OP_POPNUM, -1),
+        (compile.c.OP_PUSH, -4),
+        (compile.c.OP_POPNUM, -1),
+        (compile.c.OP_HALT, -1),
+    ]
+
+
+def test_optimize_prefix():
+    compiler = compile.Compiler()
+    compiler.lines = [
+        (compile.c.OP_PUSH, 3),
+        (compile.c.OP_DUP, -1),
+        (compile.c.OP_POPNUM, -1),
+        (compile.c.OP_PUSH, 1),
+        (compile.c.OP_SUB, -1),
+        (compile.c.OP_DUP, -1),
+        (compile.c.OP_BRZ, 2),
+        (compile.c.OP_JMP, 1),
+        (compile.c.OP_PUSH, 5),
+        (compile.c.OP_MOV, compile.c.VAL_QUEUE),
+        (compile.c.OP_PUSHNUM, -1),
+        (compile.c.OP_ADD, -1),
+        (compile.c.OP_POPNUM, -1),
+        (compile.c.OP_HALT, -1),
+    ]
+    compiler.label_map = {1: 1, 2: 8}
+
+    assert compiler.optimize_prefix()
+
+    # 3, 2 and 1 are written and 0 and 5 are left before the input
+    assert compiler.lines[:10] == [
+        (compile.c.OP_PUSH, 3),
+        (compile.c.OP_POPNUM, -1),
+        (compile.c.OP_PUSH, 2),
+        (compile.c.OP_POPNUM, -1),
+        (compile.c.OP_PUSH, 1),
+        (compile.c.OP_POPNUM, -1),
+        (compile.c.OP_PUSH, 0),
+        (compile.c.OP_SEL, compile.c.VAL_QUEUE),
+        (compile.c.OP_PUSH, 5),
+        (compile.c.OP_SEL, 0),
+    ]
+    assert compiler.lines[10][0] == compile.c.OP_JMP
+    assert compiler.lines[compiler.label_map[compiler.lines[10][1]]] == (compile.c.OP_PUSHNUM, -1)
+
+    compiler.optimize2()
+    assert [op for op, _ in compiler.lines].count(compile.c.OP_PUSHNUM) == 1
+
+
+def test_optimize_prefix_halts():
+    compiler = compile.Compiler()
+    compiler.compile(u'밤밣따빠밣밟따뿌\n빠맣파빨받밤뚜뭏\n돋밬탕빠맣붏두붇\n볻뫃박발뚷투뭏붖\n'
+                     u'뫃도뫃희멓뭏뭏붘\n뫃봌토범더벌뿌뚜\n뽑뽀멓멓더벓뻐뚠\n뽀덩벐멓뻐덕더벅\n')
+    compiler.optimize3()
+
+    assert compiler.lines[-1] == (compile.c.OP_HALT, -1)
+    assert set(op for op, _ in compiler.lines) == set([
+        compile.c.OP_PUSH, compile.c.OP_POPCHAR, compile.c.OP_HALT])
+    assert api.run(compiler) == (b'Hello, world!\n', 0)
+
+
+def test_optimize_loop():
+    # 0 + 7 * n by a loop
+    compiler = api.load(u'바방아아아우\n받반타타아빠추\n오어어퍼더벍퍼\n아아아아허멍머\n')
+    assert (compile.c.OP_ADDMUL, 7) in compiler.lines
+    assert api.run(compiler, b'6') == (b'42', 0)
+
+    asm = u'''PUSH 1
+PUSH 2
+PUSH 3
+PUSHNUM
+L: DUP
+BRZ E
+BRPOP2 F
+SWAP
+MOV 3
+PUSH 1
+SUB
+JMP L
+E: SEL 3
+POPNUM
+HALT
+F: PUSH 9
+POPNUM
+HALT
+'''
+    compiler = api.load(asm, source='asm')
+    assert (compile.c.OP_BULKMOV, 3) in compiler.lines
+    loop = api.load(asm, 1, source='asm')
+    assert api.run(compiler, b'2') == api.run(loop, b'2') == (b'2', 3)
+    # not enough values to move at once
+    assert api.run(compiler, b'5') == api.run(loop, b'5') == (b'9', 2)
+
+
+def test_optimize_storage():
+    asm = u'''PUSHNUM
+PUSHNUM
+ADD
+MOV 3
+PUSHNUM
+BRZ A
+SEL 3
+JMP B
+A: SEL 4
+PUSH 7
+B: DUP
+ADD
+POPNUM
+HALT
+'''
+    compiler = api.load(asm, source='asm')
+    assert (compile.c.OP_ADDAT, 0) in compiler.lines
+    assert (compile.c.OP_MOVTO, 3) in compiler.lines
+    # paths from storage 3 and 4 meet
+    assert (compile.c.OP_ADD, -1) in compiler.lines
+    generic = api.load(asm, 1, source='asm')
+    assert api.run(compiler, b'2 3 0') == api.run(generic, b'2 3 0') == (b'14', 0)
+    assert api.run(compiler, b'2 3 1') == api.run(generic, b'2 3 1') == (b'10', 0)
+
+    compiler.optimize_split()
+    specialized = [op for op, _ in compile.c.OP_SPECIALIZATIONS]
+    assert not [op for op, _ in compiler.lines if op in specialized]
+
+
 def test_optimize_operation_folds_zero_brz():
     compiler = compile.Compiler()
     compiler.lines = [
@@ -133,3 +376,89 @@ def test_optimize():
                      뫃떠벌번정따도퍼즐릿
                      '''.replace(' ', ''))
     compiler.optimize2()
+
+
+def test_optimize_fusion():
+    compiler = compile.Compiler()
+    compiler.lines = [
+        (compile.c.OP_PUSHNUM, -1),
+        (compile.c.OP_PUSH, 2),
+        (compile.c.OP_ADD, -1),
+        (compile.c.OP_DUP, -1),
+        (compile.c.OP_BRZ, 1),
+        (compile.c.OP_POPNUM, -1),
+        (compile.c.OP_HALT, -1),
+    ]
+    compiler.label_map = {1: 6}
+
+    reachability = compiler.optimize_fusion()
+    compiler.optimize_adjust(reachability)
+
+    assert compiler.lines == [
+        (compile.c.OP_PUSHNUM, -1),
+        (compile.c.OP_PUSHADD, 2),
+        (compile.c.OP_DUPBRZ, 1),
+        (compile.c.OP_POPNUM, -1),
+        (compile.c.OP_HALT, -1),
+    ]
+    assert compiler.label_map[1] == 4
+
+    def resolved(compiler):
+        return [
+            (op, compiler.label_map[val] if op in compile.c.OP_JUMPS else val if compile.OP_USEVAL[op] else -1)
+            for op, val in compiler.lines]
+
+    fused = resolved(compiler)
+    compiler.read_asm(compiler.write_asm())
+    assert resolved(compiler) == fused
+    compiler.read_bytecode(compiler.write_bytecode())
+    assert resolved(compiler) == fused
+
+    compiler.optimize_split()
+    assert [op for op, _ in compiler.lines] == [
+        compile.c.OP_PUSHNUM, compile.c.OP_PUSH, compile.c.OP_ADD,
+        compile.c.OP_DUP, compile.c.OP_BRZ, compile.c.OP_POPNUM, compile.c.OP_HALT]
+    assert resolved(compiler)[4] == (compile.c.OP_BRZ, 6)
+
+
+def test_optimize_fusion_keeps_jump_target():
+    compiler = compile.Compiler()
+    compiler.lines = [
+        (compile.c.OP_PUSH, 2),
+        (compile.c.OP_ADD, -1),
+        (compile.c.OP_JMP, 1),
+    ]
+    compiler.label_map = {1: 1}
+
+    reachability = compiler.optimize_fusion()
+
+    assert reachability == [1, 1, 1]
+    assert compiler.lines[0] == (compile.c.OP_PUSH, 2)
+
+
+def test_fusion_stack_effects():
+    for fused, parts in compile.c.OP_FUSIONS:
+        deleted, added = 0, 0
+        for part in parts:
+            if compile.c.OP_STACKDEL[part] > added:
+                deleted += compile.c.OP_STACKDEL[part] - added
+                added = 0
+            else:
+                added -= compile.c.OP_STACKDEL[part]
+            added += compile.c.OP_STACKADD[part]
+        assert compile.c.OP_STACKDEL[fused] == deleted
+        assert compile.c.OP_STACKADD[fused] == added
+        assert compile.c.OP_REQSIZE[fused] == deleted
+
+
+def test_primitive_wraps():
+    primitive = compile.PrimitiveProgram(u'아아아\n\n아a\n아아아아\n')
+    assert primitive.decode((2, 1)) == compile.NONE_CELL
+    assert primitive.decode((0, 3)) == compile.NONE_CELL
+    assert primitive.char_at((0, 1)) == u'아'
+    assert primitive.advance_position((0, 2), compile.DIR_RIGHT) == (0, 0)
+    assert primitive.advance_position((2, 0), compile.DIR_LEFT) == (2, 1)
+    assert primitive.advance_position((3, 3), compile.DIR_DOWN) == (3, 3)
+    assert primitive.advance_position((3, 2), compile.DIR_DOWN, 2) == (0, 2)
+    assert primitive.advance_position((0, 1), compile.DIR_UP) == (3, 1)
+    assert primitive.advance_position((2, 1), compile.DIR_UP, 2) == (0, 1)
@@ -0,0 +1,126 @@
+# coding: utf-8
+import sys
+
+import pytest
+
+pytest.importorskip('rpython')
+
+from aheui.int import bigint, hybridint, smallint  # noqa: E402
+
+
+MAXINT = sys.maxsize
+MININT = -MAXINT - 1
+
+
+def _value(r):
+    return int(hybridint.str(r))
+
+
+def _promoted(v):
+    r = hybridint.fromlong(v)
+    assert r.big is not None
+    return r
+
+
+@pytest.mark.parametrize(('op', 'a', 'b', 'expected'), [
+    (hybridint.add, MAXINT, 1, MAXINT + 1),
+    (hybridint.add, MININT, -1, MININT - 1),
+    (hybridint.sub, MININT, 1, MININT - 1),
+    (hybridint.sub, MAXINT, -1, MAXINT + 1),
+    (hybridint.mul, MAXINT, 2, MAXINT * 2),
+    (hybridint.mul, MININT, -1, MAXINT + 1),
+])
+def test_promote_on_overflow(op, a, b, expected):
+    r = op(hybridint.fromint(a), hybridint.fromint(b))
+    assert r.big is not None
+    assert _value(r) == expected
+
+
+def test_no_promotion_at_boundary():
+    r = hybridint.add(hybridint.fromint(MAXINT - 1), hybridint.fromint(1))
+    assert r.big is None
+    assert r.value == MAXINT
+    r = hybridint.sub(hybridint.fromint(MININT + 1), hybridint.fromint(1))
+    assert r.big is None
+    assert r.value == MININT
+
+
+def test_demote():
+    big = _promoted(MAXINT + 1)
+    r = hybridint.sub(big, hybridint.fromint(1))
+    assert r.big is None
+    assert r.value == MAXINT
+    r = hybridint.div(hybridint.mul(big, hybridint.fromint(3)), big)
+    assert r.big is None
+    assert r.value == 3
+    r = hybridint.mod(big, hybridint.fromint(7))
+    assert r.big is None
+    assert r.value == (MAXINT + 1) % 7
+    assert hybridint.fromstr(b'%d' % MAXINT).big is None
+    assert hybridint.fromlong(MININT).big is None
+
+
+@pytest.mark.parametrize(('a', 'b'), [
+    (7, 2),
+    (-7, 2),
+    (7, -2),
+    (-7, -2),
+    (MAXINT, -1),
+    (MININT, 1),
+    (MININT, -1),
+    (MININT, 2),
+    (MININT, -3),
+    (MAXINT + 1, -1),
+    (-MAXINT - 2, 5),
+    (MAXINT * 3, -MAXINT - 2),
+])
+def test_div_mod_signs(a, b):
+    r1 = hybridint.fromlong(a)
+    r2 = hybridint.fromlong(b)
+    big1 = bigint.fromlong(a)
+    big2 = bigint.fromlong(b)
+
+    quotient = hybridint.div(r1, r2)
+    assert _value(quotient) == smallint.div(a, b)
+    assert hybridint.str(quotient) == bigint.str(bigint.div(big1, big2))
+    remainder = hybridint.mod(r1, r2)
+    assert _value(remainder) == smallint.mod(a, b)
+    assert hybridint.str(remainder) == bigint.str(bigint.mod(big1, big2))
+
+
+def test_min_div_minus_one_promotes():
+    r = hybridint.div(hybridint.fromint(MININT), hybridint.fromint(-1))
+    assert r.big is not None
+    assert _value(r) == MAXINT + 1
+    r = hybridint.mod(hybridint.fromint(MININT), hybridint.fromint(-1))
+    assert r.big is None
+    assert r.value == 0
+
+
+@pytest.mark.parametrize('a', [1, 0, MININT, MAXINT + 1])
+def test_zero_division(a):
+    zero = hybridint.fromint(0)
+    with pytest.raises(ZeroDivisionError):
+        hybridint.div(hybridint.fromlong(a), zero)
+    with pytest.raises(ZeroDivisionError):
+        hybridint.mod(hybridint.fromlong(a), zero)
+
+
+def test_promoted_values():
+    big = _promoted(MAXINT + 1)
+    negative = _promoted(MININT - 1)
+
+    assert not hybridint.is_zero(big)
+    assert not hybridint.is_zero(negative)
+    zero = hybridint.sub(big, big)
+    assert zero.big is None
+    assert hybridint.is_zero(zero)
+
+    assert not hybridint.is_unicodepoint(big)
+    assert not hybridint.is_unicodepoint(negative)
+    assert hybridint.is_unicodepoint(hybridint.fromint(0xAC00))
+
+    assert hybridint.str(big) == b'%d' % (MAXINT + 1)
+    assert hybridint.str(negative) == b'%d' % (MININT - 1)
+    assert hybridint.ge(big, hybridint.fromint(MAXINT))
+    assert not hybridint.ge(negative, hybridint.fromint(MININT))
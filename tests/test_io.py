@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from aheui import aheui
+
+
+def chunked_reader(data, chunk_size):
+    chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+    calls = []
+
+    def read(fd, length):
+        calls.append(length)
+        return chunks.pop(0) if chunks else b''
+    return read, calls
+
+
+def test_input_buffer_block_read():
+    read, calls = chunked_reader(b'12 -3\n', 100)
+    buf = aheui.InputBuffer(fd=-1, read=read, block_size=4096)
+    assert aheui.read_number(buf) == 12
+    assert aheui.read_number(buf) == -3
+    assert calls == [4096]
+
+
+def test_input_buffer_across_chunks():
+    text = u'아희\n1234'.encode('utf-8')
+    read, _ = chunked_reader(text, 1)
+    buf = aheui.InputBuffer(fd=-1, read=read, block_size=1)
+    assert aheui.read_utf8(buf) == ord(u'아')
+    assert aheui.read_utf8(buf) == ord(u'희')
+    assert aheui.read_utf8(buf) == ord(u'\n')
+    assert aheui.read_number(buf) == 1234
+    assert aheui.read_utf8(buf) == -1
+
+
+def test_input_buffer_mmap(tmpdir):
+    path = tmpdir.join('input')
+    path.write_binary(u'42 가'.encode('utf-8'))
+    with open(str(path), 'rb') as f:
+        buf = aheui.InputBuffer(fd=f.fileno())
+        assert aheui.read_number(buf) == 42
+        assert aheui.read_utf8(buf) == ord(u'가')
+        assert buf.mapped
+
+
+def test_read_number_ready_queue():
+    read, calls = chunked_reader(b'1 -22\t333\n4a5', 100)
+    buf = aheui.InputBuffer(fd=-1, read=read, block_size=100)
+    assert aheui.read_number(buf) == 1
+    assert buf.numbers == [1, -22, 333, 4]  # 5 may continue after the buffer
+    assert aheui.read_number(buf) == -22
+    # reading a character drops the numbers scanned ahead
+    assert aheui.read_utf8(buf) == ord(u'3')
+    assert buf.numbers == []
+    assert aheui.read_number(buf) == 33
+    assert aheui.read_number(buf) == 4
+    assert aheui.read_utf8(buf) == ord(u'a')
+    assert aheui.read_number(buf) == 5
+
+
+def test_output_flushed_on_error(monkeypatch):
+    written = []
+
+    def write(fd, data):
+        written.append(data)
+        return len(data)
+    monkeypatch.setattr(aheui.output_buffer, 'write_fd', write)
+    monkeypatch.setattr(aheui.warnings, 'limit', aheui.warnings.limit)  # set by entry_point
+    with pytest.raises(ZeroDivisionError):
+        aheui.entry_point(['aheui', '--no-c', '-c', u'반망반바나'])
+    assert b''.join(written) == b'2'
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from aheui import compile
+from aheui.aheui import Program, profile_mainloop
+from aheui.profile import Profile
+
+
+def test_profile_counters():
+    compiler = compile.Compiler()
+    compiler.read_asm(u'''PUSH 3
+loop: DUP
+BRZ end
+SEL 1
+SEL 0
+PUSH 1
+SUB
+JMP loop
+end: HALT
+''')
+    program = Program(compiler.lines, compiler.label_map)
+    profile = Profile(program.size)
+    assert profile_mainloop(program, None, profile) == 0
+    assert profile.pc_counts[:3] == [1, 4, 4]
+    assert (profile.taken[2], profile.not_taken[2]) == (1, 3)
+    assert profile.switches[3:5] == [3, 3]
+    assert profile.op_counts[compile.c.OP_JMP] == 3
+
+    report = profile.report(compiler.lines, compiler.label_map, compiler.debug)
+    assert u'L2\t4\tBRZ L8\t1\t3\t-\t' in report
+    assert u'L3\t3\tSEL 1\t-\t-\t3\t' in report
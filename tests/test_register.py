@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from aheui import compile
+from aheui import register
+from aheui.aheui import regloop
+
+
+def translate(code, level=2):
+    compiler = compile.Compiler()
+    compiler.compile(code)
+    if level == 1:
+        compiler.optimize1()
+    elif level == 2:
+        compiler.optimize2()
+    return register.translate(compiler.lines, compiler.label_map)
+
+
+def test_register_exitcode():
+    for level in [0, 1, 2]:
+        assert regloop(translate(u'밣희', level)) == 8
+        assert regloop(translate(u'밣상희', level)) == 0
+        assert regloop(translate(u'반반다희', level)) == 4
+        assert regloop(translate(u'상반발타희', level)) == 3
+        assert regloop(translate(u'샇반발빠희', level)) == 5
+
+
+def test_register_block_local_values():
+    compiler = compile.Compiler()
+    compiler.read_asm(u'''PUSH 3
+PUSH 4
+MUL
+DUP
+ADD
+PUSH 5
+SWAP
+SUB
+HALT
+''')
+    program = register.translate(compiler.lines, compiler.label_map)
+    opcodes = program.opcodes
+    # only the final value is stored before halt
+    assert opcodes.count(register.R_PUSH) == 1
+    assert register.R_POP not in opcodes
+    assert regloop(program) == -19
+
+
+def test_register_side_exit_stores_pending():
+    compiler = compile.Compiler()
+    compiler.read_asm(u'''PUSH 7
+PUSH 0
+BRZ out
+HALT
+out: HALT
+''')
+    program = register.translate(compiler.lines, compiler.label_map)
+    assert regloop(program) == 7
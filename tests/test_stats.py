@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from aheui import compile
+from aheui import stats
+from aheui.aheui import Program, Storage, mainloop
+
+
+def test_storage_stats():
+    compiler = compile.Compiler()
+    compiler.read_asm(u'''PUSH 2
+PUSH 3
+ADD
+DUP
+DUP
+MOV 21
+MOV 21
+SEL 21
+PUSH 4
+ADD
+HALT
+''')
+    storage = Storage(True)
+    assert mainloop(Program(compiler.lines, compiler.label_map), None, None, storage) == 4
+
+    stack = storage[0]
+    assert (len(stack), stack.peak, stack.pushes, stack.pops()) == (1, 3, 4, 3)
+    queue = storage[21]
+    assert (len(queue), queue.peak, queue.pushes, queue.pops()) == (1, 3, 4, 3)
+    assert stack.nbytes() > 0
+
+    text = stats.report_text(storage)
+    assert text.count(u'\n') == 3
+    assert u'(21)\t1\t3\t4\t3\t' in text
+    assert stats.report_json(storage).count(u'"index"') == 28
+
+    # storages count nothing without stats
+    storage = Storage()
+    assert mainloop(Program(compiler.lines, compiler.label_map), None, None, storage) == 4
+    assert (len(storage[0]), storage[0].pushes, storage[21].pushes) == (1, 0, 0)
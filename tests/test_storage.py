@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+from aheui import api
+from aheui.storage import contiguous, linkedlist
+
+
+def contents(storage):
+    values = []
+    while len(storage) > 0:
+        values.append(storage.pop())
+    return values
+
+
+@pytest.mark.parametrize('name', ['Stack', 'Queue', 'Port'])
+def test_contiguous_matches_linkedlist(name):
+    rng = random.Random(name)
+    array = getattr(contiguous, name)()
+    linked = getattr(linkedlist, name)()
+    for step in range(5000):
+        # grow first, then shrink to cover resizes in both directions
+        push_ratio = 0.7 if step < 2500 else 0.3
+        if len(linked) < 2 or rng.random() < push_ratio:
+            value = rng.randint(-100, 100)
+            array.push(value)
+            linked.push(value)
+        else:
+            op = rng.choice(['pop', 'dup', 'swap', 'add', 'sub', 'mul', 'cmp'])
+            assert getattr(array, op)() == getattr(linked, op)()
+        assert len(array) == len(linked)
+    assert (array.pushes, array.peak, array.pops()) == (linked.pushes, linked.peak, linked.pops())
+    assert contents(array) == contents(linked)
+    assert array.capacity() == contiguous.MIN_CAPACITY
+
+
+def test_queue_wraps_around():
+    queue = contiguous.Queue()
+    for i in range(contiguous.MIN_CAPACITY * 3):
+        queue.push(i)
+        queue.push(i)
+        queue.pop()
+    queue.dup()
+    assert queue.capacity() == contiguous.MIN_CAPACITY * 4
+    assert contents(queue)[:4] == [24, 24, 24, 25]
+
+
+# Read n, push n..1 to the stack 0 and move them to the queue. Rotate the
+# queue by moving its head to itself, move pairs to the port, and two values
+# of the port back to the stack 0. Then print each storage under OP_BRPOPs.
+BOUNCE_ASM = u'''
+        SEL 1
+        PUSHNUM
+L0:     DUP
+        BRZ L1
+        DUP
+        MOV 0
+        PUSH 1
+        SUB
+        JMP L0
+L1:     POP
+        SEL 0
+L2:     BRPOP1 L3
+        MOV 21
+        JMP L2
+L3:     SEL 21
+        BRPOP1 L5
+        MOV 21
+L4:     BRPOP2 L5
+        MOV 27
+        JMP L4
+L5:     SEL 27
+        BRPOP2 L6
+        MOV 0
+        MOV 0
+L6:     BRPOP1 L7
+        POPNUM
+        JMP L6
+L7:     SEL 21
+L8:     BRPOP1 L9
+        POPNUM
+        JMP L8
+L9:     SEL 0
+L10:    BRPOP2 L11
+        POPNUM
+        JMP L10
+L11:    BRPOP1 L12
+        POPNUM
+L12:    HALT
+'''
+
+
+@pytest.mark.parametrize(('count', 'expected'), [
+    (0, b''),
+    (1, b'1'),
+    (2, b'21'),
+    (3, b'123'),
+    (5, b'32145'),
+])
+def test_sizes_follow_moves_between_storages(count, expected):
+    stdin = b'%d\n' % count
+    for opt in (0, 1, 2, 3):
+        assert api.run(BOUNCE_ASM, stdin, opt=opt, source='asm') == (expected, 0)
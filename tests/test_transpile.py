@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from aheui import compile
+from aheui import transpile
+from aheui._compat import bigint
+
+
+def run(code, level=2):
+    compiler = compile.Compiler()
+    compiler.compile(code)
+    if level == 1:
+        compiler.optimize1()
+    elif level == 2:
+        compiler.optimize2()
+    outputs = []
+
+    def write_number(value_str):
+        outputs.append(value_str.decode('utf-8'))
+
+    def write_utf8(value):
+        outputs.append(chr(value))
+
+    main = transpile.build(compiler.lines, compiler.label_map)
+    exitcode = main(write_number, write_utf8, None, None, bigint.str)
+    return u''.join(outputs), exitcode
+
+
+def test_transpile_arithmetic():
+    for level in [0, 1, 2]:
+        assert run(u'반반나망반반타망반반라망희', level) == (u'100', 0)
+
+
+def test_transpile_exitcode():
+    for level in [0, 1, 2]:
+        assert run(u'밣희', level) == (u'', 8)
+        assert run(u'밣상희', level) == (u'', 0)
+
+
+def test_transpile_storages():
+    # queue: operands are taken from the head
+    assert run(u'상반발타망희') == (u'3', 0)
+    # port: duplicate pushes the last pushed value again
+    assert run(u'샇반발빠망망망희') == (u'552', 0)
+
+
+def test_transpile_loop():
+    compiler = compile.Compiler()
+    compiler.read_asm(u'''PUSH 0
+PUSH 10
+loop: DUP
+BRZ end
+DUP
+MOV 1
+SWAP
+SEL 1
+MOV 0
+SEL 0
+ADD
+SWAP
+PUSH 1
+SUB
+JMP loop
+end: POP
+POPNUM
+HALT
+''')
+    outputs = []
+    main = transpile.build(compiler.lines, compiler.label_map)
+    exitcode = main(outputs.append, None, None, None, bigint.str)
+    assert (outputs, exitcode) == ([b'55'], 0)